@@ -0,0 +1,34 @@
+"""native uuid team_id
+
+Revision ID: 003
+Revises: 002
+Create Date: 2024-02-15 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # 16-byte native keys instead of 36-character varchar; ix_teams_team_id is rebuilt by the ALTER
+    op.alter_column('teams', 'team_id',
+                    existing_type=sa.String(),
+                    type_=postgresql.UUID(as_uuid=True),
+                    postgresql_using='team_id::uuid',
+                    existing_nullable=True)
+
+
+def downgrade() -> None:
+    op.alter_column('teams', 'team_id',
+                    existing_type=postgresql.UUID(as_uuid=True),
+                    type_=sa.String(),
+                    postgresql_using='team_id::text',
+                    existing_nullable=True)
@@ -0,0 +1,29 @@
+"""stamp teams with their insert time
+
+Revision ID: 004
+Revises: 003
+Create Date: 2024-03-15 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # now() is the transaction start; the change feed needs created_at in insert order
+    op.alter_column('teams', 'created_at',
+                    existing_type=sa.DateTime(timezone=True),
+                    server_default=sa.text('clock_timestamp()'))
+
+
+def downgrade() -> None:
+    op.alter_column('teams', 'created_at',
+                    existing_type=sa.DateTime(timezone=True),
+                    server_default=sa.text('now()'))
@@ -0,0 +1,53 @@
+"""create team digest buckets
+
+Revision ID: 005
+Revises: 004
+Create Date: 2024-04-01 10:00:00.000000
+
+"""
+import hashlib
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+# Must match app.digest
+DIGEST_BUCKET_DEPTH = 3
+BACKFILL_BATCH_SIZE = 5000
+
+
+def upgrade() -> None:
+    buckets = op.create_table('team_digest_buckets',
+    sa.Column('prefix', sa.String(), nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.Column('hash', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('prefix')
+    )
+    
+    # Existing teams are hashed once here; from now on every insert keeps its bucket up to date
+    totals = {}
+    result = op.get_bind().execute(
+        sa.text("SELECT team_id FROM teams").execution_options(yield_per=BACKFILL_BATCH_SIZE)
+    )
+    for (team_id,) in result:
+        # Canonical dashed form, however the driver returns the column
+        team_id = str(uuid.UUID(str(team_id)))
+        bucket = totals.setdefault(team_id[:DIGEST_BUCKET_DEPTH], [0, 0])
+        bucket[0] += 1
+        bucket[1] ^= int.from_bytes(hashlib.blake2b(team_id.encode(), digest_size=8).digest(), "big")
+    if totals:
+        op.bulk_insert(buckets, [
+            {"prefix": prefix, "count": count, "hash": value - (1 << 64) if value >= 1 << 63 else value}
+            for prefix, (count, value) in sorted(totals.items())
+        ])
+
+
+def downgrade() -> None:
+    op.drop_table('team_digest_buckets')
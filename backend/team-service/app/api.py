@@ -1,43 +1,238 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from typing import AsyncIterator, Iterator, List, Optional, Tuple, Union
+import json
 import logging
 
-from .database import get_db
-from .models import Team
-from .schemas import TeamCreate, TeamResponse
-from .events import publish_team_registered
+from .database import get_db, run_db
+from .models import Team, OutboxEvent
+from .schemas import TeamCreate, TeamBulkCreate, TeamResponse, TeamChanges, EventResponse, DigestBucket
+from .digest import MAX_PREFIX_LENGTH, record_team_digests, team_digests, uuid_range
+from .events import team_registered_event
+from .outbox import OUTBOX_RETENTION, add_outbox_event, add_outbox_events, notify_outbox_relay
+from .changes import CHANGES_PAGE_SIZE, lock_change_feed
+from .serialization import dump_json, dump_rows
+from .stream import StreamFull, get_broadcaster, sse_messages
+from .versions import bump_version, cached_response, collection_etag, etag_matches, json_response, not_modified
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+def _create_team(db: Session, team: TeamCreate) -> Team:
+    # Create new team
+    db_team = Team(name=team.name)
+    db.add(db_team)
+    lock_change_feed(db, "teams")
+    db.flush()
+    
+    # Stage TeamRegistered event and the digest update in the same transaction as the team row
+    add_outbox_event(db, team_registered_event(db_team.to_dict()))
+    record_team_digests(db, [str(db_team.team_id)])
+    db.commit()
+    db.refresh(db_team)
+    
+    logger.info(f"Created team: {db_team.name} with ID: {db_team.team_id}")
+    return db_team
+
+def _create_teams_bulk(db: Session, names: List[str]) -> List[dict]:
+    # One multi-row INSERT ... RETURNING inside a single transaction; insertmanyvalues
+    # batches may return rows in any order unless asked to sort them back into input order
+    lock_change_feed(db, "teams")
+    db_teams = db.scalars(
+        insert(Team).returning(Team, sort_by_parameter_order=True),
+        [{"name": name} for name in names]
+    ).all()
+    # Snapshot before commit so expired attributes don't trigger a refresh per row
+    teams_data = [db_team.to_dict() for db_team in db_teams]
+    
+    # Stage all TeamRegistered events and digest updates in the same transaction
+    add_outbox_events(db, [team_registered_event(team_data) for team_data in teams_data])
+    record_team_digests(db, [team_data["team_id"] for team_data in teams_data])
+    db.commit()
+    
+    logger.info(f"Created {len(teams_data)} teams in bulk")
+    return teams_data
+
+# Rows fetched per round trip when streaming the whole table
+STREAM_BATCH_SIZE = 1000
+
+# TeamResponse fields in order, selected as plain tuples for the list fast path
+TEAM_COLUMNS = (Team.id, Team.team_id, Team.name, Team.created_at)
+
+def _get_teams(
+    db: Session,
+    after: Optional[int],
+    limit: Optional[int],
+    team_id_prefix: Optional[str] = None
+) -> Tuple[bytes, Optional[int]]:
+    # Keyset pagination on the primary key: each page is an index range scan from the cursor
+    query = select(*TEAM_COLUMNS).order_by(Team.id)
+    if team_id_prefix:
+        low, high = uuid_range(team_id_prefix)
+        query = query.where(Team.team_id.between(low, high))
+    if after is not None:
+        query = query.where(Team.id > after)
+    if limit is None:
+        teams = db.execute(query).all()
+        next_cursor = None
+    else:
+        # Fetch one extra row to learn whether another page exists
+        teams = db.execute(query.limit(limit + 1)).all()
+        next_cursor = teams[limit - 1].id if len(teams) > limit else None
+        teams = teams[:limit]
+    logger.info(f"Retrieved {len(teams)} teams")
+    return dump_rows(teams), next_cursor
+
+def _get_team_changes(db: Session, since: int, limit: int) -> bytes:
+    # The primary key is the change token, so a poll is an index range scan from it. Writers commit
+    # ids in order under the change feed lock, so no lower id can still turn up behind the token
+    rows = db.execute(select(*TEAM_COLUMNS).where(Team.id > since).order_by(Team.id).limit(limit)).all()
+    token = rows[-1].id if rows else since
+    has_more = len(rows) == limit
+    return dump_json({"items": [row._asdict() for row in rows], "token": token, "has_more": has_more})
+
+def _iter_teams_ndjson(db: Session) -> Iterator[str]:
+    # yield_per streams through a server-side cursor instead of loading the table
+    for team in db.query(Team).order_by(Team.id).yield_per(STREAM_BATCH_SIZE):
+        yield TeamResponse.model_validate(team).model_dump_json() + "\n"
+
+async def _aiter_teams_ndjson(db: AsyncSession) -> AsyncIterator[str]:
+    teams = await db.stream_scalars(
+        select(Team).order_by(Team.id).execution_options(yield_per=STREAM_BATCH_SIZE)
+    )
+    async for team in teams:
+        yield TeamResponse.model_validate(team).model_dump_json() + "\n"
+
 @router.post("/teams", response_model=TeamResponse)
-def create_team(team: TeamCreate, db: Session = Depends(get_db)):
+async def create_team(team: TeamCreate, db: Union[Session, AsyncSession] = Depends(get_db)):
     try:
-        # Create new team
-        db_team = Team(name=team.name)
-        db.add(db_team)
-        db.commit()
-        db.refresh(db_team)
-        
-        logger.info(f"Created team: {db_team.name} with ID: {db_team.team_id}")
-        
-        # Publish TeamRegistered event
-        team_data = db_team.to_dict()
-        publish_team_registered(team_data)
-        
+        db_team = await run_db(db, _create_team, team)
+        bump_version("teams")
+        notify_outbox_relay()
         return db_team
     except Exception as e:
-        db.rollback()
         logger.error(f"Failed to create team: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to create team")
 
+@router.post("/teams/bulk", response_model=List[TeamResponse])
+async def create_teams_bulk(teams: TeamBulkCreate, db: Union[Session, AsyncSession] = Depends(get_db)):
+    try:
+        teams_data = await run_db(db, _create_teams_bulk, teams.names)
+        bump_version("teams")
+        notify_outbox_relay()
+        return teams_data
+    except Exception as e:
+        logger.error(f"Failed to create teams in bulk: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to create teams")
+
+@router.get("/teams/digest", response_model=List[DigestBucket])
+async def get_teams_digest(
+    prefix: str = Query("", pattern=f"^[0-9a-f]{{0,{MAX_PREFIX_LENGTH - 1}}}$"),
+    db: Union[Session, AsyncSession] = Depends(get_db)
+):
+    # Count and hash of team_ids in each of the 16 child ranges of prefix, for anti-entropy checks
+    try:
+        return await run_db(db, team_digests, prefix)
+    except Exception as e:
+        logger.error(f"Failed to compute team digest: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to compute team digest")
+
+@router.get("/teams/changes", response_model=TeamChanges)
+async def get_team_changes(
+    since: int = Query(0, ge=0, description="Token returned by the previous poll; 0 starts from the beginning"),
+    limit: int = Query(CHANGES_PAGE_SIZE, ge=1, le=5000),
+    db: Union[Session, AsyncSession] = Depends(get_db)
+):
+    # Teams registered after the token, so clients refresh in O(delta) instead of reloading /teams
+    try:
+        body = await run_db(db, _get_team_changes, since, limit)
+        return Response(content=body, media_type="application/json")
+    except Exception as e:
+        logger.error(f"Failed to retrieve team changes: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve team changes")
+
 @router.get("/teams", response_model=List[TeamResponse])
-def get_teams(db: Session = Depends(get_db)):
+async def get_teams(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    after: Optional[int] = Query(None, description="Cursor returned in X-Next-Cursor by the previous page"),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    team_id_prefix: Optional[str] = Query(
+        None, pattern="^[0-9a-f]{1,8}$", description="Only teams whose team_id starts with this hex prefix"
+    ),
+    db: Union[Session, AsyncSession] = Depends(get_db)
+):
+    # Taken before the query, so a write racing with it only makes the ETag more conservative
+    etag = await collection_etag("teams")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    
+    if format == "ndjson":
+        # Full scan in constant memory, one JSON document per line
+        rows = _aiter_teams_ndjson(db) if isinstance(db, AsyncSession) else _iter_teams_ndjson(db)
+        return StreamingResponse(rows, media_type="application/x-ndjson", headers={"ETag": etag})
+    
+    cached = cached_response(request, etag)
+    if cached is not None:
+        return cached
+    
     try:
-        teams = db.query(Team).all()
-        logger.info(f"Retrieved {len(teams)} teams")
-        return teams
+        body, next_cursor = await run_db(db, _get_teams, after, limit, team_id_prefix)
+        headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else {}
+        return json_response(request, etag, body, headers)
     except Exception as e:
         logger.error(f"Failed to retrieve teams: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to retrieve teams")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to retrieve teams")
+
+def _get_events(db: Session, after: int, limit: int) -> Tuple[List[dict], Optional[int], Optional[int]]:
+    # The outbox id is the event's sequence number, so a replay is a primary key range scan
+    rows = (
+        db.query(OutboxEvent.id, OutboxEvent.payload)
+        .filter(OutboxEvent.id > after)
+        .order_by(OutboxEvent.id)
+        .limit(limit + 1)
+        .all()
+    )
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    events = [{"sequence": row.id, **json.loads(row.payload)} for row in rows[:limit]]
+    # Outbox ids commit out of order, so a sequence below the oldest logged one may still be in flight;
+    # only ones old enough to have fallen out of the retention window can have been pruned
+    oldest, newest = db.query(func.min(OutboxEvent.id), func.max(OutboxEvent.id)).one()
+    log_start = None if oldest is None else min(oldest, max(newest - OUTBOX_RETENTION + 1, 1))
+    return events, next_cursor, log_start
+
+@router.get("/events", response_model=List[EventResponse])
+async def get_events(
+    response: Response,
+    after: int = Query(0, ge=0, description="Last sequence number the caller has already seen"),
+    limit: int = Query(500, ge=1, le=5000),
+    db: Union[Session, AsyncSession] = Depends(get_db)
+):
+    try:
+        events, next_cursor, log_start = await run_db(db, _get_events, after, limit)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = str(next_cursor)
+        if log_start is not None:
+            # Sequences below this have been pruned; a caller further behind must resync another way
+            response.headers["X-Log-Start"] = str(log_start)
+        return events
+    except Exception as e:
+        logger.error(f"Failed to retrieve events: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve events")
+
+@router.get("/stream/teams")
+async def stream_teams():
+    # Server-sent events pushed as registrations are published, instead of clients re-fetching /teams
+    broadcaster = get_broadcaster()
+    try:
+        client = broadcaster.subscribe()
+    except StreamFull:
+        raise HTTPException(status_code=503, detail="Too many stream clients")
+    return StreamingResponse(
+        sse_messages(broadcaster, client),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,49 +1,246 @@
+import os
 import zmq
-import json
+import msgpack
 import logging
+import queue
+import struct
+import threading
 import time
-from datetime import datetime
-from typing import Dict, Any
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional
+
+from .metrics import REGISTRY
 
 logger = logging.getLogger(__name__)
 
-class EventPublisher:
+# "queue" hands events to a background sender thread, "sync" sends inside the caller
+PUBLISHER_MODE = os.getenv("EVENT_PUBLISHER_MODE", "queue")
+PUBLISH_QUEUE_SIZE = int(os.getenv("EVENT_PUBLISH_QUEUE_SIZE", "10000"))
+# Set when running several workers: each one connects to the forwarder (see forwarder.py) instead of binding
+PUBLISH_CONNECT_ADDRESS = os.getenv("ZMQ_PUBLISH_CONNECT")
+PUBLISH_BIND_ADDRESS = os.getenv("ZMQ_PUBLISH_BIND", "tcp://0.0.0.0:5555")
+# Events are sharded by teamId into this many topic partitions; must match the tournament consumers
+EVENT_PARTITIONS = int(os.getenv("EVENT_PARTITIONS", "64"))
+
+# Wire format: [topic, header, payload] where the topic is "<event type>/<partition>",
+# the header packs (version, sequence number, event time in microseconds since the epoch)
+# and the payload is the msgpack-encoded event payload
+ENVELOPE_VERSION = 1
+ENVELOPE_HEADER = struct.Struct("!BQQ")
+# Longest a caller waiting for its events to leave the queue (the outbox relay) waits before giving up
+PUBLISH_WAIT_TIMEOUT_SECONDS = 30.0
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+EVENTS_PUBLISHED = REGISTRY.counter("events_published_total", "Events sent on the ZeroMQ socket")
+EVENTS_DROPPED = REGISTRY.counter("events_dropped_total", "Events dropped because the publish queue was full")
+EVENT_PUBLISH_SECONDS = REGISTRY.histogram(
+    "event_publish_duration_seconds", "Time from handing an event to the publisher until it is sent, queueing included"
+)
+
+def team_registered_event(team_data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "event": "TeamRegistered",
+        "payload": {
+            "teamId": team_data["team_id"],
+            "name": team_data["name"],
+            # The rest of the stored row, so stream clients can show it without fetching it
+            "id": team_data.get("id"),
+            "createdAt": team_data.get("created_at")
+        },
+        "timestamp": datetime.utcnow().isoformat() + "Z"
+    }
+
+def event_partition(event: Dict[str, Any], partitions: int = EVENT_PARTITIONS) -> int:
+    """Stable partition for an event, so every event about one team lands on the same consumer"""
+    team_id = event.get("payload", {}).get("teamId")
+    if not team_id:
+        return 0
+    return zlib.crc32(str(team_id).encode()) % partitions
+
+def event_topic(event: Dict[str, Any]) -> str:
+    """Topic frame consumers subscribe to: a prefix selects an event type, optionally narrowed to one shard"""
+    return f"{event['event']}/{event_partition(event):03d}"
+
+def event_time_us(event: Dict[str, Any]) -> int:
+    """Event time as integer microseconds since the epoch, taken from the ISO timestamp when present"""
+    timestamp = event.get("timestamp")
+    if timestamp:
+        moment = datetime.fromisoformat(timestamp.rstrip("Z")).replace(tzinfo=timezone.utc)
+    else:
+        moment = datetime.now(timezone.utc)
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+def encode_event(event: Dict[str, Any], sequence: int = 0) -> List[bytes]:
+    """Build the multipart envelope; sequence 0 marks an event that did not come from the outbox"""
+    return [
+        event_topic(event).encode(),
+        ENVELOPE_HEADER.pack(ENVELOPE_VERSION, sequence, event_time_us(event)),
+        msgpack.packb(event["payload"]),
+    ]
+
+class SendReceipt:
+    """Queued behind a batch of events; the sender sets it once every message before it went out"""
+    
     def __init__(self):
+        self.done = threading.Event()
+        self.failed = 0
+
+class EventPublisher:
+    def __init__(
+        self,
+        mode: Optional[str] = None,
+        queue_size: Optional[int] = None,
+        connect_address: Optional[str] = None
+    ):
         self.context = zmq.Context()
         self.socket = self.context.socket(zmq.PUB)
-        # Set high water mark to prevent message loss
-        self.socket.set_hwm(1000)
+        # Set high water mark to prevent message loss (raise it for large bulk imports)
+        self.socket.set_hwm(int(os.getenv("ZMQ_SNDHWM", "1000")))
         # Set linger time to ensure messages are sent
         self.socket.set(zmq.LINGER, 1000)
-        self.socket.bind("tcp://0.0.0.0:5555")
-        logger.info("ZeroMQ publisher bound to tcp://0.0.0.0:5555")
-        # Give ZeroMQ time to establish connections (important for slow joiners)
-        time.sleep(0.5)
+        connect_address = connect_address or PUBLISH_CONNECT_ADDRESS
+        if connect_address:
+            # Many publishers may connect to one forwarder, only a single process can bind the port
+            self.socket.connect(connect_address)
+            logger.info(f"ZeroMQ publisher connected to forwarder at {connect_address}")
+        else:
+            self.socket.bind(PUBLISH_BIND_ADDRESS)
+            logger.info(f"ZeroMQ publisher bound to {PUBLISH_BIND_ADDRESS}")
+        # No slow-joiner sleeps: subscribers that miss events catch up from GET /events by sequence number
+        
+        self.mode = mode or PUBLISHER_MODE
+        self._stats_lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+        self.send_latency_total = 0.0
+        self.send_latency_max = 0.0
+        self._queue = None
+        self._sender = None
+        if self.mode == "queue":
+            # The sender thread becomes the only user of the socket from here on
+            self._queue = queue.Queue(maxsize=queue_size or PUBLISH_QUEUE_SIZE)
+            self._sender = threading.Thread(target=self._drain, name="event-publisher", daemon=True)
+            self._sender.start()
+            logger.info(f"Event publisher running in queue mode (capacity {self._queue.maxsize})")
         self._initialized = True
     
-    def publish_team_registered(self, team_data: Dict[str, Any]):
-        event = {
-            "event": "TeamRegistered",
-            "payload": {
-                "teamId": team_data["team_id"],
-                "name": team_data["name"]
-            },
-            "timestamp": datetime.utcnow().isoformat() + "Z"
-        }
+    def _enqueue(self, frames: List[bytes], block: bool = False, receipt: Optional[SendReceipt] = None) -> bool:
+        try:
+            self._queue.put((frames, time.perf_counter(), receipt), block=block)
+            return True
+        except queue.Full:
+            with self._stats_lock:
+                self.dropped += 1
+            EVENTS_DROPPED.inc()
+            logger.warning("Event publish queue full, dropping event")
+            return False
+    
+    def _send(self, frames: List[bytes], enqueued_at: float):
+        self.socket.send_multipart(frames)
+        latency = time.perf_counter() - enqueued_at
+        with self._stats_lock:
+            self.published += 1
+            self.send_latency_total += latency
+            self.send_latency_max = max(self.send_latency_max, latency)
+        EVENTS_PUBLISHED.inc()
+        EVENT_PUBLISH_SECONDS.observe(latency)
+    
+    def _drain(self):
+        """Send queued events until the stop sentinel is received"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if isinstance(item, SendReceipt):
+                item.done.set()
+                continue
+            frames, enqueued_at, receipt = item
+            try:
+                self._send(frames, enqueued_at)
+            except Exception as e:
+                if receipt is not None:
+                    receipt.failed += 1
+                logger.error(f"Failed to send queued event: {str(e)}")
+    
+    def publish_event(self, event: Dict[str, Any], sequence: int = 0):
+        message = encode_event(event, sequence)
+        if self._queue is not None:
+            if self._enqueue(message):
+                logger.info(f"Queued {event['event']} event: {event}")
+            return
+        
+        self._send(message, time.perf_counter())
+        logger.info(f"Published {event['event']} event: {event}")
+    
+    def publish_events(
+        self,
+        events: List[Dict[str, Any]],
+        block: bool = False,
+        sequences: Optional[List[int]] = None,
+        wait: bool = False
+    ) -> bool:
+        """Publish a batch of events as a single burst
         
-        message = json.dumps(event)
-        # Small delay to ensure slow joiners can receive the message
-        time.sleep(0.01)
-        self.socket.send_string(message)
-        logger.info(f"Published TeamRegistered event: {event}")
+        With block=True a full queue applies backpressure instead of dropping,
+        which is what background callers such as the outbox relay want. With
+        wait=True the call only returns once the sender thread has handed
+        every event to the socket, and reports whether all of them were.
+        """
+        sequences = sequences or [0] * len(events)
+        messages = [encode_event(event, sequence) for event, sequence in zip(events, sequences)]
+        if self._queue is not None:
+            receipt = SendReceipt() if wait else None
+            queued = sum(1 for message in messages if self._enqueue(message, block=block, receipt=receipt))
+            logger.info(f"Queued {queued} of {len(messages)} events")
+            if receipt is None:
+                return queued == len(messages)
+            # The single sender sends in queue order, so reaching the receipt means the batch went out
+            self._queue.put(receipt)
+            if not receipt.done.wait(PUBLISH_WAIT_TIMEOUT_SECONDS):
+                logger.error(f"Timed out waiting for {len(messages)} queued events to be sent")
+                return False
+            return queued == len(messages) and receipt.failed == 0
+        
+        for message in messages:
+            self._send(message, time.perf_counter())
+        logger.info(f"Published {len(messages)} events")
+        return True
+    
+    def publish_team_registered(self, team_data: Dict[str, Any]):
+        self.publish_event(team_registered_event(team_data))
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            published = self.published
+            return {
+                "mode": self.mode,
+                "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+                "queue_capacity": self._queue.maxsize if self._queue is not None else 0,
+                "published": published,
+                "dropped": self.dropped,
+                "send_latency_avg_ms": (self.send_latency_total / published * 1000) if published else 0.0,
+                "send_latency_max_ms": self.send_latency_max * 1000,
+            }
     
     def close(self):
+        if self._sender is not None:
+            # Let the sender flush what is already queued before the socket goes away
+            self._queue.put(None)
+            self._sender.join(timeout=5)
         self.socket.close()
         self.context.term()
 
 # Global publisher instance
 _publisher = None
 
+REGISTRY.callback(
+    "event_publish_queue_depth",
+    "Events waiting in the publish queue",
+    "gauge",
+    lambda: _publisher.stats()["queue_depth"] if _publisher is not None else 0
+)
+
 def get_publisher():
     global _publisher
     if _publisher is None:
@@ -53,6 +250,12 @@ def get_publisher():
         logger.debug("Using existing ZeroMQ publisher instance")
     return _publisher
 
+def close_publisher():
+    global _publisher
+    if _publisher:
+        _publisher.close()
+        _publisher = None
+
 def publish_team_registered(team_data: Dict[str, Any]):
     publisher = get_publisher()
-    publisher.publish_team_registered(team_data)
\ No newline at end of file
+    publisher.publish_team_registered(team_data)
@@ -0,0 +1,76 @@
+import os
+import zmq
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Worker publishers connect their PUB sockets here (XSUB side)
+FORWARDER_FRONTEND = os.getenv("ZMQ_FORWARDER_FRONTEND", "tcp://127.0.0.1:5556")
+# Subscribers such as tournament-service connect here (XPUB side)
+FORWARDER_BACKEND = os.getenv("ZMQ_FORWARDER_BACKEND", "tcp://0.0.0.0:5555")
+
+class EventForwarder:
+    """XSUB/XPUB proxy that fans events from many worker publishers out to all subscribers
+    
+    Only the forwarder binds the public port, so any number of uvicorn workers
+    (or replicas sharing the host network) can publish by connecting to it.
+    Subscriptions travel upstream through the proxy, so PUB-side filtering
+    keeps working exactly as with a directly bound publisher.
+    """
+    
+    def __init__(self, frontend: Optional[str] = None, backend: Optional[str] = None):
+        self.frontend_address = frontend or FORWARDER_FRONTEND
+        self.backend_address = backend or FORWARDER_BACKEND
+        self.context = zmq.Context()
+        self.frontend = self.context.socket(zmq.XSUB)
+        self.frontend.set_hwm(int(os.getenv("ZMQ_SNDHWM", "1000")))
+        self.frontend.bind(self.frontend_address)
+        self.backend = self.context.socket(zmq.XPUB)
+        self.backend.set_hwm(int(os.getenv("ZMQ_SNDHWM", "1000")))
+        self.backend.bind(self.backend_address)
+        # Steering socket used to stop the proxy cleanly from another thread
+        self._control_address = f"inproc://forwarder-control-{id(self)}"
+        self.control = self.context.socket(zmq.PAIR)
+        self.control.bind(self._control_address)
+        self.thread = None
+        logger.info(f"ZeroMQ forwarder relaying {self.frontend_address} -> {self.backend_address}")
+    
+    def run(self):
+        """Relay messages until stop() is called; blocks the calling thread"""
+        control = self.context.socket(zmq.PAIR)
+        control.connect(self._control_address)
+        try:
+            zmq.proxy_steerable(self.frontend, self.backend, None, control)
+        finally:
+            control.close()
+            self.frontend.close()
+            self.backend.close()
+    
+    def start(self):
+        """Run the forwarder in a background thread"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="event-forwarder", daemon=True)
+            self.thread.start()
+            logger.info("Event forwarder started")
+    
+    def stop(self):
+        """Stop the proxy and release its ports"""
+        self.control.send(b"TERMINATE")
+        if self.thread:
+            self.thread.join()
+        self.control.close()
+        self.context.term()
+        logger.info("Event forwarder stopped")
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    forwarder = EventForwarder()
+    try:
+        forwarder.run()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 import logging
 import sys
 
 from .api import router
-from .database import create_tables
-from .events import get_publisher
+from .database import DB_ASYNC, create_tables, create_tables_async, get_pool_stats
+from .events import get_publisher, close_publisher
+from .metrics import REGISTRY, MetricsMiddleware, instrument_queries
+from .profiling import ProfilingMiddleware
+from .outbox import start_outbox_relay, stop_outbox_relay
+from .slow_queries import get_slow_query_log
+from .stream import get_broadcaster, start_event_stream, stop_event_stream
+from .versions import response_cache
 
 # Configure logging
 logging.basicConfig(
@@ -25,15 +32,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Log-Start", "ETag"],
 )
 
+# Per-route latency histograms and SQL timings for /metrics
+app.add_middleware(MetricsMiddleware)
+instrument_queries()
+
+# cProfile for requests sent with X-Profile, when PROFILING_ENABLED is set
+app.add_middleware(ProfilingMiddleware)
+
 # Include API router
 app.include_router(router)
 
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting Team Service...")
-    create_tables()
+    if DB_ASYNC:
+        await create_tables_async()
+    else:
+        create_tables()
     logger.info("Database tables created/verified")
     
     # Initialize ZeroMQ publisher at startup
@@ -43,7 +61,45 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Failed to initialize ZeroMQ publisher: {e}")
         raise
+    
+    # Start relaying committed outbox events to ZeroMQ
+    start_outbox_relay()
+    
+    # Push published events to connected /stream/teams clients
+    start_event_stream()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    logger.info("Shutting down Team Service...")
+    stop_event_stream()
+    stop_outbox_relay()
+    close_publisher()
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy", "service": "team-service"}
\ No newline at end of file
+    return {"status": "healthy", "service": "team-service"}
+
+@app.get("/publisher/stats")
+def publisher_stats():
+    return get_publisher().stats()
+
+@app.get("/pool/stats")
+def db_pool_stats():
+    return get_pool_stats()
+
+@app.get("/admin/slow-queries")
+def slow_queries(limit: int = 50):
+    slow_query_log = get_slow_query_log()
+    return {**slow_query_log.stats(), "queries": slow_query_log.entries(limit)}
+
+@app.get("/cache/stats")
+def cache_stats():
+    return response_cache.stats()
+
+@app.get("/stream/stats")
+def stream_stats():
+    return get_broadcaster().stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
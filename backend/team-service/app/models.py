@@ -1,23 +1,63 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, BigInteger, Integer, String, Text, DateTime, Index, Uuid
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql import func
+from sqlalchemy.sql.functions import FunctionElement
 from typing import Optional
 import uuid
 
 Base = declarative_base()
 
+class insert_time(FunctionElement):
+    """Time of the insert itself; now() would stamp every row with its transaction's start time"""
+    type = DateTime(timezone=True)
+    inherit_cache = True
+
+@compiles(insert_time)
+def _insert_time(element, compiler, **kw):
+    # CURRENT_TIMESTAMP is already per statement on SQLite
+    return "CURRENT_TIMESTAMP"
+
+@compiles(insert_time, "postgresql")
+def _insert_time_postgresql(element, compiler, **kw):
+    return "clock_timestamp()"
+
 class Team(Base):
     __tablename__ = "teams"
     
     id = Column(Integer, primary_key=True, index=True)
-    team_id = Column(String, unique=True, index=True, default=lambda: str(uuid.uuid4()))
+    team_id = Column(Uuid, unique=True, index=True, default=uuid.uuid4)  # Native UUID on PostgreSQL
     name = Column(String, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Stamped when the row is inserted, not when its transaction began
+    created_at = Column(DateTime(timezone=True), server_default=insert_time())
     
     def to_dict(self):
         return {
             "id": self.id,
-            "team_id": self.team_id,
+            "team_id": str(self.team_id) if self.team_id else None,
             "name": self.name,
             "created_at": self.created_at.isoformat() if self.created_at else None
-        }
\ No newline at end of file
+        }
+
+class OutboxEvent(Base):
+    """Event written in the same transaction as the row it describes, relayed to ZeroMQ later"""
+    __tablename__ = "outbox"
+    
+    id = Column(Integer, primary_key=True)
+    event_type = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)  # Serialized event envelope
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+    
+    __table_args__ = (
+        # Keeps the relay's "oldest unsent first" scan small however large the table grows
+        Index("ix_outbox_unsent", "id", postgresql_where=sent_at.is_(None)),
+    )
+
+class TeamDigestBucket(Base):
+    """Count and XOR hash of the team_ids starting with one fixed-length hex prefix, see app.digest"""
+    __tablename__ = "team_digest_buckets"
+    
+    prefix = Column(String, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+    hash = Column(BigInteger, nullable=False, default=0)  # Unsigned 64-bit hash stored two's complement
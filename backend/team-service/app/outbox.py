@@ -0,0 +1,176 @@
+import os
+import json
+import logging
+import threading
+import time
+from typing import Any, Dict, List
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+
+from .database import SessionLocal
+from .events import get_publisher
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL_SECONDS", "1.0"))
+# The outbox doubles as the sequence-numbered event log behind GET /events:
+# the newest OUTBOX_RETENTION events are kept for replay, older sent ones are pruned
+OUTBOX_RETENTION = int(os.getenv("OUTBOX_RETENTION", "100000"))
+OUTBOX_PRUNE_INTERVAL = float(os.getenv("OUTBOX_PRUNE_INTERVAL_SECONDS", "60"))
+
+def add_outbox_event(db: Session, event: Dict[str, Any]) -> OutboxEvent:
+    """Stage an event in the caller's transaction; it is only relayed once that commits"""
+    outbox_event = OutboxEvent(event_type=event["event"], payload=json.dumps(event))
+    db.add(outbox_event)
+    return outbox_event
+
+def add_outbox_events(db: Session, events: List[Dict[str, Any]]):
+    """Stage many events with a single multi-row INSERT"""
+    db.execute(
+        insert(OutboxEvent),
+        [{"event_type": event["event"], "payload": json.dumps(event)} for event in events]
+    )
+
+class OutboxRelay:
+    def __init__(
+        self,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        poll_interval: float = OUTBOX_POLL_INTERVAL,
+        retention: int = OUTBOX_RETENTION
+    ):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._last_prune = time.monotonic()
+        self.running = False
+        self.thread = None
+        self._wakeup = threading.Event()
+    
+    def start(self):
+        """Start the relay in a background thread"""
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name="outbox-relay", daemon=True)
+            self.thread.start()
+            logger.info("Outbox relay started")
+    
+    def stop(self):
+        """Stop the relay"""
+        self.running = False
+        self._wakeup.set()
+        if self.thread:
+            self.thread.join()
+        logger.info("Outbox relay stopped")
+    
+    def notify(self):
+        """Wake the relay up right away instead of waiting for the next poll"""
+        self._wakeup.set()
+    
+    def _run(self):
+        while self.running:
+            self._wakeup.clear()
+            try:
+                relayed = self.relay_batch()
+            except Exception as e:
+                logger.error(f"Error relaying outbox events: {str(e)}")
+                relayed = 0
+            if time.monotonic() - self._last_prune >= OUTBOX_PRUNE_INTERVAL:
+                self._last_prune = time.monotonic()
+                try:
+                    self.prune()
+                except Exception as e:
+                    logger.error(f"Error pruning outbox: {str(e)}")
+            # Keep draining while batches come back full, otherwise wait for work
+            if relayed < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+    
+    def relay_batch(self) -> int:
+        """Publish the oldest unsent events and mark them sent, returning how many were relayed"""
+        db = SessionLocal()
+        try:
+            # SKIP LOCKED lets several relays (one per worker) drain the table side by side
+            rows = (
+                db.query(OutboxEvent.id, OutboxEvent.payload)
+                .filter(OutboxEvent.sent_at.is_(None))
+                .order_by(OutboxEvent.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            if not rows:
+                return 0
+            
+            # The outbox id doubles as the event's sequence number on the wire. Rows are only marked
+            # sent once the sender thread has actually sent them, so a crash before that re-relays them
+            sent = get_publisher().publish_events(
+                [json.loads(row.payload) for row in rows],
+                block=True,
+                sequences=[row.id for row in rows],
+                wait=True
+            )
+            if not sent:
+                raise RuntimeError(f"Only part of a batch of {len(rows)} outbox events was sent, retrying it")
+            
+            db.query(OutboxEvent).filter(OutboxEvent.id.in_([row.id for row in rows])).update(
+                {OutboxEvent.sent_at: func.now()}, synchronize_session=False
+            )
+            db.commit()
+            logger.info(f"Relayed {len(rows)} outbox events")
+            return len(rows)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    
+    def prune(self) -> int:
+        """Delete sent events that have fallen out of the replay window"""
+        db = SessionLocal()
+        try:
+            newest = db.query(func.max(OutboxEvent.id)).scalar()
+            if newest is None:
+                return 0
+            deleted = (
+                db.query(OutboxEvent)
+                .filter(OutboxEvent.id <= newest - self.retention, OutboxEvent.sent_at.isnot(None))
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+            if deleted:
+                logger.info(f"Pruned {deleted} outbox events older than sequence {newest - self.retention}")
+            return deleted
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+# Global relay instance
+_relay = None
+
+def get_outbox_relay():
+    global _relay
+    if _relay is None:
+        _relay = OutboxRelay()
+    return _relay
+
+def start_outbox_relay():
+    """Start the outbox relay"""
+    relay = get_outbox_relay()
+    relay.start()
+
+def stop_outbox_relay():
+    """Stop the outbox relay"""
+    global _relay
+    if _relay:
+        _relay.stop()
+        _relay = None
+
+def notify_outbox_relay():
+    """Tell a running relay that new events were committed"""
+    if _relay:
+        _relay.notify()
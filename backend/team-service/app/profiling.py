@@ -0,0 +1,233 @@
+import io
+import os
+import re
+import time
+import uuid
+import pstats
+import cProfile
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Iterator, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# Requests sent with an X-Profile header are run under cProfile only when this is set
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+# Where X-Profile: file requests leave their .prof files (open with snakeviz or pstats)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+# Profiled requests allowed per process per minute; the rest are served unprofiled
+PROFILE_MAX_PER_MINUTE = int(os.getenv("PROFILE_MAX_PER_MINUTE", "6"))
+# Functions listed in an inline report, by cumulative time
+PROFILE_INLINE_LINES = 60
+
+# Streams never finish, so their profile would never be written
+UNPROFILED_PREFIXES = ("/stream/",)
+
+class RequestProfile:
+    """cProfile profilers for one request: one on the event loop and one per threadpool thread it used
+    
+    cProfile only sees the thread it was enabled on, so work handed to the
+    threadpool through run_db is profiled by a profiler of its own and the
+    results are merged when the request ends.
+    """
+    
+    def __init__(self):
+        self.thread_id = threading.get_ident()
+        self._lock = threading.Lock()
+        self._profilers: List[cProfile.Profile] = [cProfile.Profile()]
+    
+    def start(self):
+        self._profilers[0].enable()
+    
+    def stop(self):
+        self._profilers[0].disable()
+    
+    @contextmanager
+    def thread_section(self) -> Iterator[None]:
+        if threading.get_ident() == self.thread_id:
+            yield
+            return
+        profiler = cProfile.Profile()
+        with self._lock:
+            self._profilers.append(profiler)
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+    
+    def stats(self, stream: Optional[io.StringIO] = None) -> pstats.Stats:
+        with self._lock:
+            profilers = list(self._profilers)
+        stats = pstats.Stats(profilers[0], stream=stream)
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        return stats
+
+_active_profile: ContextVar[Optional[RequestProfile]] = ContextVar("active_profile", default=None)
+
+@contextmanager
+def profiled_section() -> Iterator[None]:
+    """Include the enclosed work in the current request's profile when it runs on another thread"""
+    profile = _active_profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.thread_section():
+        yield
+
+class ProfileRateLimiter:
+    """Sliding one-minute window of profiled requests"""
+    
+    def __init__(self, max_per_minute: int):
+        self.max_per_minute = max_per_minute
+        self._lock = threading.Lock()
+        self._started: Deque[float] = deque()
+    
+    def allow(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            while self._started and now - self._started[0] >= 60:
+                self._started.popleft()
+            if len(self._started) >= self.max_per_minute:
+                return False
+            self._started.append(now)
+            return True
+
+def _header(scope, name: bytes) -> str:
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+def _with_headers(message, headers):
+    return {**message, "headers": list(message.get("headers", [])) + headers}
+
+def profile_filename(method: str, path: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "_", path.strip("/"))[:80] or "root"
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}-{method}-{slug}.prof"
+
+class ProfilingMiddleware:
+    """Runs individual requests under cProfile on demand
+    
+    With PROFILING_ENABLED set, a request sent with "X-Profile: file" is
+    served as usual and its profile written to PROFILE_DIR, named in the
+    X-Profile-File response header. "X-Profile: inline" replaces the response
+    with a text report of the profile. Only one request per process is
+    profiled at a time, at most PROFILE_MAX_PER_MINUTE a minute; X-Profile-Status
+    says why a request was not. Other requests handled on the event loop
+    meanwhile show up in the profile too.
+    """
+    
+    def __init__(
+        self,
+        app,
+        enabled: Optional[bool] = None,
+        directory: Optional[str] = None,
+        max_per_minute: Optional[int] = None
+    ):
+        self.app = app
+        self.enabled = enabled if enabled is not None else PROFILING_ENABLED
+        self.directory = directory or PROFILE_DIR
+        self.limiter = ProfileRateLimiter(max_per_minute if max_per_minute is not None else PROFILE_MAX_PER_MINUTE)
+        self._busy = threading.Lock()
+    
+    async def __call__(self, scope, receive, send):
+        mode = _header(scope, b"x-profile").strip().lower() if scope["type"] == "http" and self.enabled else ""
+        if not mode:
+            await self.app(scope, receive, send)
+            return
+        
+        if scope["path"].startswith(UNPROFILED_PREFIXES):
+            skipped = "unsupported"
+        elif not self._busy.acquire(blocking=False):
+            skipped = "busy"
+        elif not self.limiter.allow():
+            self._busy.release()
+            skipped = "rate-limited"
+        else:
+            skipped = None
+        if skipped:
+            async def send_with_status(message):
+                if message["type"] == "http.response.start":
+                    message = _with_headers(message, [(b"x-profile-status", skipped.encode())])
+                await send(message)
+            
+            await self.app(scope, receive, send_with_status)
+            return
+        
+        try:
+            if mode == "inline":
+                await self._profile_inline(scope, receive, send)
+            else:
+                await self._profile_to_file(scope, receive, send)
+        finally:
+            self._busy.release()
+    
+    async def _run_profiled(self, scope, receive, send) -> RequestProfile:
+        profile = RequestProfile()
+        token = _active_profile.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profile.stop()
+            _active_profile.reset(token)
+        return profile
+    
+    async def _profile_to_file(self, scope, receive, send):
+        filename = profile_filename(scope["method"], scope["path"])
+        
+        async def send_with_filename(message):
+            if message["type"] == "http.response.start":
+                message = _with_headers(message, [
+                    (b"x-profile-status", b"file"),
+                    (b"x-profile-file", filename.encode()),
+                ])
+            await send(message)
+        
+        profile = await self._run_profiled(scope, receive, send_with_filename)
+        try:
+            await run_in_threadpool(self._dump, profile, filename)
+        except Exception as e:
+            logger.error(f"Failed to write profile {filename}: {str(e)}")
+    
+    def _dump(self, profile: RequestProfile, filename: str):
+        os.makedirs(self.directory, exist_ok=True)
+        profile.stats().dump_stats(os.path.join(self.directory, filename))
+        logger.info(f"Wrote profile of {filename} to {self.directory}")
+    
+    async def _profile_inline(self, scope, receive, send):
+        status = 500
+        
+        async def capture(message):
+            nonlocal status
+            # The real response is dropped; only its status is reported
+            if message["type"] == "http.response.start":
+                status = message["status"]
+        
+        started = time.perf_counter()
+        profile = await self._run_profiled(scope, receive, capture)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        
+        report = io.StringIO()
+        report.write(f"{scope['method']} {scope['path']} -> {status} in {elapsed_ms:.1f} ms\n\n")
+        profile.stats(stream=report).sort_stats("cumulative").print_stats(PROFILE_INLINE_LINES)
+        body = report.getvalue().encode()
+        
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+                (b"x-profile-status", b"inline"),
+                (b"x-profile-response-status", str(status).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
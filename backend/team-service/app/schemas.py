@@ -1,15 +1,35 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, Optional, List
+from uuid import UUID
 
 class TeamCreate(BaseModel):
     name: str
 
+class TeamBulkCreate(BaseModel):
+    names: List[str] = Field(..., min_length=1, max_length=10000)
+
 class TeamResponse(BaseModel):
     id: int
-    team_id: str
+    team_id: UUID
     name: str
     created_at: Optional[datetime] = None
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class TeamChanges(BaseModel):
+    items: List[TeamResponse]
+    token: int
+    has_more: bool
+
+class EventResponse(BaseModel):
+    sequence: int
+    event: str
+    payload: Dict[str, Any]
+    timestamp: Optional[str] = None
+
+class DigestBucket(BaseModel):
+    prefix: str
+    count: int
+    hash: str
\ No newline at end of file
@@ -0,0 +1,180 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+
+from .database import SessionLocal
+from .models import Team, TeamDigestBucket
+
+logger = logging.getLogger(__name__)
+
+# Serialized list responses kept in memory, one per distinct URL; 0 disables the cache
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "0"))
+# Counters only see this process's own writes, so each process re-reads a collection's high-water
+# mark at most this often before trusting its ETag; 0 trusts the local counter (single process only)
+ETAG_MAX_STALENESS_SECONDS = float(os.getenv("ETAG_MAX_STALENESS_SECONDS", "1"))
+
+# Tells this process's counters apart from those of a restarted or sibling worker
+INCARNATION = uuid.uuid4().hex[:8]
+
+class CollectionVersions:
+    """Per-process change counters for the collections behind the list endpoints
+    
+    Every write path bumps its collection, so an ETag built from the counters
+    changes whenever a list could have and a conditional GET is answered
+    without a query. Counters start at zero in every process, which is why
+    the ETag also carries the process incarnation.
+    """
+    
+    def __init__(self, max_staleness: Optional[float] = None):
+        self.max_staleness = max_staleness if max_staleness is not None else ETAG_MAX_STALENESS_SECONDS
+        self._lock = threading.Lock()
+        self._versions: Dict[str, int] = {}
+        self._watermarks: Dict[str, Callable[[], Any]] = {}
+        self._seen: Dict[str, Any] = {}
+        self._checked: Dict[str, float] = {}
+    
+    def bump(self, *names: str):
+        with self._lock:
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+    
+    def get(self, name: str) -> int:
+        return self._versions.get(name, 0)
+    
+    def register_watermark(self, name: str, watermark: Callable[[], Any]):
+        """Database check used to notice writes made by other processes"""
+        self._watermarks[name] = watermark
+    
+    def needs_refresh(self, names: Iterable[str]) -> bool:
+        if self.max_staleness <= 0:
+            return False
+        now = time.monotonic()
+        return any(
+            name in self._watermarks and now - self._checked.get(name, float("-inf")) >= self.max_staleness
+            for name in names
+        )
+    
+    def refresh(self, names: Iterable[str]):
+        """Bump every collection whose high-water mark moved since the last check; queries the database"""
+        for name in names:
+            watermark = self._watermarks.get(name)
+            if watermark is None:
+                continue
+            try:
+                mark = watermark()
+            except Exception as e:
+                # Without the mark nothing proves the list unchanged, so no 304 may be answered from it
+                logger.error(f"Failed to read the {name} high-water mark: {str(e)}")
+                self.bump(name)
+                continue
+            with self._lock:
+                self._checked[name] = time.monotonic()
+                changed = self._seen.get(name) != mark
+                self._seen[name] = mark
+            if changed:
+                self.bump(name)
+    
+    def etag(self, *names: str) -> str:
+        return '"' + "-".join([INCARNATION] + [str(self.get(name)) for name in names]) + '"'
+
+class ResponseCache:
+    """Small LRU of serialized list bodies, each valid only for the ETag it was built under"""
+    
+    def __init__(self, size: Optional[int] = None):
+        self.size = size if size is not None else RESPONSE_CACHE_SIZE
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[str, bytes, Dict[str, str]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+    
+    def get(self, key: str, etag: str) -> Optional[Tuple[bytes, Dict[str, str]]]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+    
+    def put(self, key: str, etag: str, body: bytes, headers: Dict[str, str]):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (etag, body, headers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"size": self.size, "entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+def _teams_watermark() -> Tuple[Any, ...]:
+    db = SessionLocal()
+    try:
+        # max(id) alone stays put when a lower id commits after a higher one was read. The digest bucket
+        # counts grow with every commit that adds teams, and summing them reads at most 4096 rows
+        total = select(func.sum(TeamDigestBucket.count)).scalar_subquery()
+        return tuple(db.execute(select(total, func.max(Team.id))).one())
+    finally:
+        db.close()
+
+collection_versions = CollectionVersions()
+collection_versions.register_watermark("teams", _teams_watermark)
+response_cache = ResponseCache()
+
+def bump_version(*names: str):
+    collection_versions.bump(*names)
+
+async def collection_etag(*names: str) -> str:
+    """Current ETag for the given collections, refreshing stale counters off the event loop"""
+    if collection_versions.needs_refresh(names):
+        await run_in_threadpool(collection_versions.refresh, names)
+    return collection_versions.etag(*names)
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match check using weak comparison, as RFC 9110 requires for GET"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or (candidate[2:] if candidate.startswith("W/") else candidate) == etag:
+            return True
+    return False
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+def _cache_key(request: Request) -> str:
+    return f"{request.url.path}?{request.url.query}"
+
+def cached_response(request: Request, etag: str) -> Optional[Response]:
+    entry = response_cache.get(_cache_key(request), etag)
+    if entry is None:
+        return None
+    body, headers = entry
+    return Response(content=body, media_type="application/json", headers={**headers, "ETag": etag})
+
+def json_response(request: Request, etag: str, body: bytes, headers: Dict[str, str]) -> Response:
+    """Send a serialized JSON list, keeping the body for later requests when the cache is enabled"""
+    response_cache.put(_cache_key(request), etag, body, headers)
+    return Response(content=body, media_type="application/json", headers={**headers, "ETag": etag})
@@ -0,0 +1,91 @@
+"""Measure the per-request cost of the /metrics instrumentation
+
+Times a minimal ASGI app with and without MetricsMiddleware, a raw histogram
+observation, and a trivial SQLite query with and without the cursor hooks:
+
+    docker-compose exec team-service python benchmarks/metrics_overhead.py
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+
+# Add the app directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.metrics import HTTP_REQUEST_SECONDS, MetricsMiddleware, instrument_queries
+from app.metrics import _after_cursor_execute, _before_cursor_execute
+
+class Route:
+    path = "/teams"
+
+async def bare_app(scope, receive, send):
+    scope["route"] = Route
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"[]"})
+
+async def receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+async def send(message):
+    pass
+
+async def time_requests(app, requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        await app({"type": "http", "method": "GET", "path": "/teams"}, receive, send)
+    return (time.perf_counter() - started) / requests
+
+def noop_listener(*args):
+    pass
+
+def time_queries(engine, queries: int) -> float:
+    with engine.connect() as conn:
+        for _ in range(1000):
+            conn.execute(text("SELECT 1")).scalar()
+        started = time.perf_counter()
+        for _ in range(queries):
+            conn.execute(text("SELECT 1")).scalar()
+        return (time.perf_counter() - started) / queries
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=50_000)
+    args = parser.parse_args()
+    
+    bare = asyncio.run(time_requests(bare_app, args.requests))
+    instrumented = asyncio.run(time_requests(MetricsMiddleware(bare_app), args.requests))
+    
+    started = time.perf_counter()
+    for _ in range(args.requests):
+        HTTP_REQUEST_SECONDS.observe(0.003, ("GET", "/teams", "200"))
+    observe = (time.perf_counter() - started) / args.requests
+    
+    engine = create_engine("sqlite://")
+    plain_query = time_queries(engine, args.queries)
+    # Listeners that do nothing isolate what SQLAlchemy charges for dispatching cursor events at all
+    event.listen(Engine, "before_cursor_execute", noop_listener)
+    event.listen(Engine, "after_cursor_execute", noop_listener)
+    noop_query = time_queries(engine, args.queries)
+    event.remove(Engine, "before_cursor_execute", noop_listener)
+    event.remove(Engine, "after_cursor_execute", noop_listener)
+    instrument_queries()
+    timed_query = time_queries(engine, args.queries)
+    event.remove(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.remove(Engine, "after_cursor_execute", _after_cursor_execute)
+    
+    print(f"{'measurement':<28} {'per call':>10}")
+    print(f"{'histogram observe':<28} {observe * 1e6:>7.2f} us")
+    print(f"{'request, bare app':<28} {bare * 1e6:>7.2f} us")
+    print(f"{'request, with middleware':<28} {instrumented * 1e6:>7.2f} us")
+    print(f"{'middleware overhead':<28} {(instrumented - bare) * 1e6:>7.2f} us")
+    print(f"{'SQLAlchemy event dispatch':<28} {(noop_query - plain_query) * 1e6:>7.2f} us")
+    print(f"{'query timing hooks':<28} {(timed_query - noop_query) * 1e6:>7.2f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Compare unique-index size and point-lookup latency of varchar vs native UUID keys
+
+Uses temporary tables, so it is safe to run against the compose database:
+
+    docker-compose exec team-service python benchmarks/uuid_keys.py --rows 200000
+"""
+import argparse
+import os
+import sys
+import time
+
+from sqlalchemy import text
+
+# Add the app directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.database import engine
+
+def measure(conn, table: str, keys, column_type: str):
+    index_size = conn.execute(text(f"SELECT pg_relation_size('{table}_key_idx')")).scalar()
+    started = time.perf_counter()
+    for key in keys:
+        conn.execute(text(f"SELECT id FROM {table} WHERE key = CAST(:key AS {column_type})"), {"key": key}).first()
+    elapsed = time.perf_counter() - started
+    return index_size, elapsed / len(keys) * 1_000_000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--lookups", type=int, default=2_000)
+    args = parser.parse_args()
+
+    with engine.connect() as conn:
+        conn.execute(text("CREATE TEMP TABLE bench_uuid (id serial PRIMARY KEY, key uuid NOT NULL)"))
+        conn.execute(text("CREATE TEMP TABLE bench_varchar (id serial PRIMARY KEY, key varchar NOT NULL)"))
+        conn.execute(text("INSERT INTO bench_uuid (key) SELECT gen_random_uuid() FROM generate_series(1, :rows)"), {"rows": args.rows})
+        conn.execute(text("INSERT INTO bench_varchar (key) SELECT key::text FROM bench_uuid ORDER BY id"))
+        conn.execute(text("CREATE UNIQUE INDEX bench_uuid_key_idx ON bench_uuid (key)"))
+        conn.execute(text("CREATE UNIQUE INDEX bench_varchar_key_idx ON bench_varchar (key)"))
+        conn.execute(text("ANALYZE bench_uuid"))
+        conn.execute(text("ANALYZE bench_varchar"))
+
+        keys = [str(row.key) for row in conn.execute(
+            text("SELECT key FROM bench_uuid ORDER BY random() LIMIT :n"), {"n": args.lookups}
+        )]
+
+        print(f"{args.rows} rows, {len(keys)} point lookups")
+        print(f"{'key type':<10} {'index size':>12} {'lookup':>10}")
+        for table, column_type in (("bench_varchar", "varchar"), ("bench_uuid", "uuid")):
+            index_size, lookup_us = measure(conn, table, keys, column_type)
+            print(f"{column_type:<10} {index_size / 1024 / 1024:>9.2f} MB {lookup_us:>7.1f} us")
+
+if __name__ == "__main__":
+    main()
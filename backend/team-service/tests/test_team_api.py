@@ -1,13 +1,18 @@
 import pytest
 from unittest.mock import Mock, patch
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, func
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
 import json
+import msgpack
+import time
 
 from app.main import app
 from app.database import get_db
-from app.models import Base, Team
+from app.models import Base, Team, OutboxEvent
+from app.outbox import OutboxRelay, add_outbox_event
 
 # Create test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
@@ -21,17 +26,33 @@ def override_get_db():
     finally:
         db.close()
 
+# Async stack against the same database; NullPool keeps connections off other tests' event loops
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
 app.dependency_overrides[get_db] = override_get_db
 
-@pytest.fixture
-def client():
+@pytest.fixture(params=["sync", "async"])
+def client(request):
+    # Run every API test against both the sync and the async database stack
+    app.dependency_overrides[get_db] = override_get_db if request.param == "sync" else override_get_async_db
     Base.metadata.create_all(bind=engine)
     with TestClient(app) as test_client:
         yield test_client
     Base.metadata.drop_all(bind=engine)
 
-@patch('app.events.publish_team_registered')
-def test_create_team(mock_publish, client):
+def get_outbox_events():
+    db = TestingSessionLocal()
+    try:
+        return [json.loads(row.payload) for row in db.query(OutboxEvent).order_by(OutboxEvent.id)]
+    finally:
+        db.close()
+
+def test_create_team(client):
     """Test creating a team"""
     team_data = {"name": "Helsinki FC"}
     
@@ -43,10 +64,13 @@ def test_create_team(mock_publish, client):
     assert "team_id" in data
     assert "created_at" in data
     
-    # Verify event publishing was called
-    mock_publish.assert_called_once()
-    call_args = mock_publish.call_args[0][0]
-    assert call_args["name"] == "Helsinki FC"
+    # Verify TeamRegistered event was written to the outbox
+    events = get_outbox_events()
+    assert len(events) == 1
+    assert events[0]["event"] == "TeamRegistered"
+    assert events[0]["payload"] == {
+        "teamId": data["team_id"], "name": "Helsinki FC", "id": data["id"], "createdAt": data["created_at"]
+    }
 
 def test_get_teams_empty(client):
     """Test getting teams when none exist"""
@@ -68,8 +92,7 @@ def test_get_teams_with_data(mock_publish, client):
     assert len(teams) == 1
     assert teams[0]["name"] == "Oulu FC"
 
-@patch('app.events.publish_team_registered')
-def test_create_multiple_teams(mock_publish, client):
+def test_create_multiple_teams(client):
     """Test creating multiple teams"""
     teams = [{"name": "Team A"}, {"name": "Team B"}]
     
@@ -86,5 +109,633 @@ def test_create_multiple_teams(mock_publish, client):
     assert "Team A" in team_names
     assert "Team B" in team_names
     
-    # Verify event publishing was called twice
-    assert mock_publish.call_count == 2
\ No newline at end of file
+    # Verify one outbox event per team
+    assert len(get_outbox_events()) == 2
+def test_create_teams_bulk(client):
+    """Test registering many teams in one request"""
+    names = [f"League Team {i}" for i in range(50)]
+    
+    response = client.post("/teams/bulk", json={"names": names})
+    
+    assert response.status_code == 200
+    data = response.json()
+    assert [t["name"] for t in data] == names
+    assert len({t["team_id"] for t in data}) == 50
+    
+    # All events are staged in the same transaction
+    events = get_outbox_events()
+    assert [e["payload"]["name"] for e in events] == names
+    
+    response = client.get("/teams")
+    assert len(response.json()) == 50
+
+def test_create_teams_bulk_rejects_empty(client):
+    """Test bulk registration requires at least one team"""
+    response = client.post("/teams/bulk", json={"names": []})
+    assert response.status_code == 422
+
+def test_publisher_queue_mode(client):
+    """Test queued events are sent off the request path and counted"""
+    from app.events import get_publisher
+    
+    publisher = get_publisher()
+    assert publisher.mode == "queue"
+    publisher.publish_team_registered({"team_id": "queued-team", "name": "Queue FC"})
+    
+    for _ in range(100):
+        if publisher.stats()["published"] >= 1:
+            break
+        time.sleep(0.01)
+    
+    stats = client.get("/publisher/stats").json()
+    assert stats["published"] >= 1
+    assert stats["dropped"] == 0
+    assert stats["queue_capacity"] > 0
+
+def test_outbox_relay_publishes_and_marks_sent():
+    """Test the relay drains unsent outbox events in order"""
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        for name in ["Relay A", "Relay B"]:
+            db.add(OutboxEvent(event_type="TeamRegistered", payload=json.dumps({
+                "event": "TeamRegistered",
+                "payload": {"teamId": name.lower(), "name": name},
+                "timestamp": "2024-01-01T10:00:00Z"
+            })))
+        db.commit()
+        db.close()
+        
+        publisher = Mock()
+        with patch('app.outbox.SessionLocal', TestingSessionLocal):
+            with patch('app.outbox.get_publisher', return_value=publisher):
+                relay = OutboxRelay(batch_size=10)
+                assert relay.relay_batch() == 2
+                # Nothing left to send on the next pass
+                assert relay.relay_batch() == 0
+        
+        publisher.publish_events.assert_called_once()
+        published = publisher.publish_events.call_args[0][0]
+        assert [e["payload"]["name"] for e in published] == ["Relay A", "Relay B"]
+        # Outbox ids travel as the envelope sequence numbers
+        assert publisher.publish_events.call_args[1]["sequences"] == [1, 2]
+        
+        db = TestingSessionLocal()
+        assert db.query(OutboxEvent).filter(OutboxEvent.sent_at.is_(None)).count() == 0
+        db.close()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+def test_outbox_rows_stay_unsent_until_the_sender_sends_them():
+    """Test queued relay batches are only reported sent once the sender thread has sent them"""
+    from app.events import get_publisher
+    
+    publisher = get_publisher()
+    event = {"event": "TeamRegistered", "payload": {"teamId": "wait-team", "name": "Wait FC"}}
+    published = publisher.stats()["published"]
+    assert publisher.publish_events([event], block=True, sequences=[7], wait=True) is True
+    # The count is updated by the sender before it reaches the receipt
+    assert publisher.stats()["published"] == published + 1
+    
+    Base.metadata.create_all(bind=engine)
+    try:
+        db = TestingSessionLocal()
+        db.add(OutboxEvent(event_type="TeamRegistered", payload=json.dumps(event)))
+        db.commit()
+        db.close()
+        
+        failing_send = patch.object(publisher, "_send", side_effect=OSError("socket gone"))
+        with patch('app.outbox.SessionLocal', TestingSessionLocal), failing_send:
+            with pytest.raises(RuntimeError):
+                OutboxRelay(batch_size=10).relay_batch()
+        
+        db = TestingSessionLocal()
+        assert db.query(OutboxEvent).filter(OutboxEvent.sent_at.is_(None)).count() == 1
+        db.close()
+        
+        with patch('app.outbox.SessionLocal', TestingSessionLocal):
+            assert OutboxRelay(batch_size=10).relay_batch() == 1
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+def test_encode_event_envelope():
+    """Test events are framed as topic, binary header and msgpack payload"""
+    from app.events import ENVELOPE_HEADER, ENVELOPE_VERSION, encode_event, event_partition
+    
+    event = {
+        "event": "TeamRegistered",
+        "payload": {"teamId": "envelope-team", "name": "Envelope FC"},
+        "timestamp": "2024-01-01T10:00:00.000001Z"
+    }
+    topic, header, payload = encode_event(event, sequence=42)
+    
+    assert topic == f"TeamRegistered/{event_partition(event):03d}".encode()
+    assert ENVELOPE_HEADER.unpack(header) == (ENVELOPE_VERSION, 42, 1704103200000001)
+    assert msgpack.unpackb(payload) == event["payload"]
+
+def test_forwarder_relays_events_from_several_publishers():
+    """Test worker publishers connected to the forwarder reach a single subscriber"""
+    import zmq
+    from app.events import EventPublisher
+    from app.forwarder import EventForwarder
+    
+    forwarder = EventForwarder(frontend="tcp://127.0.0.1:15556", backend="tcp://127.0.0.1:15555")
+    forwarder.start()
+    context = zmq.Context()
+    subscriber = context.socket(zmq.SUB)
+    subscriber.connect("tcp://127.0.0.1:15555")
+    subscriber.setsockopt_string(zmq.SUBSCRIBE, "")
+    workers = [EventPublisher(mode="sync", connect_address="tcp://127.0.0.1:15556") for _ in range(2)]
+    # Publishers no longer wait for slow joiners themselves
+    time.sleep(0.5)
+    
+    try:
+        for index, worker in enumerate(workers):
+            worker.publish_team_registered({"team_id": f"worker-{index}", "name": f"Worker {index} FC"})
+        
+        received = set()
+        while len(received) < 2 and subscriber.poll(2000):
+            topic, header, payload = subscriber.recv_multipart()
+            received.add(msgpack.unpackb(payload)["teamId"])
+        assert received == {"worker-0", "worker-1"}
+    finally:
+        for worker in workers:
+            worker.close()
+        subscriber.close()
+        context.term()
+        forwarder.stop()
+
+def test_get_teams_keyset_pagination(client):
+    """Test paging through teams with limit and the X-Next-Cursor cursor"""
+    names = [f"Page Team {i}" for i in range(5)]
+    client.post("/teams/bulk", json={"names": names})
+    
+    seen = []
+    response = client.get("/teams", params={"limit": 2})
+    while True:
+        assert response.status_code == 200
+        seen.extend(t["name"] for t in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        response = client.get("/teams", params={"limit": 2, "after": cursor})
+    
+    assert seen == names
+
+def test_get_teams_ndjson_stream(client):
+    """Test streaming all teams as NDJSON"""
+    names = [f"Stream Team {i}" for i in range(3)]
+    client.post("/teams/bulk", json={"names": names})
+    
+    response = client.get("/teams", params={"format": "ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [t["name"] for t in lines] == names
+
+
+def test_get_events_replays_by_sequence(client):
+    """Test the event log is paged by sequence number"""
+    client.post("/teams/bulk", json={"names": ["Seq A", "Seq B", "Seq C"]})
+    
+    response = client.get("/events?after=0&limit=2")
+    assert response.status_code == 200
+    events = response.json()
+    assert [e["payload"]["name"] for e in events] == ["Seq A", "Seq B"]
+    assert events[0]["event"] == "TeamRegistered"
+    assert response.headers["X-Log-Start"] == str(events[0]["sequence"])
+    
+    response = client.get(f"/events?after={response.headers['X-Next-Cursor']}&limit=2")
+    assert [e["payload"]["name"] for e in response.json()] == ["Seq C"]
+    assert "X-Next-Cursor" not in response.headers
+
+def test_event_log_start_stays_below_unpruned_holes(client):
+    """Test X-Log-Start only moves past sequences old enough to have been pruned"""
+    client.post("/teams/bulk", json={"names": ["Hole A", "Hole B", "Hole C"]})
+    
+    # The first event is missing, as if its transaction had not committed yet
+    db = TestingSessionLocal()
+    db.query(OutboxEvent).filter(OutboxEvent.id == db.query(func.min(OutboxEvent.id)).scalar_subquery()).delete(
+        synchronize_session=False
+    )
+    db.commit()
+    db.close()
+    
+    response = client.get("/events?after=0")
+    assert len(response.json()) == 2
+    assert response.headers["X-Log-Start"] == "1"
+    
+    with patch('app.api.OUTBOX_RETENTION', 1):
+        response = client.get("/events?after=0")
+    assert response.headers["X-Log-Start"] == str(response.json()[0]["sequence"])
+
+def test_outbox_relay_prunes_beyond_retention():
+    """Test only sent events outside the retention window are pruned"""
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        for i in range(5):
+            db.add(OutboxEvent(event_type="TeamRegistered", payload="{}", sent_at=None if i == 0 else func.now()))
+        db.commit()
+        db.close()
+        
+        with patch('app.outbox.SessionLocal', TestingSessionLocal):
+            assert OutboxRelay(retention=2).prune() == 2
+        
+        db = TestingSessionLocal()
+        # The unsent event is kept even though it is old
+        assert [row.id for row in db.query(OutboxEvent).order_by(OutboxEvent.id)] == [1, 4, 5]
+        db.close()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+def test_teams_digest_and_prefix_filter(client):
+    """Test range digests cover every team and a mismatching range can be fetched on its own"""
+    from app.digest import team_hash
+    
+    teams = client.post("/teams/bulk", json={"names": [f"Digest {i}" for i in range(40)]}).json()
+    
+    buckets = client.get("/teams/digest").json()
+    assert [b["prefix"] for b in buckets] == list("0123456789abcdef")
+    assert sum(b["count"] for b in buckets) == 40
+    
+    bucket = next(b for b in buckets if b["count"])
+    in_bucket = [t["team_id"] for t in teams if t["team_id"].startswith(bucket["prefix"])]
+    expected_hash = 0
+    for team_id in in_bucket:
+        expected_hash ^= team_hash(team_id)
+    assert bucket["hash"] == f"{expected_hash:016x}"
+    
+    # Recursing one level splits the bucket further
+    children = client.get(f"/teams/digest?prefix={bucket['prefix']}").json()
+    assert sum(b["count"] for b in children) == bucket["count"]
+    
+    response = client.get(f"/teams?team_id_prefix={bucket['prefix']}")
+    assert sorted(t["team_id"] for t in response.json()) == sorted(in_bucket)
+
+def test_teams_digest_buckets_are_kept_up_to_date(client):
+    """Test digests added up from the stored buckets match hashing every team, without scanning teams"""
+    from app.digest import bucket_digests
+    
+    team_ids = []
+    for batch in range(3):
+        teams = client.post("/teams/bulk", json={"names": [f"Bucket {batch}-{i}" for i in range(300)]}).json()
+        team_ids += [t["team_id"] for t in teams]
+    team_ids.append(client.post("/teams", json={"name": "Bucket Single"}).json()["team_id"])
+    
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    for target in (engine, async_engine.sync_engine):
+        event.listen(target, "before_cursor_execute", record)
+    try:
+        shallow = {prefix: client.get("/teams/digest", params={"prefix": prefix}).json() for prefix in ("", team_ids[0][:2])}
+    finally:
+        for target in (engine, async_engine.sync_engine):
+            event.remove(target, "before_cursor_execute", record)
+    assert statements
+    assert not any("FROM teams" in statement for statement in statements)
+    
+    deep = team_ids[0][:4]
+    for prefix, buckets in {**shallow, deep: client.get("/teams/digest", params={"prefix": deep}).json()}.items():
+        assert buckets == bucket_digests((t for t in team_ids if t.startswith(prefix)), prefix)
+
+def test_get_teams_conditional_get(client):
+    """Test an unchanged team list is answered with 304 without querying"""
+    client.post("/teams", json={"name": "ETag FC"})
+    
+    response = client.get("/teams")
+    etag = response.headers["ETag"]
+    
+    with patch('app.api._get_teams') as mock_get_teams:
+        response = client.get("/teams", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        mock_get_teams.assert_not_called()
+    
+    # A new registration changes the version, so the old ETag no longer matches
+    client.post("/teams/bulk", json={"names": ["ETag United"]})
+    response = client.get("/teams", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.json()) == 2
+
+def test_get_teams_etag_notices_other_process_writes(client):
+    """Test a team registered by another worker process invalidates this worker's ETag within the staleness bound"""
+    import os
+    import sys
+    import subprocess
+    from app.versions import CollectionVersions, _teams_watermark
+    
+    other_worker = (
+        "from sqlalchemy import create_engine\n"
+        "from sqlalchemy.orm import Session\n"
+        "from app.models import Team\n"
+        "with Session(create_engine('sqlite:///./test.db')) as db:\n"
+        "    db.add(Team(name='Other Worker FC'))\n"
+        "    db.commit()\n"
+    )
+    service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    
+    # Fresh counters: ids restart with the recreated table, so a mark seen by an earlier test could repeat
+    versions = CollectionVersions(max_staleness=0.05)
+    versions.register_watermark("teams", _teams_watermark)
+    with patch('app.versions.SessionLocal', TestingSessionLocal), patch('app.versions.collection_versions', versions):
+        etag = client.get("/teams").headers["ETag"]
+        assert client.get("/teams", headers={"If-None-Match": etag}).status_code == 304
+        
+        subprocess.run([sys.executable, "-c", other_worker], check=True, env={**os.environ, "PYTHONPATH": service_dir})
+        time.sleep(0.1)
+        
+        response = client.get("/teams", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert [t["name"] for t in response.json()] == ["Other Worker FC"]
+
+def test_teams_watermark_moves_when_a_lower_id_commits_late(client):
+    """Test the high-water mark changes when a lower id commits after a higher one was already read"""
+    import uuid
+    from app.digest import record_team_digests
+    from app.versions import _teams_watermark
+    
+    def commit_team(team_id, name):
+        db = TestingSessionLocal()
+        team = Team(id=team_id, team_id=uuid.uuid4(), name=name)
+        db.add(team)
+        db.flush()
+        record_team_digests(db, [str(team.team_id)])
+        db.commit()
+        db.close()
+    
+    with patch('app.versions.SessionLocal', TestingSessionLocal):
+        commit_team(2, "Early Commit")
+        seen = _teams_watermark()
+        commit_team(1, "Late Commit")
+        assert _teams_watermark() != seen
+
+def test_get_teams_response_cache(client):
+    """Test cached list bodies are reused until the collection version changes"""
+    from app.versions import response_cache
+    
+    client.post("/teams/bulk", json={"names": ["Cache A", "Cache B", "Cache C"]})
+    uncached = client.get("/teams", params={"limit": 2})
+    
+    with patch.object(response_cache, "size", 16):
+        try:
+            first = client.get("/teams", params={"limit": 2})
+            with patch('app.api._get_teams') as mock_get_teams:
+                second = client.get("/teams", params={"limit": 2})
+                mock_get_teams.assert_not_called()
+            # Same contract as the uncached path
+            assert second.content == first.content == uncached.content
+            assert second.headers["X-Next-Cursor"] == uncached.headers["X-Next-Cursor"]
+            
+            client.post("/teams", json={"name": "Cache D"})
+            third = client.get("/teams")
+            assert [t["name"] for t in third.json()] == ["Cache A", "Cache B", "Cache C", "Cache D"]
+        finally:
+            response_cache.clear()
+
+def test_get_teams_fast_path_matches_model_serialization(client):
+    """Test the Core/orjson list body is identical to rendering TeamResponse models"""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from app.schemas import TeamResponse
+    
+    client.post("/teams/bulk", json={"names": ["Fast Path FC", "Ünïcode United"]})
+    
+    db = TestingSessionLocal()
+    try:
+        expected = [TeamResponse.model_validate(team) for team in db.query(Team).order_by(Team.id)]
+    finally:
+        db.close()
+    assert client.get("/teams").content == JSONResponse(jsonable_encoder(expected)).body
+
+def test_team_changes_feed(client):
+    """Test polling the change feed returns only teams registered after the token"""
+    client.post("/teams/bulk", json={"names": ["Change A", "Change B", "Change C"]})
+    
+    first = client.get("/teams/changes", params={"limit": 2}).json()
+    assert [t["name"] for t in first["items"]] == ["Change A", "Change B"]
+    assert first["has_more"] is True
+    
+    second = client.get("/teams/changes", params={"since": first["token"]}).json()
+    assert [t["name"] for t in second["items"]] == ["Change C"]
+    assert second["has_more"] is False
+    
+    client.post("/teams", json={"name": "Change D"})
+    third = client.get("/teams/changes", params={"since": second["token"]}).json()
+    assert [t["name"] for t in third["items"]] == ["Change D"]
+    # Nothing new: the token stays put
+    assert client.get("/teams/changes", params={"since": third["token"]}).json() == {
+        "items": [], "token": third["token"], "has_more": False
+    }
+
+def test_team_writers_commit_ids_in_order(client):
+    """Test team writes take the change feed lock before inserting, and a slow write still commits"""
+    from sqlalchemy.dialects import postgresql
+    from app.changes import change_feed_lock_statement, lock_change_feed
+    
+    assert change_feed_lock_statement("sqlite", "teams") is None
+    statement = change_feed_lock_statement("postgresql", "teams")
+    assert "pg_advisory_xact_lock" in str(statement.compile(dialect=postgresql.dialect()))
+    
+    def slow_outbox(db, event):
+        time.sleep(0.3)
+        return add_outbox_event(db, event)
+    
+    lock = Mock(side_effect=lock_change_feed)
+    with patch('app.api.lock_change_feed', lock), patch('app.api.add_outbox_event', side_effect=slow_outbox):
+        assert client.post("/teams", json={"name": "Slow Commit FC"}).status_code == 200
+        assert client.post("/teams/bulk", json={"names": ["Bulk A", "Bulk B"]}).status_code == 200
+    
+    assert [call.args[1] for call in lock.call_args_list] == ["teams", "teams"]
+    changes = client.get("/teams/changes").json()
+    assert [t["name"] for t in changes["items"]] == ["Slow Commit FC", "Bulk A", "Bulk B"]
+    assert changes["token"] == changes["items"][-1]["id"]
+
+@pytest.mark.asyncio
+async def test_event_broadcaster_cuts_off_slow_clients():
+    """Test each stream client has a bounded buffer and an overflowing one is told to resync"""
+    import asyncio
+    from app.stream import RESYNC_MESSAGE, EventBroadcaster, sse_messages
+    
+    broadcaster = EventBroadcaster(buffer_size=2)
+    broadcaster.attach(asyncio.get_running_loop())
+    fast, slow = broadcaster.subscribe(), broadcaster.subscribe()
+    fast_stream = sse_messages(broadcaster, fast)
+    assert await fast_stream.__anext__() == ": connected\n\n"
+    
+    for i in range(3):
+        broadcaster.publish("TeamRegistered", {"teamId": f"stream-{i}", "name": f"Stream {i}"})
+        await asyncio.sleep(0)
+        message = await fast_stream.__anext__()
+        assert message.startswith("event: TeamRegistered\ndata: ")
+        assert json.loads(message.split("data: ", 1)[1])["teamId"] == f"stream-{i}"
+    
+    # The slow client keeps what it had buffered, ending with the resync notice, then its stream ends
+    assert slow.overflowed
+    slow_messages = [message async for message in sse_messages(broadcaster, slow)]
+    assert slow_messages[-1] is RESYNC_MESSAGE
+    assert broadcaster.stats()["clients"] == 1
+    await fast_stream.aclose()
+    assert broadcaster.stats()["clients"] == 0
+
+@pytest.mark.asyncio
+async def test_stream_source_pushes_published_events():
+    """Test a worker's stream source turns published registrations into stream messages"""
+    import asyncio
+    import zmq
+    from app.events import encode_event, team_registered_event
+    from app.stream import EventBroadcaster, StreamSource
+    
+    context = zmq.Context()
+    publisher = context.socket(zmq.PUB)
+    publisher.bind("tcp://127.0.0.1:15565")
+    broadcaster = EventBroadcaster()
+    broadcaster.attach(asyncio.get_running_loop())
+    client = broadcaster.subscribe()
+    source = StreamSource(broadcaster, address="tcp://127.0.0.1:15565")
+    source.start()
+    await asyncio.sleep(0.5)
+    
+    try:
+        team = {"id": 7, "team_id": "pushed-team", "name": "Pushed FC", "created_at": "2024-01-01T10:00:00"}
+        publisher.send_multipart(encode_event(team_registered_event(team)))
+        message = await asyncio.wait_for(client.queue.get(), 2)
+        # The full TeamResponse row, so browsers don't fetch it again
+        assert json.loads(message.split("data: ", 1)[1]) == team
+    finally:
+        source.stop()
+        publisher.close(linger=0)
+        context.term()
+
+def test_metrics_endpoint_reports_routes_and_queries(client):
+    """Test /metrics exposes per-route latency and SQL timing histograms"""
+    from app.metrics import DB_QUERY_SECONDS, HTTP_REQUEST_SECONDS
+    
+    labels = ("GET", "/teams", "200")
+    requests_before = HTTP_REQUEST_SECONDS.count(labels)
+    selects_before = DB_QUERY_SECONDS.count(("SELECT",))
+    client.post("/teams", json={"name": "Metrics FC"})
+    client.get("/teams")
+    client.get("/no-such-route")
+    
+    assert HTTP_REQUEST_SECONDS.count(labels) == requests_before + 1
+    assert DB_QUERY_SECONDS.count(("SELECT",)) > selects_before
+    
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/teams",status="200",le="+Inf"}' in body
+    # Unknown paths share one label instead of one series per URL
+    assert 'route="unmatched",status="404"' in body
+    assert 'db_query_duration_seconds_count{operation="INSERT"}' in body
+    assert "event_publish_queue_depth" in body
+
+def test_pool_instrumentation_reports_waits_and_hold_times():
+    """Test pool checkout timeouts, occupancy gauges and per-route connection hold times"""
+    from sqlalchemy import exc
+    from app.metrics import DB_CONNECTION_HOLD_SECONDS, DB_POOL_TIMEOUTS, InstrumentedQueuePool, instrument_pool
+    
+    pooled = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05
+    )
+    instrument_pool(pooled, "pool-test")
+    PooledSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=pooled)
+    
+    def override_get_pooled_db():
+        db = PooledSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+    
+    Base.metadata.create_all(bind=engine)
+    app.dependency_overrides[get_db] = override_get_pooled_db
+    try:
+        with TestClient(app) as test_client:
+            assert test_client.get("/teams").status_code == 200
+            
+            held = pooled.connect()
+            timeouts = DB_POOL_TIMEOUTS.value(("sync",))
+            with pytest.raises(exc.TimeoutError):
+                pooled.connect()
+            assert DB_POOL_TIMEOUTS.value(("sync",)) == timeouts + 1
+            body = test_client.get("/metrics").text
+            held.close()
+    finally:
+        app.dependency_overrides[get_db] = override_get_db
+        Base.metadata.drop_all(bind=engine)
+        pooled.dispose()
+    
+    assert 'db_pool_checked_out{pool="pool-test"} 1' in body
+    assert 'db_pool_checkout_wait_seconds_count{pool="sync"}' in body
+    assert DB_CONNECTION_HOLD_SECONDS.count(("pool-test", "/teams")) >= 1
+    # Connections taken outside a request are attributed to background work
+    assert DB_CONNECTION_HOLD_SECONDS.count(("pool-test", "background")) >= 1
+
+def test_slow_query_log_captures_route_shape_and_plan(client):
+    """Test slow statements are recorded with their route, parameter shape and a sampled EXPLAIN"""
+    from sqlalchemy import event
+    from app.slow_queries import get_slow_query_log
+    
+    slow_query_log = get_slow_query_log()
+    engines = [engine, async_engine.sync_engine]
+    client.post("/teams", json={"name": "Slow FC"})
+    sample_everything = patch.object(slow_query_log, "explain_sample_rate", 1.0)
+    with patch.object(slow_query_log, "threshold_ms", 0.000001), sample_everything:
+        for watched in engines:
+            slow_query_log.attach(watched)
+        try:
+            assert client.get("/teams", params={"limit": 10}).status_code == 200
+            report = client.get("/admin/slow-queries").json()
+        finally:
+            for watched in engines:
+                event.remove(watched, "before_cursor_execute", slow_query_log._before_cursor_execute)
+                event.remove(watched, "after_cursor_execute", slow_query_log._after_cursor_execute)
+            slow_query_log.clear()
+    
+    assert report["enabled"] is True
+    entry = next(q for q in report["queries"] if q["route"] == "/teams")
+    assert entry["statement"].lstrip().startswith("SELECT")
+    # Only the shape of the parameters is kept, never their values
+    assert "10" not in json.dumps(entry["parameters"])
+    assert "int" in json.dumps(entry["parameters"])
+    assert "teams" in entry["explain"].lower()
+
+def test_profiling_middleware_writes_and_inlines_profiles(tmp_path):
+    """Test X-Profile requests are profiled across the threadpool, up to the per-minute limit"""
+    import pstats
+    from app.profiling import ProfilingMiddleware
+    
+    app.dependency_overrides[get_db] = override_get_db
+    Base.metadata.create_all(bind=engine)
+    profiled = TestClient(ProfilingMiddleware(app, enabled=True, directory=str(tmp_path), max_per_minute=2))
+    try:
+        response = profiled.post("/teams", json={"name": "Profiled FC"}, headers={"X-Profile": "file"})
+        assert response.status_code == 200
+        assert response.json()["name"] == "Profiled FC"
+        stats = pstats.Stats(str(tmp_path / response.headers["X-Profile-File"]))
+        # _create_team runs in the threadpool, outside the event loop's profiler
+        assert any(function == "_create_team" for _, _, function in stats.stats)
+        
+        inline = profiled.get("/teams", headers={"X-Profile": "inline"})
+        assert inline.headers["X-Profile-Status"] == "inline"
+        assert inline.headers["X-Profile-Response-Status"] == "200"
+        assert "_get_teams" in inline.text
+        
+        limited = profiled.get("/teams", headers={"X-Profile": "inline"})
+        assert limited.headers["X-Profile-Status"] == "rate-limited"
+        assert [team["name"] for team in limited.json()] == ["Profiled FC"]
+        assert "X-Profile-Status" not in profiled.get("/teams").headers
+    finally:
+        Base.metadata.drop_all(bind=engine)
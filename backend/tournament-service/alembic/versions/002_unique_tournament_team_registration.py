@@ -0,0 +1,32 @@
+"""unique tournament team registration
+
+Revision ID: 002
+Revises: 001
+Create Date: 2024-02-01 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Drop duplicates left by replayed events, keeping the earliest registration
+    op.execute("""
+        DELETE FROM tournament_teams a
+        USING tournament_teams b
+        WHERE a.tournament_id = b.tournament_id
+          AND a.team_id = b.team_id
+          AND a.id > b.id
+    """)
+    op.create_index('ix_tournament_teams_tournament_id_team_id', 'tournament_teams', ['tournament_id', 'team_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tournament_teams_tournament_id_team_id', table_name='tournament_teams')
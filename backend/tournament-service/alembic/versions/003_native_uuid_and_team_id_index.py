@@ -0,0 +1,37 @@
+"""native uuid tournament_id and team_id index
+
+Revision ID: 003
+Revises: 002
+Create Date: 2024-02-15 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # 16-byte native keys instead of 36-character varchar; ix_tournaments_tournament_id is rebuilt by the ALTER
+    op.alter_column('tournaments', 'tournament_id',
+                    existing_type=sa.String(),
+                    type_=postgresql.UUID(as_uuid=True),
+                    postgresql_using='tournament_id::uuid',
+                    existing_nullable=True)
+    # Lookups by tournament_id use the leading column of the (tournament_id, team_id) unique index from 002
+    op.create_index(op.f('ix_tournament_teams_team_id'), 'tournament_teams', ['team_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_tournament_teams_team_id'), table_name='tournament_teams')
+    op.alter_column('tournaments', 'tournament_id',
+                    existing_type=postgresql.UUID(as_uuid=True),
+                    type_=sa.String(),
+                    postgresql_using='tournament_id::text',
+                    existing_nullable=True)
@@ -0,0 +1,29 @@
+"""create event offsets table
+
+Revision ID: 004
+Revises: 003
+Create Date: 2024-03-01 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('event_offsets',
+    sa.Column('stream', sa.String(), nullable=False),
+    sa.Column('sequence', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('stream')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('event_offsets')
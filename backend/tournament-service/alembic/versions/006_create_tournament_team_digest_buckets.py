@@ -0,0 +1,61 @@
+"""create tournament team digest buckets
+
+Revision ID: 006
+Revises: 005
+Create Date: 2024-04-01 10:00:00.000000
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+# Must match app.digest
+HEX_DIGITS = "0123456789abcdef"
+DIGEST_BUCKET_DEPTH = 3
+BACKFILL_BATCH_SIZE = 5000
+
+
+def upgrade() -> None:
+    buckets = op.create_table('tournament_team_digest_buckets',
+    sa.Column('tournament_id', sa.Integer(), nullable=False),
+    sa.Column('prefix', sa.String(), nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.Column('hash', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['tournament_id'], ['tournaments.id'], ),
+    sa.PrimaryKeyConstraint('tournament_id', 'prefix')
+    )
+    
+    # Existing registrations are hashed once here; from now on every insert keeps its bucket up to date
+    totals = {}
+    result = op.get_bind().execute(
+        sa.text("SELECT tournament_id, team_id FROM tournament_teams").execution_options(yield_per=BACKFILL_BATCH_SIZE)
+    )
+    for tournament_id, team_id in result:
+        prefix = team_id[:DIGEST_BUCKET_DEPTH]
+        if len(prefix) < DIGEST_BUCKET_DEPTH or not all(digit in HEX_DIGITS for digit in prefix):
+            continue
+        bucket = totals.setdefault((tournament_id, prefix), [0, 0])
+        bucket[0] += 1
+        bucket[1] ^= int.from_bytes(hashlib.blake2b(team_id.encode(), digest_size=8).digest(), "big")
+    if totals:
+        op.bulk_insert(buckets, [
+            {
+                "tournament_id": tournament_id,
+                "prefix": prefix,
+                "count": count,
+                "hash": value - (1 << 64) if value >= 1 << 63 else value,
+            }
+            for (tournament_id, prefix), (count, value) in sorted(totals.items())
+        ])
+
+
+def downgrade() -> None:
+    op.drop_table('tournament_team_digest_buckets')
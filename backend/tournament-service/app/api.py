@@ -1,49 +1,207 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional, Tuple, Union
 import logging
 
-from .database import get_db
+from .database import get_db, run_db
 from .models import Tournament, TournamentTeam
-from .schemas import TournamentCreate, TournamentResponse
+from .schemas import DigestBucket, TournamentCreate, TournamentHeaderResponse, TournamentResponse, TournamentTeamResponse
+from .digest import MAX_PREFIX_LENGTH, tournament_team_digests
+from .changes import CHANGES_PAGE_SIZE
+from .serialization import dump_json, dump_rows
+from .stream import StreamFull, get_broadcaster, sse_messages
+from .versions import bump_version, cached_response, collection_etag, etag_matches, json_response, not_modified
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+def _create_tournament(db: Session, tournament: TournamentCreate) -> TournamentResponse:
+    # Create new tournament
+    db_tournament = Tournament(name=tournament.name)
+    db.add(db_tournament)
+    db.commit()
+    db.refresh(db_tournament)
+    
+    logger.info(f"Created tournament: {db_tournament.name} with ID: {db_tournament.tournament_id}")
+    
+    # Serialize while the session can still load the teams relationship
+    return TournamentResponse.model_validate(db_tournament)
+
+# Response model fields in order, selected as plain tuples for the list fast path
+TOURNAMENT_COLUMNS = (Tournament.id, Tournament.tournament_id, Tournament.name, Tournament.created_at)
+ROSTER_COLUMNS = (TournamentTeam.id, TournamentTeam.team_id, TournamentTeam.team_name, TournamentTeam.created_at)
+
+def _get_tournaments(db: Session, include_teams: bool) -> bytes:
+    tournaments = [row._asdict() for row in db.execute(select(*TOURNAMENT_COLUMNS).order_by(Tournament.id))]
+    if not include_teams:
+        logger.info(f"Retrieved {len(tournaments)} tournament headers")
+        return dump_json(tournaments)
+    
+    # Every roster in one extra query, grouped in Python instead of one lazy SELECT per tournament
+    rosters = {}
+    for tournament in tournaments:
+        tournament["teams"] = rosters[tournament["id"]] = []
+    for row in db.execute(select(*ROSTER_COLUMNS, TournamentTeam.tournament_id).order_by(TournamentTeam.id)):
+        team = row._asdict()
+        roster = rosters.get(team.pop("tournament_id"))
+        if roster is not None:
+            roster.append(team)
+    logger.info(f"Retrieved {len(tournaments)} tournaments")
+    return dump_json(tournaments)
+
+def _get_tournament_roster(
+    db: Session, tournament_id: int, after: Optional[int], limit: int
+) -> Optional[Tuple[bytes, Optional[int]]]:
+    if db.get(Tournament, tournament_id) is None:
+        return None
+    
+    # Keyset pagination on the registration id within one tournament
+    query = select(*ROSTER_COLUMNS).where(TournamentTeam.tournament_id == tournament_id)
+    if after is not None:
+        query = query.where(TournamentTeam.id > after)
+    # Fetch one extra row to learn whether another page exists
+    teams = db.execute(query.order_by(TournamentTeam.id).limit(limit + 1)).all()
+    next_cursor = teams[limit - 1].id if len(teams) > limit else None
+    logger.info(f"Retrieved {len(teams[:limit])} teams for tournament {tournament_id}")
+    return dump_rows(teams[:limit]), next_cursor
+
+# TournamentTeam.to_dict() fields in order
+REGISTRATION_COLUMNS = (TournamentTeam.id, TournamentTeam.tournament_id, *ROSTER_COLUMNS[1:])
+
+def _get_tournament_teams(db: Session) -> bytes:
+    teams = db.execute(select(*REGISTRATION_COLUMNS)).all()
+    logger.info(f"Retrieved {len(teams)} tournament team entries")
+    # Same shape as TournamentTeam.to_dict(), whose isoformat() writes UTC as +00:00
+    return dump_rows(teams, option=0)
+
 @router.post("/tournaments", response_model=TournamentResponse)
-def create_tournament(tournament: TournamentCreate, db: Session = Depends(get_db)):
+async def create_tournament(tournament: TournamentCreate, db: Union[Session, AsyncSession] = Depends(get_db)):
     try:
-        # Create new tournament
-        db_tournament = Tournament(name=tournament.name)
-        db.add(db_tournament)
-        db.commit()
-        db.refresh(db_tournament)
-        
-        logger.info(f"Created tournament: {db_tournament.name} with ID: {db_tournament.tournament_id}")
-        
+        db_tournament = await run_db(db, _create_tournament, tournament)
+        bump_version("tournaments")
         return db_tournament
     except Exception as e:
-        db.rollback()
         logger.error(f"Failed to create tournament: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to create tournament")
 
-@router.get("/tournaments", response_model=List[TournamentResponse])
-def get_tournaments(db: Session = Depends(get_db)):
+@router.get("/tournaments", response_model=List[Union[TournamentResponse, TournamentHeaderResponse]])
+async def get_tournaments(
+    request: Request,
+    include_teams: bool = Query(True, description="Set to false to return tournament headers without rosters"),
+    db: Union[Session, AsyncSession] = Depends(get_db)
+):
+    # Taken before the query, so a write racing with it only makes the ETag more conservative
+    etag = await collection_etag(*(("tournaments", "tournament_teams") if include_teams else ("tournaments",)))
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    cached = cached_response(request, etag)
+    if cached is not None:
+        return cached
+    
     try:
-        tournaments = db.query(Tournament).all()
-        logger.info(f"Retrieved {len(tournaments)} tournaments")
-        return tournaments
+        body = await run_db(db, _get_tournaments, include_teams)
+        return json_response(request, etag, body, {})
     except Exception as e:
         logger.error(f"Failed to retrieve tournaments: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to retrieve tournaments")
 
+@router.get("/tournaments/{tournament_id}/teams", response_model=List[TournamentTeamResponse])
+async def get_tournament_roster(
+    tournament_id: int,
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    after: Optional[int] = Query(None, description="Cursor returned in X-Next-Cursor by the previous page"),
+    db: Union[Session, AsyncSession] = Depends(get_db)
+):
+    etag = await collection_etag("tournament_teams")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    cached = cached_response(request, etag)
+    if cached is not None:
+        return cached
+    
+    try:
+        roster = await run_db(db, _get_tournament_roster, tournament_id, after, limit)
+    except Exception as e:
+        logger.error(f"Failed to retrieve teams for tournament {tournament_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve tournament teams")
+    
+    if roster is None:
+        raise HTTPException(status_code=404, detail="Tournament not found")
+    body, next_cursor = roster
+    headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else {}
+    return json_response(request, etag, body, headers)
+
 @router.get("/tournament-teams")
-def get_tournament_teams(db: Session = Depends(get_db)):
+async def get_tournament_teams(
+    request: Request,
+    db: Union[Session, AsyncSession] = Depends(get_db)
+):
     """Get all tournament team registrations (for debugging/testing)"""
+    etag = await collection_etag("tournament_teams")
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    cached = cached_response(request, etag)
+    if cached is not None:
+        return cached
+    
     try:
-        teams = db.query(TournamentTeam).all()
-        logger.info(f"Retrieved {len(teams)} tournament team entries")
-        return [team.to_dict() for team in teams]
+        body = await run_db(db, _get_tournament_teams)
+        return json_response(request, etag, body, {})
     except Exception as e:
         logger.error(f"Failed to retrieve tournament teams: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to retrieve tournament teams")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Failed to retrieve tournament teams")
+
+def _get_tournament_team_changes(db: Session, since: int, limit: int) -> bytes:
+    # The primary key is the change token, so a poll is an index range scan from it. Writers commit
+    # ids in order under the change feed lock, so no lower id can still turn up behind the token
+    rows = db.execute(
+        select(*REGISTRATION_COLUMNS).where(TournamentTeam.id > since).order_by(TournamentTeam.id).limit(limit)
+    ).all()
+    token = rows[-1].id if rows else since
+    has_more = len(rows) == limit
+    return dump_json({"items": [row._asdict() for row in rows], "token": token, "has_more": has_more}, option=0)
+
+@router.get("/tournament-teams/changes")
+async def get_tournament_team_changes(
+    since: int = Query(0, ge=0, description="Token returned by the previous poll; 0 starts from the beginning"),
+    limit: int = Query(CHANGES_PAGE_SIZE, ge=1, le=5000),
+    db: Union[Session, AsyncSession] = Depends(get_db)
+):
+    """Registrations applied after the token, in the same shape as /tournament-teams"""
+    try:
+        body = await run_db(db, _get_tournament_team_changes, since, limit)
+        return Response(content=body, media_type="application/json")
+    except Exception as e:
+        logger.error(f"Failed to retrieve tournament team changes: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve tournament team changes")
+
+@router.get("/tournament-teams/digest", response_model=List[DigestBucket])
+async def get_tournament_teams_digest(
+    tournament_id: int = Query(1),
+    prefix: str = Query("", pattern=f"^[0-9a-f]{{0,{MAX_PREFIX_LENGTH - 1}}}$"),
+    db: Union[Session, AsyncSession] = Depends(get_db)
+):
+    """Count and hash of registered team_ids in each of the 16 child ranges of prefix"""
+    try:
+        return await run_db(db, tournament_team_digests, tournament_id, prefix)
+    except Exception as e:
+        logger.error(f"Failed to compute tournament team digest: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to compute tournament team digest")
+
+@router.get("/stream/tournament-teams")
+async def stream_tournament_teams():
+    """Server-sent events pushed as registrations are applied, instead of clients re-fetching lists"""
+    broadcaster = get_broadcaster()
+    try:
+        client = broadcaster.subscribe()
+    except StreamFull:
+        raise HTTPException(status_code=503, detail="Too many stream clients")
+    return StreamingResponse(
+        sse_messages(broadcaster, client),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
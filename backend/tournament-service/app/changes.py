@@ -0,0 +1,27 @@
+import os
+import zlib
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+CHANGES_PAGE_SIZE = int(os.getenv("CHANGES_PAGE_SIZE", "1000"))
+
+def change_feed_lock_statement(dialect_name: str, collection: str):
+    """Transaction-scoped lock every writer of a change feed collection takes before inserting
+    
+    Ids are handed out at insert time, so two writers could otherwise commit
+    them out of order and a token already past the higher id would skip the
+    lower one for good. Holding the lock from the insert until commit makes ids
+    commit in the order they were taken, so a poll can hand back the last id it
+    returned as the token. SQLite only ever has one writing transaction, so it
+    needs no lock (None).
+    """
+    if dialect_name == "sqlite":
+        return None
+    return select(func.pg_advisory_xact_lock(zlib.crc32(collection.encode())))
+
+def lock_change_feed(db: Session, collection: str):
+    """Take the change feed lock for collection in db's transaction; it is released on commit or rollback"""
+    statement = change_feed_lock_statement(db.get_bind().dialect.name, collection)
+    if statement is not None:
+        db.execute(statement)
@@ -1,20 +1,104 @@
 import os
+from typing import Any, Callable, TypeVar, Union
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from .metrics import InstrumentedAsyncQueuePool, InstrumentedQueuePool, instrument_pool, pool_stats
 from .models import Base
+from .profiling import profiled_section
+from .slow_queries import get_slow_query_log
+
+T = TypeVar("T")
 
 # Database configuration
 DATABASE_URL = f"postgresql://{os.getenv('DB_USER', 'tournament_user')}:{os.getenv('DB_PASSWORD', 'tournament_password')}@{os.getenv('TOURNAMENT_DB_HOST', 'tournament-db')}:{os.getenv('DB_PORT', '5432')}/{os.getenv('DB_NAME', 'tournament_db')}"
 
-engine = create_engine(DATABASE_URL)
+# Pool settings apply to the sync and the async engine alike. Each worker process of each replica opens
+# up to DB_POOL_SIZE + DB_POOL_MAX_OVERFLOW connections per engine, which has to fit max_connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "10"))
+# Seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Connections older than this many seconds are replaced on checkout; -1 keeps them forever
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+# Test each connection with a round trip on checkout, so ones dropped by the server are replaced
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+
+POOL_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_POOL_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
+engine = create_engine(DATABASE_URL, poolclass=InstrumentedQueuePool, **POOL_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def get_db():
+# Async engine (asyncpg) for code running on the event loop
+ASYNC_DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=InstrumentedAsyncQueuePool, **POOL_OPTIONS)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+instrument_pool(engine, "sync")
+instrument_pool(async_engine.sync_engine, "async")
+# Opt-in through SLOW_QUERY_MS
+get_slow_query_log().attach(engine)
+get_slow_query_log().attach(async_engine.sync_engine)
+
+# Opt-in async request stack: handlers get an AsyncSession instead of a threadpool-bound Session
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() == "true"
+
+def get_sync_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+get_db = get_async_db if DB_ASYNC else get_sync_db
+
+async def run_db(db: Union[Session, AsyncSession], fn: Callable[..., T], *args: Any) -> T:
+    """Run fn(session, *args) without blocking the event loop, rolling back if it raises
+    
+    An AsyncSession runs it through run_sync on the asyncpg connection; a plain
+    Session runs it in the threadpool, which is how sync handlers behaved before.
+    """
+    def unit_of_work(session: Session) -> T:
+        # Part of the request's profile when it was sent with X-Profile
+        with profiled_section():
+            try:
+                return fn(session, *args)
+            except Exception:
+                session.rollback()
+                raise
+    
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(unit_of_work)
+    return await run_in_threadpool(unit_of_work, db)
+
 def create_tables():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+
+async def create_tables_async():
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+def get_pool_stats():
+    return {
+        "config": {
+            "size": DB_POOL_SIZE,
+            "max_overflow": DB_POOL_MAX_OVERFLOW,
+            "timeout": DB_POOL_TIMEOUT,
+            "recycle": DB_POOL_RECYCLE,
+            "pre_ping": DB_POOL_PRE_PING,
+        },
+        "sync": pool_stats(engine),
+        "async": pool_stats(async_engine.sync_engine),
+    }
\ No newline at end of file
@@ -0,0 +1,127 @@
+import hashlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from .models import TournamentTeam, TournamentTeamDigestBucket
+
+# Must match team-service's digest.py so bucket hashes compare equal
+HEX_DIGITS = "0123456789abcdef"
+MAX_PREFIX_LENGTH = 8
+DIGEST_SCAN_BATCH_SIZE = 5000
+# Every insert adds its team_ids to the stored bucket of their first this many hex digits, so
+# digests of shorter prefixes add up at most 16 ** DIGEST_BUCKET_DEPTH rows instead of scanning
+DIGEST_BUCKET_DEPTH = 3
+
+HASH_MASK = (1 << 64) - 1
+
+def team_hash(team_id: str) -> int:
+    """64-bit hash of a canonical team id; XOR-ing these makes a bucket hash order independent"""
+    return int.from_bytes(hashlib.blake2b(team_id.encode(), digest_size=8).digest(), "big")
+
+def _signed(value: int) -> int:
+    """An unsigned 64-bit hash as the BIGINT that stores it"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def bucket_digests(team_ids: Iterable[str], prefix: str) -> List[Dict[str, Any]]:
+    """Count and hash team ids into the 16 child buckets of a hex prefix"""
+    counts = dict.fromkeys(HEX_DIGITS, 0)
+    hashes = dict.fromkeys(HEX_DIGITS, 0)
+    depth = len(prefix)
+    for team_id in team_ids:
+        digit = team_id[depth:depth + 1]
+        if digit in counts:
+            counts[digit] += 1
+            hashes[digit] ^= team_hash(team_id)
+    return [
+        {"prefix": prefix + digit, "count": counts[digit], "hash": f"{hashes[digit]:016x}"}
+        for digit in HEX_DIGITS
+    ]
+
+def combine_buckets(buckets: Iterable[Tuple[str, int, int]], prefix: str) -> List[Dict[str, Any]]:
+    """Fold stored (prefix, count, hash) buckets below a prefix into its 16 child buckets"""
+    counts = dict.fromkeys(HEX_DIGITS, 0)
+    hashes = dict.fromkeys(HEX_DIGITS, 0)
+    depth = len(prefix)
+    for bucket_prefix, count, bucket_hash in buckets:
+        digit = bucket_prefix[depth]
+        counts[digit] += count
+        hashes[digit] ^= bucket_hash & HASH_MASK
+    return [
+        {"prefix": prefix + digit, "count": counts[digit], "hash": f"{hashes[digit]:016x}"}
+        for digit in HEX_DIGITS
+    ]
+
+def next_prefix(prefix: str) -> Optional[str]:
+    """Smallest hex string above every string starting with prefix; None when there is none"""
+    stripped = prefix.rstrip("f")
+    if not stripped:
+        return None
+    return stripped[:-1] + HEX_DIGITS[HEX_DIGITS.index(stripped[-1]) + 1]
+
+def prefix_range(column, prefix: str) -> list:
+    """column >= prefix AND column < next_prefix, which an index can scan, unlike LIKE 'prefix%'"""
+    conditions = [column >= prefix]
+    upper = next_prefix(prefix)
+    if upper is not None:
+        conditions.append(column < upper)
+    return conditions
+
+def digest_bucket_updates(rows: Iterable[Tuple[int, str]]) -> List[Dict[str, Any]]:
+    """Count and hash added to each stored bucket by newly inserted (tournament_id, team_id) rows
+    
+    Only team_ids starting with DIGEST_BUCKET_DEPTH hex digits are bucketed, as
+    every UUID does. Buckets come back in key order, so concurrent writers lock
+    their rows in the same sequence.
+    """
+    totals: Dict[Tuple[int, str], List[int]] = {}
+    for tournament_id, team_id in rows:
+        prefix = team_id[:DIGEST_BUCKET_DEPTH]
+        if len(prefix) < DIGEST_BUCKET_DEPTH or not all(digit in HEX_DIGITS for digit in prefix):
+            continue
+        bucket = totals.setdefault((tournament_id, prefix), [0, 0])
+        bucket[0] += 1
+        bucket[1] ^= team_hash(team_id)
+    return [
+        {"tournament_id": tournament_id, "prefix": prefix, "count": count, "hash": _signed(bucket_hash)}
+        for (tournament_id, prefix), (count, bucket_hash) in sorted(totals.items())
+    ]
+
+def upsert_digest_buckets_statement(dialect_name: str):
+    """Add counts and XOR hashes into stored buckets; a | b - a & b is XOR on both databases"""
+    dialect_insert = sqlite.insert if dialect_name == "sqlite" else postgresql.insert
+    statement = dialect_insert(TournamentTeamDigestBucket)
+    excluded = statement.excluded
+    bucket_hash = TournamentTeamDigestBucket.hash
+    return statement.on_conflict_do_update(
+        index_elements=["tournament_id", "prefix"],
+        set_={
+            "count": TournamentTeamDigestBucket.count + excluded["count"],
+            "hash": bucket_hash.op("|")(excluded["hash"]) - bucket_hash.op("&")(excluded["hash"]),
+        }
+    )
+
+def record_tournament_team_digests(db: Session, inserted: Iterable[Tuple[int, str]]):
+    """Add inserted (tournament_id, team_id) rows to their digest buckets, in the inserting transaction"""
+    updates = digest_bucket_updates(inserted)
+    if updates:
+        db.execute(upsert_digest_buckets_statement(db.get_bind().dialect.name), updates)
+
+def tournament_team_digests(db: Session, tournament_id: int, prefix: str) -> List[Dict[str, Any]]:
+    if len(prefix) < DIGEST_BUCKET_DEPTH:
+        query = (
+            select(TournamentTeamDigestBucket.prefix, TournamentTeamDigestBucket.count, TournamentTeamDigestBucket.hash)
+            .where(TournamentTeamDigestBucket.tournament_id == tournament_id)
+        )
+        if prefix:
+            query = query.where(*prefix_range(TournamentTeamDigestBucket.prefix, prefix))
+        return combine_buckets(db.execute(query), prefix)
+    # Below the stored buckets the range is a small slice of the (tournament_id, team_id) index
+    query = (
+        select(TournamentTeam.team_id)
+        .where(TournamentTeam.tournament_id == tournament_id, *prefix_range(TournamentTeam.team_id, prefix))
+        .execution_options(yield_per=DIGEST_SCAN_BATCH_SIZE)
+    )
+    return bucket_digests(db.scalars(query), prefix)
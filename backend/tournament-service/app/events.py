@@ -1,30 +1,229 @@
+import os
+import asyncio
+import httpx
 import zmq
+import zmq.asyncio
 import json
+import msgpack
 import logging
+import struct
 import threading
 import time
-from typing import Dict, Any
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional, Set, Tuple, Union
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
 
-from .database import SessionLocal
-from .models import TournamentTeam
+from .changes import change_feed_lock_statement, lock_change_feed
+from .database import SessionLocal, AsyncSessionLocal
+from .digest import digest_bucket_updates, record_tournament_team_digests, upsert_digest_buckets_statement
+from .journal import EVENT_JOURNAL_DIR, EventJournal
+from .lag import LagSketch
+from .metrics import REGISTRY
+from .models import EventOffset, TournamentTeam
+from .stream import get_broadcaster
+from .versions import bump_version
 
 logger = logging.getLogger(__name__)
 
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", "500"))
+EVENT_FLUSH_INTERVAL_MS = int(os.getenv("EVENT_FLUSH_INTERVAL_MS", "50"))
+# "thread" runs the blocking subscriber in a daemon thread, "asyncio" runs it on the app's event loop
+EVENT_SUBSCRIBER_MODE = os.getenv("EVENT_SUBSCRIBER_MODE", "thread")
+# Recently applied (tournament, team) registrations remembered to skip redeliveries without a DB round trip
+EVENT_DEDUPE_CACHE_SIZE = int(os.getenv("EVENT_DEDUPE_CACHE_SIZE", "100000"))
+# Consumer group: each of EVENT_CONSUMER_REPLICAS replicas takes the teamId partitions assigned to its index
+EVENT_PARTITIONS = int(os.getenv("EVENT_PARTITIONS", "64"))
+EVENT_CONSUMER_REPLICAS = int(os.getenv("EVENT_CONSUMER_REPLICAS", "1"))
+EVENT_CONSUMER_INDEX = int(os.getenv("EVENT_CONSUMER_INDEX", "0"))
+
+# Event types this service reacts to; everything else is filtered out by the socket, unparsed
+SUBSCRIBED_EVENTS = ["TeamRegistered"]
+# Envelope header: (version, sequence number, event time in microseconds since the epoch)
+ENVELOPE_VERSION = 1
+ENVELOPE_HEADER = struct.Struct("!BQQ")
+
+# team-service's sequence-numbered event log (GET /events), used to catch up on start and to fill gaps;
+# an empty value turns replay off
+TEAM_SERVICE_URL = os.getenv("TEAM_SERVICE_URL", "http://team-service:8000")
+EVENT_REPLAY_BATCH_SIZE = int(os.getenv("EVENT_REPLAY_BATCH_SIZE", "1000"))
+# Outbox ids are taken at insert and commit out of order, so a sequence missing from the log may still be
+# in flight; it is fetched again until it turns up, is pruned, or has been missing for this long
+# (its transaction rolled back, which leaves a hole for good)
+EVENT_GAP_MAX_AGE_SECONDS = float(os.getenv("EVENT_GAP_MAX_AGE_SECONDS", "300"))
+# With a journal, received messages are applied by a writer thread in batches of up to this many
+EVENT_JOURNAL_DRAIN_BATCH_SIZE = int(os.getenv("EVENT_JOURNAL_DRAIN_BATCH_SIZE", "5000"))
+# A journaled batch that fails this many times in a row while the database is reachable is split in half,
+# and a single record that does is moved to the journal's dead-letter file so the rest can go on
+EVENT_JOURNAL_MAX_ATTEMPTS = int(os.getenv("EVENT_JOURNAL_MAX_ATTEMPTS", "5"))
+JOURNAL_RETRY_MAX_SECONDS = 5.0
+# Warn when the p99 delay from publish to commit goes above this many milliseconds; 0 disables the warning
+EVENT_LAG_WARN_MS = float(os.getenv("EVENT_LAG_WARN_MS", "1000"))
+
+def insert_tournament_teams_statement(dialect_name: str):
+    """INSERT ... ON CONFLICT DO NOTHING on the (tournament_id, team_id) unique index
+    
+    Returns the rows actually inserted, which are the ones to add to the digest buckets.
+    """
+    dialect_insert = sqlite.insert if dialect_name == "sqlite" else postgresql.insert
+    return dialect_insert(TournamentTeam).on_conflict_do_nothing(
+        index_elements=["tournament_id", "team_id"]
+    ).returning(TournamentTeam.tournament_id, TournamentTeam.team_id)
+
+def upsert_event_offset_statement(dialect_name: str, stream: str, sequence: int):
+    """Move a stream's checkpoint forward, never backwards"""
+    dialect_insert = sqlite.insert if dialect_name == "sqlite" else postgresql.insert
+    statement = dialect_insert(EventOffset).values(stream=stream, sequence=sequence)
+    return statement.on_conflict_do_update(
+        index_elements=["stream"],
+        set_={"sequence": statement.excluded.sequence},
+        where=EventOffset.sequence < statement.excluded.sequence
+    )
+
+EVENTS_CONSUMED = REGISTRY.counter("events_consumed_total", "Event messages handled by the subscriber, replays included")
+EVENT_BATCH_SECONDS = REGISTRY.histogram(
+    "event_batch_duration_seconds", "Time to decode a batch of events and store its registrations"
+)
+EVENT_HANDLER_ERRORS = REGISTRY.counter(
+    "event_handler_errors_total", "Messages that failed to decode and batches that failed to store", ("stage",)
+)
+EVENT_LAG_SECONDS = REGISTRY.histogram(
+    "event_lag_seconds", "Time from an event's publish timestamp until the batch holding it was committed",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 3600.0)
+)
+
+def announce_tournament_teams(rows: List[Dict[str, Any]]):
+    """Tell list caches and stream clients about committed registrations"""
+    if not rows:
+        return
+    bump_version("tournament_teams")
+    broadcaster = get_broadcaster()
+    for row in rows:
+        broadcaster.publish("TournamentTeamRegistered", row)
+
+def partition_topics(
+    replicas: int,
+    index: int,
+    partitions: int = EVENT_PARTITIONS,
+    events: List[str] = SUBSCRIBED_EVENTS
+) -> List[str]:
+    """Topic prefixes owned by one replica; a single replica takes every partition of each event type"""
+    if replicas <= 1:
+        return [f"{event}/" for event in events]
+    return [
+        f"{event}/{partition:03d}"
+        for event in events
+        for partition in range(partitions)
+        if partition % replicas == index
+    ]
+
+def decode_message(message: Union[str, List[bytes], Dict[str, Any]]) -> Dict[str, Any]:
+    """Decode a [topic, header, payload] envelope into an event dict
+    
+    Plain JSON documents (a string or a single frame) and events already
+    decoded from the replay endpoint are accepted as well.
+    """
+    if isinstance(message, dict):
+        return message
+    if isinstance(message, str):
+        return json.loads(message)
+    if len(message) != 3:
+        return json.loads(message[-1])
+    
+    topic, header, payload = message
+    # Only the version byte is fixed; later versions may grow the header
+    if header[0] != ENVELOPE_VERSION:
+        raise ValueError(f"Unsupported event envelope version {header[0]}")
+    _, sequence, timestamp_us = ENVELOPE_HEADER.unpack(header)
+    return {
+        "event": topic.decode().split("/", 1)[0],
+        "payload": msgpack.unpackb(payload),
+        "sequence": sequence,
+        "timestamp_us": timestamp_us,
+    }
+
+def event_time(event: Dict[str, Any]) -> Optional[float]:
+    """Publish time in seconds since the epoch, from the envelope header or a logged event's ISO timestamp"""
+    if event.get("timestamp_us"):
+        return event["timestamp_us"] / 1_000_000
+    timestamp = event.get("timestamp")
+    if timestamp:
+        return datetime.fromisoformat(timestamp.rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
+    return None
+
 class EventSubscriber:
-    def __init__(self):
-        self.context = zmq.Context()
+    context_class = zmq.Context
+    
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        flush_interval_ms: Optional[int] = None,
+        replicas: Optional[int] = None,
+        index: Optional[int] = None,
+        journal: Optional[EventJournal] = None
+    ):
+        self.batch_size = batch_size or EVENT_BATCH_SIZE
+        self.flush_interval_ms = flush_interval_ms if flush_interval_ms is not None else EVENT_FLUSH_INTERVAL_MS
+        self.replicas = replicas or EVENT_CONSUMER_REPLICAS
+        self.index = index if index is not None else EVENT_CONSUMER_INDEX
+        if not 0 <= self.index < self.replicas:
+            raise ValueError(f"EVENT_CONSUMER_INDEX must be between 0 and {self.replicas - 1}")
+        self.context = self.context_class()
         self.socket = self.context.socket(zmq.SUB)
         self.socket.connect("tcp://team-service:5555")
-        self.socket.setsockopt_string(zmq.SUBSCRIBE, "")  # Subscribe to all messages
+        # Filtering happens on the publisher side, so a replica never receives other replicas' partitions
+        self.topics = partition_topics(self.replicas, self.index)
+        for topic in self.topics:
+            self.socket.setsockopt_string(zmq.SUBSCRIBE, topic)
         self.running = False
         self.thread = None
-        logger.info("ZeroMQ subscriber connected to tcp://team-service:5555")
+        self._applied: "OrderedDict[Tuple[int, str], None]" = OrderedDict()
+        self.dedupe_hits = 0
+        self.dedupe_misses = 0
+        # Checkpoint per replica, since each replica only applies its own partitions
+        self.stream = "team-service" if self.replicas <= 1 else f"team-service/{self.index}"
+        # Highest sequence seen (None until the stored checkpoint is loaded) and highest one stored
+        self.last_sequence: Optional[int] = None
+        self.saved_sequence = 0
+        # Missing (after, before) sequence ranges still to be fetched from the replay log,
+        # and when the sequences in each were first found missing
+        self._gaps: List[Tuple[int, int]] = []
+        self._gap_found: Dict[Tuple[int, int], float] = {}
+        # Lowest sequence team-service's log still holds, from the last X-Log-Start it sent
+        self.log_start: Optional[int] = None
+        # Ranges fetched for the batch being written, queued again if the write fails
+        self._filled_gaps: List[Tuple[int, int]] = []
+        self.gaps_detected = 0
+        self.gaps_abandoned = 0
+        self.replayed = 0
+        # Publish times of the events parsed since the last commit, and the rolling lag they turn into
+        self._event_times: List[float] = []
+        self.lag = LagSketch()
+        self._lag_checked = 0.0
+        self.lag_alerting = False
+        self.lag_warnings = 0
+        # Received messages are journaled locally first, so a slow or unavailable database never stalls the socket
+        if journal is None and EVENT_JOURNAL_DIR:
+            journal = EventJournal(EVENT_JOURNAL_DIR)
+        self.journal = journal
+        self.writer = None
+        self._journal_wakeup = threading.Event()
+        # Shrinks while a batch keeps failing and grows back as batches are stored
+        self.drain_batch_size = EVENT_JOURNAL_DRAIN_BATCH_SIZE
+        self._drain_failures = 0
+        logger.info(
+            f"ZeroMQ subscriber connected to tcp://team-service:5555 "
+            f"(replica {self.index + 1} of {self.replicas}, {len(self.topics)} topic prefixes)"
+        )
     
     def start(self):
         """Start the subscriber in a background thread"""
         if not self.running:
             self.running = True
+            self._start_journal_writer()
             self.thread = threading.Thread(target=self._listen, daemon=True)
             self.thread.start()
             logger.info("Event subscriber started")
@@ -34,18 +233,35 @@ class EventSubscriber:
         self.running = False
         if self.thread:
             self.thread.join()
+        self._stop_journal_writer()
         self.socket.close()
         self.context.term()
         logger.info("Event subscriber stopped")
     
+    def _start_journal_writer(self):
+        if self.journal is not None:
+            self.writer = threading.Thread(target=self._drain_journal, name="journal-writer", daemon=True)
+            self.writer.start()
+    
+    def _stop_journal_writer(self):
+        if self.journal is not None:
+            self._journal_wakeup.set()
+            if self.writer:
+                self.writer.join()
+            self.journal.close()
+    
     def _listen(self):
         """Listen for events in background thread"""
+        if self.journal is None:
+            # With a journal the writer thread catches up before draining
+            self._catch_up()
         while self.running:
             try:
                 # Set a timeout to check if we should stop
                 if self.socket.poll(1000):  # 1 second timeout
-                    message = self.socket.recv_string(zmq.NOBLOCK)
-                    self._handle_message(message)
+                    self._dispatch(self._receive_batch())
+                elif self.journal is not None:
+                    self.journal.sync()
             except zmq.Again:
                 # No message received within timeout, continue
                 continue
@@ -53,61 +269,684 @@ class EventSubscriber:
                 logger.error(f"Error receiving message: {str(e)}")
                 time.sleep(1)
     
-    def _handle_message(self, message: str):
-        """Handle incoming message"""
+    def _receive_batch(self) -> List[List[bytes]]:
+        """Drain up to batch_size messages, waiting at most flush_interval_ms for more"""
+        messages = [self.socket.recv_multipart(zmq.NOBLOCK)]
+        deadline = time.monotonic() + self.flush_interval_ms / 1000
+        while len(messages) < self.batch_size:
+            remaining_ms = (deadline - time.monotonic()) * 1000
+            if remaining_ms <= 0 or not self.socket.poll(remaining_ms):
+                break
+            messages.append(self.socket.recv_multipart(zmq.NOBLOCK))
+        return messages
+    
+    def _dispatch(self, messages: List[List[bytes]]):
+        """Journal a received batch for the writer, or apply it right away when there is no journal"""
+        if self.journal is None:
+            self._handle_batch(messages)
+            return
+        self.journal.append(messages)
+        self.journal.sync()
+        self._journal_wakeup.set()
+    
+    def _drain_journal(self):
+        """Apply journaled messages to the database in large batches until stopped"""
+        self._catch_up()
+        retry_delay = 0.1
+        while self.running:
+            try:
+                self._journal_wakeup.clear()
+                drained = self._drain_journal_once()
+            except Exception as e:
+                logger.error(f"Error draining the event journal: {str(e)}")
+                drained = False
+            if drained is None:
+                # Nothing pending: make sure what was appended is on disk, then wait for more
+                self.journal.sync(force=True)
+                self._journal_wakeup.wait(1.0)
+            elif drained:
+                retry_delay = 0.1
+            else:
+                # The database is unavailable; the records stay journaled and the listener keeps receiving
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, JOURNAL_RETRY_MAX_SECONDS)
+    
+    def _drain_journal_once(self) -> Optional[bool]:
+        """Apply the next batch from the journal checkpoint; None when nothing is pending"""
+        messages, next_offset = self.journal.read(self.journal.checkpoint, self.drain_batch_size)
+        if not messages:
+            return None
         try:
-            event = json.loads(message)
-            logger.info(f"Received event: {event}")
-            
-            if event.get("event") == "TeamRegistered":
-                self._handle_team_registered(event)
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse JSON message: {message}, error: {str(e)}")
+            stored = self._handle_batch(messages)
         except Exception as e:
-            logger.error(f"Error handling message: {str(e)}")
+            logger.error(f"Error applying {len(messages)} journaled events: {str(e)}")
+            stored = False
+        if not stored:
+            self._drain_failed(messages, next_offset)
+            return False
+        self.journal.commit(next_offset)
+        self._drain_failures = 0
+        self.drain_batch_size = min(self.drain_batch_size * 2, EVENT_JOURNAL_DRAIN_BATCH_SIZE)
+        return True
+    
+    def _drain_failed(self, messages: List[List[bytes]], next_offset: int):
+        """Split a journaled batch that keeps failing, and set aside a single record that does
+        
+        While the database is unreachable every batch fails the same way, so
+        nothing changes until it is back: the journal is there to wait it out.
+        """
+        self._drain_failures += 1
+        if self._drain_failures < EVENT_JOURNAL_MAX_ATTEMPTS:
+            return
+        # Failures that an outage explains say nothing about the batch, so it gets fresh attempts
+        self._drain_failures = 0
+        if not self._database_available():
+            return
+        if len(messages) > 1:
+            self.drain_batch_size = len(messages) // 2
+            logger.warning(
+                f"A batch of {len(messages)} journaled events failed {EVENT_JOURNAL_MAX_ATTEMPTS} times, "
+                f"retrying it in batches of {self.drain_batch_size}"
+            )
+            return
+        self.journal.dead_letter(messages[0])
+        self.journal.commit(next_offset)
+        try:
+            sequence = decode_message(messages[0]).get("sequence")
+        except Exception:
+            sequence = None
+        logger.error(
+            f"Journaled event (sequence {sequence}) failed {EVENT_JOURNAL_MAX_ATTEMPTS} times; "
+            f"moved it to the dead-letter file in {self.journal.directory}"
+        )
     
-    def _handle_team_registered(self, event: Dict[str, Any]):
-        """Handle TeamRegistered event"""
+    def _database_available(self) -> bool:
+        db = SessionLocal()
         try:
-            payload = event.get("payload", {})
-            team_id = payload.get("teamId")
-            team_name = payload.get("name")
+            db.execute(text("SELECT 1"))
+            return True
+        except Exception:
+            return False
+        finally:
+            db.close()
+    
+    def _handle_message(self, message: Union[str, List[bytes]]):
+        """Handle incoming message"""
+        self._handle_batch([message])
+    
+    def _handle_batch(
+        self,
+        messages: List[Union[str, List[bytes], Dict[str, Any]]],
+        detect_gaps: Optional[bool] = None
+    ) -> bool:
+        """Handle a batch of incoming messages with a single insert and commit, returning whether it was stored
+        
+        Gaps are detected in the live stream only with a single replica, since a
+        replica sees just its own partitions; pages replayed from the event log
+        hold every sequence, so catch-up detects them either way.
+        """
+        if not self._ensure_checkpoint():
+            return False
+        if detect_gaps is None:
+            detect_gaps = self.replicas <= 1
+        started = time.perf_counter()
+        rows = self._parse_batch(messages, detect_gaps)
+        rows += self._fill_gaps()
+        stored = True
+        if rows or self._checkpoint() > self.saved_sequence:
+            stored = self._insert_tournament_teams(rows)
+        self._record_lag(stored)
+        EVENTS_CONSUMED.inc(len(messages))
+        EVENT_BATCH_SECONDS.observe(time.perf_counter() - started)
+        return stored
+    
+    def _parse_batch(
+        self,
+        messages: List[Union[str, List[bytes], Dict[str, Any]]],
+        detect_gaps: bool = True
+    ) -> List[Dict[str, Any]]:
+        """Turn a batch of raw messages into tournament team rows"""
+        rows = []
+        batch_keys: Set[Tuple[int, str]] = set()
+        for message in messages:
+            try:
+                event = decode_message(message)
+                logger.debug(f"Received event: {event}")
+                self._track_sequence(event.get("sequence", 0), detect_gaps)
+                published = event_time(event)
+                if published is not None:
+                    self._event_times.append(published)
+                
+                if event.get("event") == "TeamRegistered" and self._owns(event):
+                    row = self._team_registered_row(event)
+                    if row and self._is_new_registration(row, batch_keys):
+                        rows.append(row)
             
-            if not team_id or not team_name:
-                logger.warning(f"Incomplete team data in event: {event}")
+            except json.JSONDecodeError as e:
+                EVENT_HANDLER_ERRORS.inc(labels=("decode",))
+                logger.error(f"Failed to parse JSON message: {message}, error: {str(e)}")
+            except Exception as e:
+                EVENT_HANDLER_ERRORS.inc(labels=("decode",))
+                logger.error(f"Error handling message: {str(e)}")
+        
+        logger.info(f"Received batch of {len(messages)} events")
+        return rows
+    
+    def _record_lag(self, stored: bool):
+        """Turn the publish times of a committed batch into lag samples
+        
+        Events of a batch that failed to store are refetched and measured when
+        they finally commit, so their samples include the time spent retrying.
+        """
+        event_times, self._event_times = self._event_times, []
+        if not stored or not event_times:
+            return
+        committed = time.time()
+        lags = [committed - published for published in event_times]
+        self.lag.record(lags)
+        for lag in lags:
+            EVENT_LAG_SECONDS.observe(max(lag, 0.0))
+        self._check_lag()
+    
+    def _check_lag(self):
+        """Log once when p99 lag crosses EVENT_LAG_WARN_MS and once when it recovers, checking once per window slice"""
+        now = time.monotonic()
+        if EVENT_LAG_WARN_MS <= 0 or now - self._lag_checked < self.lag.slice_seconds:
+            return
+        self._lag_checked = now
+        p99 = self.lag.percentile(0.99)
+        if p99 is None:
+            return
+        if p99 * 1000 > EVENT_LAG_WARN_MS and not self.lag_alerting:
+            self.lag_alerting = True
+            self.lag_warnings += 1
+            logger.warning(
+                f"p99 event lag is {p99 * 1000:.0f} ms over the last {self.lag.window_seconds:.0f}s, "
+                f"above EVENT_LAG_WARN_MS={EVENT_LAG_WARN_MS:.0f}"
+            )
+        elif p99 * 1000 <= EVENT_LAG_WARN_MS and self.lag_alerting:
+            self.lag_alerting = False
+            logger.info(f"p99 event lag is back to {p99 * 1000:.0f} ms")
+    
+    def lag_stats(self) -> Dict[str, Any]:
+        """Rolling publish-to-commit lag and what is still waiting to be applied"""
+        journal_pending = self.journal.pending_bytes() if self.journal is not None else 0
+        return {
+            **self.lag.snapshot(),
+            "warn_ms": EVENT_LAG_WARN_MS,
+            "alerting": self.lag_alerting,
+            "warnings": self.lag_warnings,
+            "backlog": {
+                # Sequences received but not yet covered by the stored checkpoint
+                "sequences_behind": max((self.last_sequence or 0) - self.saved_sequence, 0),
+                "pending_gaps": len(self._gaps),
+                "journal_pending_bytes": journal_pending,
+            },
+        }
+    
+    def _owns(self, event: Dict[str, Any]) -> bool:
+        """Whether this replica is responsible for an event; live ones are already filtered by topic"""
+        if self.replicas <= 1:
+            return True
+        team_id = str(event.get("payload", {}).get("teamId", ""))
+        return zlib.crc32(team_id.encode()) % EVENT_PARTITIONS % self.replicas == self.index
+    
+    def _track_sequence(self, sequence: int, detect_gaps: bool):
+        """Advance the highest seen sequence and remember any range skipped on the way"""
+        if not sequence or self.last_sequence is None:
+            return
+        if detect_gaps and sequence > self.last_sequence + 1:
+            self._add_gap(self.last_sequence, sequence)
+            self.gaps_detected += 1
+            logger.warning(f"Missed events {self.last_sequence + 1}..{sequence - 1}, fetching them from the event log")
+        self.last_sequence = max(self.last_sequence, sequence)
+    
+    def _checkpoint(self) -> int:
+        """Highest sequence with nothing missing at or below it"""
+        if self._gaps:
+            return min(after for after, _ in self._gaps)
+        return self.last_sequence or 0
+    
+    def _check_log_start(self, after: int, log_start: Optional[str]):
+        if log_start is None:
+            return
+        self.log_start = int(log_start)
+        if after + 1 < self.log_start:
+            logger.error(
+                f"Events {after + 1}..{int(log_start) - 1} were pruned from team-service's log "
+                f"before this consumer applied them; a full resync is needed to recover them"
+            )
+    
+    def _event_pages(self, after: int, before: Optional[int] = None) -> Iterator[List[Dict[str, Any]]]:
+        """Page through GET /events from after, stopping before the given sequence"""
+        with httpx.Client(base_url=TEAM_SERVICE_URL, timeout=10) as client:
+            while True:
+                response = client.get("/events", params={"after": after, "limit": EVENT_REPLAY_BATCH_SIZE})
+                response.raise_for_status()
+                self._check_log_start(after, response.headers.get("X-Log-Start"))
+                page = [event for event in response.json() if before is None or event["sequence"] < before]
+                if page:
+                    yield page
+                cursor = response.headers.get("X-Next-Cursor")
+                if cursor is None or (before is not None and int(cursor) >= before - 1):
+                    return
+                after = int(cursor)
+    
+    def _fill_gaps(self) -> List[Dict[str, Any]]:
+        """Fetch missed ranges from the event log, keeping the ones that fail for the next batch"""
+        rows = []
+        self._filled_gaps = []
+        for after, before in list(self._gaps):
+            if not TEAM_SERVICE_URL:
+                break
+            try:
+                events = [event for page in self._event_pages(after, before) for event in page]
+            except Exception as e:
+                logger.error(f"Failed to fetch missed events after {after}: {str(e)}")
+                break
+            rows += self._apply_gap_fill(after, before, events)
+        return rows
+    
+    def _apply_gap_fill(self, after: int, before: int, events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Take the events fetched for a gap, keeping whatever the log did not return yet as smaller gaps"""
+        found_at = self._remove_gap(after, before)
+        self._filled_gaps.append((after, before))
+        self.replayed += len(events)
+        received = sorted({event["sequence"] for event in events if after < event["sequence"] < before})
+        low = after
+        for sequence in received + [before]:
+            if sequence > low + 1:
+                self._keep_missing(low, sequence, found_at)
+            low = sequence
+        return self._parse_batch(events, detect_gaps=False)
+    
+    def _keep_missing(self, after: int, before: int, found_at: float):
+        """Queue sequences the log did not return for another fetch, unless they were pruned or are too old
+        
+        A sequence missing from the log is usually a transaction that has not
+        committed yet; dropping it would move the checkpoint past an event that
+        is never replayed. Pruned ones were already reported by _check_log_start.
+        """
+        if self.log_start is not None:
+            after = max(after, min(self.log_start, before) - 1)
+        if after + 1 >= before:
+            return
+        if time.monotonic() - found_at > EVENT_GAP_MAX_AGE_SECONDS:
+            self.gaps_abandoned += 1
+            logger.warning(
+                f"Events {after + 1}..{before - 1} are still missing from the event log after "
+                f"{EVENT_GAP_MAX_AGE_SECONDS:.0f}s; treating them as rolled back"
+            )
+            return
+        self._add_gap(after, before, found_at)
+    
+    def _add_gap(self, after: int, before: int, found_at: Optional[float] = None):
+        self._gaps.append((after, before))
+        self._gap_found[(after, before)] = found_at if found_at is not None else time.monotonic()
+    
+    def _remove_gap(self, after: int, before: int) -> float:
+        """Drop a queued gap, returning when its sequences were first found missing"""
+        self._gaps.remove((after, before))
+        return self._gap_found.pop((after, before), time.monotonic())
+    
+    def _load_checkpoint(self) -> int:
+        db = SessionLocal()
+        try:
+            offset = db.get(EventOffset, self.stream)
+            return offset.sequence if offset else 0
+        finally:
+            db.close()
+    
+    def _use_checkpoint(self, sequence: int):
+        self.saved_sequence = self.last_sequence = sequence
+        logger.info(f"Resuming from event checkpoint {sequence}")
+    
+    def _ensure_checkpoint(self) -> bool:
+        """Load the stored checkpoint if that failed at start, e.g. because the database was down
+        
+        Until it is known no batch is applied: sequences could not be tracked, so
+        gaps would go unnoticed and the checkpoint would never be stored. Events
+        of a batch refused here are journaled and retried, or without a journal
+        fetched again as the gap in front of the first event after the load.
+        """
+        if self.last_sequence is not None:
+            return True
+        try:
+            self._use_checkpoint(self._load_checkpoint())
+            return True
+        except Exception as e:
+            logger.error(f"Failed to load the event checkpoint, retrying with the next batch: {str(e)}")
+            return False
+    
+    def _catch_up(self):
+        """Apply everything logged since the stored checkpoint before consuming live events"""
+        if not self._ensure_checkpoint():
+            return
+        try:
+            if not TEAM_SERVICE_URL:
                 return
+            logger.info(f"Catching up on events after sequence {self.saved_sequence}")
+            for page in self._event_pages(self.saved_sequence):
+                if not self.running:
+                    break
+                self.replayed += len(page)
+                # A hole in the log is an event not committed yet, so it is tracked as a gap rather than skipped
+                self._handle_batch(page, detect_gaps=True)
+        except Exception as e:
+            # Live events still flow; the first one past the checkpoint will trigger a gap fill
+            logger.error(f"Failed to catch up from the event log: {str(e)}")
+    
+    def _team_registered_row(self, event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Map a TeamRegistered event to a tournament team row"""
+        payload = event.get("payload", {})
+        team_id = payload.get("teamId")
+        team_name = payload.get("name")
+        
+        if not team_id or not team_name:
+            logger.warning(f"Incomplete team data in event: {event}")
+            return None
+        
+        # Create a tournament team record (demonstrating reaction to event)
+        return {
+            "tournament_id": 1,  # Default tournament for demo
+            "team_id": team_id,
+            "team_name": team_name
+        }
+    
+    def _is_new_registration(self, row: Dict[str, Any], batch_keys: Set[Tuple[int, str]]) -> bool:
+        """Check the dedupe cache and the current batch for an already applied registration"""
+        key = (row["tournament_id"], row["team_id"])
+        if key in self._applied:
+            self._applied.move_to_end(key)
+            self.dedupe_hits += 1
+            return False
+        if key in batch_keys:
+            self.dedupe_hits += 1
+            return False
+        self.dedupe_misses += 1
+        batch_keys.add(key)
+        return True
+    
+    def _remember_applied(self, rows: List[Dict[str, Any]]):
+        """Record committed registrations, evicting the least recently seen beyond capacity"""
+        for row in rows:
+            self._applied[(row["tournament_id"], row["team_id"])] = None
+        while len(self._applied) > EVENT_DEDUPE_CACHE_SIZE:
+            self._applied.popitem(last=False)
+    
+    def stats(self) -> Dict[str, Any]:
+        journal_stats = {}
+        if self.journal is not None:
+            journal_stats = {**self.journal.stats(), "journal_drain_batch_size": self.drain_batch_size}
+        return {
+            **journal_stats,
+            "dedupe_cache_size": len(self._applied),
+            "dedupe_cache_capacity": EVENT_DEDUPE_CACHE_SIZE,
+            "dedupe_hits": self.dedupe_hits,
+            "dedupe_misses": self.dedupe_misses,
+            "consumer_replicas": self.replicas,
+            "consumer_index": self.index,
+            "owned_partitions": len(self.topics) if self.replicas > 1 else EVENT_PARTITIONS,
+            "last_sequence": self.last_sequence,
+            "checkpoint": self.saved_sequence,
+            "pending_gaps": len(self._gaps),
+            "gaps_detected": self.gaps_detected,
+            "gaps_abandoned": self.gaps_abandoned,
+            "replayed": self.replayed,
+        }
+    
+    def _insert_tournament_teams(self, rows: List[Dict[str, Any]]) -> bool:
+        """Write tournament team rows with one multi-row insert, ignoring ones already stored"""
+        db = SessionLocal()
+        try:
+            dialect_name = db.get_bind().dialect.name
+            if rows:
+                lock_change_feed(db, "tournament_teams")
+                record_tournament_team_digests(db, db.execute(insert_tournament_teams_statement(dialect_name), rows).all())
+            # The checkpoint commits with the rows it covers
+            checkpoint = self._checkpoint()
+            if checkpoint > self.saved_sequence:
+                db.execute(upsert_event_offset_statement(dialect_name, self.stream, checkpoint))
+            db.commit()
+            # Only cache keys once they are durable, so a failed batch is retried on redelivery
+            self._remember_applied(rows)
+            self.saved_sequence = max(self.saved_sequence, checkpoint)
+            announce_tournament_teams(rows)
             
-            db = SessionLocal()
+            logger.info(f"Applied {len(rows)} tournament team entries")
+            return True
+        
+        except Exception as e:
+            db.rollback()
+            self._refetch_unsaved()
+            EVENT_HANDLER_ERRORS.inc(labels=("write",))
+            logger.error(f"Failed to create tournament team entries: {str(e)}")
+            return False
+        finally:
+            db.close()
+    
+    def _refetch_unsaved(self):
+        """After a failed write, queue what it covered for a refetch
+        
+        With a journal the batch's live events stay journaled and are retried
+        from there, so only the ranges fetched from the event log for it are
+        queued again. Without one everything past the stored checkpoint is.
+        """
+        if self.journal is not None:
+            ranges = self._filled_gaps
+        elif self.last_sequence is not None and self.last_sequence > self.saved_sequence:
+            ranges = [(self.saved_sequence, self.last_sequence + 1)]
+        else:
+            ranges = []
+        for after, before in ranges:
+            self._queue_gap(after, before)
+        self._filled_gaps = []
+    
+    def _queue_gap(self, after: int, before: int):
+        """Queue a range for a refetch unless it is already covered, replacing queued ranges inside it"""
+        if any(queued_after <= after and before <= queued_before for queued_after, queued_before in self._gaps):
+            return
+        found_at = time.monotonic()
+        for a, b in list(self._gaps):
+            if after <= a and b <= before:
+                found_at = min(found_at, self._remove_gap(a, b))
+        self._add_gap(after, before, found_at)
+
+class AsyncEventSubscriber(EventSubscriber):
+    """Subscriber that runs as a task on the application's event loop"""
+    context_class = zmq.asyncio.Context
+    
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        flush_interval_ms: Optional[int] = None,
+        replicas: Optional[int] = None,
+        index: Optional[int] = None,
+        journal: Optional[EventJournal] = None
+    ):
+        super().__init__(batch_size, flush_interval_ms, replicas, index, journal)
+        self.task = None
+    
+    def start(self):
+        """Start the subscriber as a task on the running event loop"""
+        if not self.running:
+            self.running = True
+            self._start_journal_writer()
+            self.task = asyncio.get_running_loop().create_task(self._listen_async())
+            logger.info("Async event subscriber started")
+    
+    def stop(self):
+        """Stop the subscriber by cancelling its task, without waiting for a poll timeout"""
+        self.running = False
+        if self.task and not self.task.done():
+            self.task.cancel()
+        self._stop_journal_writer()
+        self.socket.close(linger=0)
+        self.context.term()
+        logger.info("Async event subscriber stopped")
+    
+    async def _listen_async(self):
+        """Listen for events until cancelled"""
+        if self.journal is None:
+            await self._catch_up_async()
+        while self.running:
             try:
-                # Create a tournament team record (demonstrating reaction to event)
-                tournament_team = TournamentTeam(
-                    tournament_id=1,  # Default tournament for demo
-                    team_id=team_id,
-                    team_name=team_name
-                )
-                
-                db.add(tournament_team)
-                db.commit()
-                
-                logger.info(f"Created tournament team entry for team: {team_name} (ID: {team_id})")
-                
+                messages = await self._receive_batch_async()
+                if self.journal is None:
+                    await self._handle_batch_async(messages)
+                else:
+                    self.journal.append(messages)
+                    # The fsync runs off the event loop
+                    await asyncio.get_running_loop().run_in_executor(None, self.journal.sync)
+                    self._journal_wakeup.set()
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                db.rollback()
-                logger.error(f"Failed to create tournament team entry: {str(e)}")
-            finally:
-                db.close()
-                
+                logger.error(f"Error receiving message: {str(e)}")
+                await asyncio.sleep(1)
+    
+    async def _receive_batch_async(self) -> List[List[bytes]]:
+        """Wait for one message, then drain up to batch_size within flush_interval_ms"""
+        messages = [await self.socket.recv_multipart()]
+        deadline = time.monotonic() + self.flush_interval_ms / 1000
+        while len(messages) < self.batch_size:
+            remaining_ms = (deadline - time.monotonic()) * 1000
+            if remaining_ms <= 0 or not await self.socket.poll(remaining_ms):
+                break
+            messages.append(await self.socket.recv_multipart(zmq.NOBLOCK))
+        return messages
+    
+    async def _handle_batch_async(
+        self,
+        messages: List[Union[str, List[bytes], Dict[str, Any]]],
+        detect_gaps: Optional[bool] = None
+    ):
+        """Handle a batch of incoming messages with a single async insert and commit"""
+        if not await self._ensure_checkpoint_async():
+            return
+        if detect_gaps is None:
+            detect_gaps = self.replicas <= 1
+        started = time.perf_counter()
+        rows = self._parse_batch(messages, detect_gaps)
+        rows += await self._fill_gaps_async()
+        stored = True
+        if rows or self._checkpoint() > self.saved_sequence:
+            stored = await self._insert_tournament_teams_async(rows)
+        self._record_lag(stored)
+        EVENTS_CONSUMED.inc(len(messages))
+        EVENT_BATCH_SECONDS.observe(time.perf_counter() - started)
+    
+    async def _event_pages_async(self, after: int, before: Optional[int] = None) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Page through GET /events without blocking the event loop"""
+        async with httpx.AsyncClient(base_url=TEAM_SERVICE_URL, timeout=10) as client:
+            while True:
+                response = await client.get("/events", params={"after": after, "limit": EVENT_REPLAY_BATCH_SIZE})
+                response.raise_for_status()
+                self._check_log_start(after, response.headers.get("X-Log-Start"))
+                page = [event for event in response.json() if before is None or event["sequence"] < before]
+                if page:
+                    yield page
+                cursor = response.headers.get("X-Next-Cursor")
+                if cursor is None or (before is not None and int(cursor) >= before - 1):
+                    return
+                after = int(cursor)
+    
+    async def _fill_gaps_async(self) -> List[Dict[str, Any]]:
+        rows = []
+        self._filled_gaps = []
+        for after, before in list(self._gaps):
+            if not TEAM_SERVICE_URL:
+                break
+            try:
+                events = [event async for page in self._event_pages_async(after, before) for event in page]
+            except Exception as e:
+                logger.error(f"Failed to fetch missed events after {after}: {str(e)}")
+                break
+            rows += self._apply_gap_fill(after, before, events)
+        return rows
+    
+    async def _ensure_checkpoint_async(self) -> bool:
+        if self.last_sequence is not None:
+            return True
+        try:
+            async with AsyncSessionLocal() as db:
+                offset = await db.get(EventOffset, self.stream)
+            self._use_checkpoint(offset.sequence if offset else 0)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to load the event checkpoint, retrying with the next batch: {str(e)}")
+            return False
+    
+    async def _catch_up_async(self):
+        if not await self._ensure_checkpoint_async():
+            return
+        try:
+            if not TEAM_SERVICE_URL:
+                return
+            logger.info(f"Catching up on events after sequence {self.saved_sequence}")
+            async for page in self._event_pages_async(self.saved_sequence):
+                self.replayed += len(page)
+                await self._handle_batch_async(page, detect_gaps=True)
         except Exception as e:
-            logger.error(f"Error handling TeamRegistered event: {str(e)}")
+            logger.error(f"Failed to catch up from the event log: {str(e)}")
+    
+    async def _insert_tournament_teams_async(self, rows: List[Dict[str, Any]]) -> bool:
+        """Write tournament team rows with one multi-row insert on the async engine"""
+        async with AsyncSessionLocal() as db:
+            try:
+                dialect_name = db.bind.dialect.name
+                if rows:
+                    lock = change_feed_lock_statement(dialect_name, "tournament_teams")
+                    if lock is not None:
+                        await db.execute(lock)
+                    inserted = (await db.execute(insert_tournament_teams_statement(dialect_name), rows)).all()
+                    updates = digest_bucket_updates(inserted)
+                    if updates:
+                        await db.execute(upsert_digest_buckets_statement(dialect_name), updates)
+                checkpoint = self._checkpoint()
+                if checkpoint > self.saved_sequence:
+                    await db.execute(upsert_event_offset_statement(dialect_name, self.stream, checkpoint))
+                await db.commit()
+                self._remember_applied(rows)
+                self.saved_sequence = max(self.saved_sequence, checkpoint)
+                announce_tournament_teams(rows)
+                
+                logger.info(f"Applied {len(rows)} tournament team entries")
+                return True
+            
+            except Exception as e:
+                await db.rollback()
+                self._refetch_unsaved()
+                EVENT_HANDLER_ERRORS.inc(labels=("write",))
+                logger.error(f"Failed to create tournament team entries: {str(e)}")
+                return False
 
 # Global subscriber instance
 _subscriber = None
 
+def _subscriber_stat(key: str) -> float:
+    return (_subscriber.stats().get(key) or 0) if _subscriber is not None else 0
+
+REGISTRY.callback(
+    "event_checkpoint_sequence", "Highest event sequence stored with the registrations it covers", "gauge",
+    lambda: _subscriber_stat("checkpoint")
+)
+REGISTRY.callback(
+    "event_gaps_detected_total", "Sequence gaps noticed in the live stream", "counter",
+    lambda: _subscriber_stat("gaps_detected")
+)
+REGISTRY.callback(
+    "event_journal_pending_bytes", "Journaled events not yet applied to the database", "gauge",
+    lambda: _subscriber_stat("journal_pending_bytes")
+)
+
 def get_subscriber():
     global _subscriber
     if _subscriber is None:
-        _subscriber = EventSubscriber()
+        if EVENT_SUBSCRIBER_MODE == "asyncio":
+            _subscriber = AsyncEventSubscriber()
+        else:
+            _subscriber = EventSubscriber()
     return _subscriber
 
 def start_event_subscriber():
@@ -0,0 +1,220 @@
+import os
+import mmap
+import msgpack
+import logging
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Directory for the local receive journal; empty writes events straight to the database instead
+EVENT_JOURNAL_DIR = os.getenv("EVENT_JOURNAL_DIR", "")
+EVENT_JOURNAL_SEGMENT_BYTES = int(os.getenv("EVENT_JOURNAL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+# Appends are flushed to disk at most this often, so one fsync covers many received batches
+EVENT_JOURNAL_FSYNC_INTERVAL_MS = int(os.getenv("EVENT_JOURNAL_FSYNC_INTERVAL_MS", "50"))
+
+# Each record is its payload length and CRC32 followed by the msgpack-encoded message frames;
+# a zero length marks the unused tail of a segment
+RECORD_HEADER = struct.Struct("!II")
+SEGMENT_SUFFIX = ".journal"
+CHECKPOINT_FILE = "checkpoint"
+# Records that could not be applied, appended in the same record format
+DEAD_LETTER_FILE = "dead-letter"
+
+class EventJournal:
+    """Append-only, memory-mapped journal of received event messages
+    
+    The listener appends every received batch here before anything touches
+    the database, and a writer reads from the checkpoint onwards, applies
+    the messages and commits a new checkpoint. Offsets are global byte
+    positions; each segment file is named after the offset it starts at
+    and is deleted once the checkpoint has moved past it.
+    """
+    
+    def __init__(self, directory: str, segment_bytes: Optional[int] = None, fsync_interval_ms: Optional[int] = None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes or EVENT_JOURNAL_SEGMENT_BYTES
+        interval_ms = fsync_interval_ms if fsync_interval_ms is not None else EVENT_JOURNAL_FSYNC_INTERVAL_MS
+        self.fsync_interval = interval_ms / 1000
+        self._lock = threading.Lock()
+        self._segments: Dict[int, mmap.mmap] = {}
+        self._dirty = False
+        self._last_sync = time.monotonic()
+        self.appended = 0
+        self.syncs = 0
+        self.dead_letters = 0
+        
+        os.makedirs(directory, exist_ok=True)
+        self.checkpoint = self._read_checkpoint()
+        bases = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)
+        )
+        for base in bases:
+            self._segments[base] = self._map_segment(base)
+        if not self._segments:
+            self._segments[self.checkpoint] = self._map_segment(self.checkpoint)
+        self._active_base = max(self._segments)
+        
+        # Everything past the last intact record (e.g. a write torn by a crash) is overwritten
+        self.write_offset = self._recover()
+        self._active_base = self._segment_for(self.write_offset)
+        logger.info(
+            f"Event journal at {directory}: checkpoint {self.checkpoint}, "
+            f"{self.write_offset - self.checkpoint} bytes pending"
+        )
+    
+    def _segment_path(self, base: int) -> str:
+        return os.path.join(self.directory, f"{base:020d}{SEGMENT_SUFFIX}")
+    
+    def _map_segment(self, base: int) -> mmap.mmap:
+        path = self._segment_path(base)
+        with open(path, "a+b") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                f.truncate(self.segment_bytes)
+            return mmap.mmap(f.fileno(), 0)
+    
+    def _read_checkpoint(self) -> int:
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT_FILE)) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+    
+    def _segment_for(self, offset: int) -> int:
+        with self._lock:
+            return max(base for base in self._segments if base <= offset)
+    
+    def _next_segment(self, base: int) -> Optional[int]:
+        with self._lock:
+            later = [other for other in self._segments if other > base]
+        return min(later) if later else None
+    
+    def _read_record(self, offset: int) -> Optional[Tuple[List[bytes], int]]:
+        """Decode the record at offset, returning it with the next offset, or None at the end"""
+        base = self._segment_for(offset)
+        buffer = self._segments[base]
+        position = offset - base
+        length = 0
+        if position + RECORD_HEADER.size <= len(buffer):
+            length, crc = RECORD_HEADER.unpack_from(buffer, position)
+        if length == 0:
+            next_base = self._next_segment(base)
+            return self._read_record(next_base) if next_base is not None else None
+        
+        start = position + RECORD_HEADER.size
+        end = start + length
+        if end > len(buffer):
+            return None
+        payload = buffer[start:end]
+        if zlib.crc32(payload) != crc:
+            return None
+        return msgpack.unpackb(payload), base + end
+    
+    def _recover(self) -> int:
+        offset = self.checkpoint
+        while True:
+            record = self._read_record(offset)
+            if record is None:
+                return offset
+            offset = record[1]
+    
+    def append(self, messages: List[List[bytes]]) -> int:
+        """Append received messages and return the offset just past them"""
+        with self._lock:
+            for frames in messages:
+                payload = msgpack.packb(frames)
+                needed = RECORD_HEADER.size + len(payload)
+                if needed + RECORD_HEADER.size > self.segment_bytes:
+                    raise ValueError(f"Journal record of {needed} bytes does not fit in a segment")
+                
+                buffer = self._segments[self._active_base]
+                position = self.write_offset - self._active_base
+                if position + needed > len(buffer):
+                    # Start a new segment at the current offset; the old one's tail reads as empty
+                    buffer.flush()
+                    self._active_base = self.write_offset
+                    self._segments[self._active_base] = buffer = self._map_segment(self._active_base)
+                    position = 0
+                
+                RECORD_HEADER.pack_into(buffer, position, len(payload), zlib.crc32(payload))
+                buffer[position + RECORD_HEADER.size:position + needed] = payload
+                # Clear the following header so stale bytes can never pass for a record
+                if position + needed + RECORD_HEADER.size <= len(buffer):
+                    RECORD_HEADER.pack_into(buffer, position + needed, 0, 0)
+                self.write_offset += needed
+                self.appended += 1
+            self._dirty = True
+            return self.write_offset
+    
+    def sync(self, force: bool = False):
+        """Flush appended records to disk, at most once per fsync interval unless forced"""
+        with self._lock:
+            if not self._dirty:
+                return
+            if not force and time.monotonic() - self._last_sync < self.fsync_interval:
+                return
+            self._segments[self._active_base].flush()
+            self._dirty = False
+            self._last_sync = time.monotonic()
+            self.syncs += 1
+    
+    def read(self, offset: int, max_records: int) -> Tuple[List[List[bytes]], int]:
+        """Read up to max_records messages from offset, returning them and the offset after them"""
+        messages = []
+        while len(messages) < max_records and offset < self.write_offset:
+            record = self._read_record(offset)
+            if record is None:
+                break
+            frames, offset = record
+            messages.append(frames)
+        return messages, offset
+    
+    def commit(self, offset: int):
+        """Durably record that everything before offset has been applied, then drop spent segments"""
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self.checkpoint = offset
+        
+        with self._lock:
+            bases = sorted(self._segments)
+            spent = [base for base, next_base in zip(bases, bases[1:]) if next_base <= offset]
+            for base in spent:
+                self._segments.pop(base).close()
+                os.remove(self._segment_path(base))
+    
+    def dead_letter(self, frames: List[bytes]):
+        """Durably set a record aside in the dead-letter file; the caller then commits past it"""
+        payload = msgpack.packb(frames)
+        with open(os.path.join(self.directory, DEAD_LETTER_FILE), "ab") as f:
+            f.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self.dead_letters += 1
+    
+    def pending_bytes(self) -> int:
+        return self.write_offset - self.checkpoint
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "journal_write_offset": self.write_offset,
+            "journal_checkpoint": self.checkpoint,
+            "journal_pending_bytes": self.pending_bytes(),
+            "journal_segments": len(self._segments),
+            "journal_appended": self.appended,
+            "journal_syncs": self.syncs,
+            "journal_dead_letters": self.dead_letters,
+        }
+    
+    def close(self):
+        self.sync(force=True)
+        with self._lock:
+            for buffer in self._segments.values():
+                buffer.close()
+            self._segments.clear()
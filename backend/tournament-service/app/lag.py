@@ -0,0 +1,126 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+# Lag percentiles cover the events committed in this many trailing seconds
+EVENT_LAG_WINDOW_SECONDS = float(os.getenv("EVENT_LAG_WINDOW_SECONDS", "60"))
+# The window advances in this many steps, so old events age out a slice at a time
+LAG_WINDOW_SLICES = 6
+
+# Values below SUB_BUCKETS microseconds get a bucket each; above that every power of two
+# is split into SUB_BUCKETS / 2 buckets, which keeps any reported value within about 3%
+SUB_BUCKET_BITS = 6
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKETS = SUB_BUCKETS // 2
+
+def bucket_index(value_us: int) -> int:
+    if value_us < SUB_BUCKETS:
+        return value_us
+    shift = value_us.bit_length() - SUB_BUCKET_BITS
+    return shift * HALF_SUB_BUCKETS + (value_us >> shift)
+
+def bucket_bounds(index: int) -> Tuple[int, int]:
+    """Inclusive lowest and highest microsecond value counted in a bucket"""
+    if index < SUB_BUCKETS:
+        return index, index
+    shift = index // HALF_SUB_BUCKETS - 1
+    lowest = (index - shift * HALF_SUB_BUCKETS) << shift
+    return lowest, lowest + (1 << shift) - 1
+
+class LagSketch:
+    """Rolling latency sketch in the style of HdrHistogram
+    
+    Lags are counted in logarithmically sized microsecond buckets, so memory
+    stays bounded by the range of values rather than their number and any
+    percentile is answered to within a few percent. Counts are kept per
+    slice of the window and dropped as slices expire. Sketches from several
+    replicas merge by adding bucket counts.
+    """
+    
+    def __init__(self, window_seconds: Optional[float] = None, slices: int = LAG_WINDOW_SLICES):
+        self.window_seconds = window_seconds or EVENT_LAG_WINDOW_SECONDS
+        self.slices = slices
+        self.slice_seconds = self.window_seconds / slices
+        self._lock = threading.Lock()
+        self._window: Deque[Tuple[int, Dict[int, int]]] = deque()
+        self.recorded = 0
+        # Lags below zero mean the publisher's clock is ahead of ours; they are counted as zero
+        self.clock_skewed = 0
+    
+    def _current_slice(self) -> Dict[int, int]:
+        number = int(time.monotonic() // self.slice_seconds)
+        while self._window and self._window[0][0] <= number - self.slices:
+            self._window.popleft()
+        if not self._window or self._window[-1][0] != number:
+            self._window.append((number, {}))
+        return self._window[-1][1]
+    
+    def record(self, lags_seconds: Iterable[float]):
+        with self._lock:
+            counts = self._current_slice()
+            for lag in lags_seconds:
+                if lag < 0:
+                    self.clock_skewed += 1
+                    lag = 0
+                index = bucket_index(int(lag * 1_000_000))
+                counts[index] = counts.get(index, 0) + 1
+                self.recorded += 1
+    
+    def buckets(self) -> List[Tuple[int, int]]:
+        """(bucket index, count) pairs for the current window, lowest lag first"""
+        with self._lock:
+            self._current_slice()
+            merged: Dict[int, int] = {}
+            for _, counts in self._window:
+                for index, count in counts.items():
+                    merged[index] = merged.get(index, 0) + count
+        return sorted(merged.items())
+    
+    def percentiles(
+        self,
+        quantiles: Iterable[float],
+        buckets: Optional[List[Tuple[int, int]]] = None
+    ) -> Dict[float, Optional[float]]:
+        """Lag in seconds at each quantile, reported as the middle of its bucket; None for an empty window"""
+        buckets = self.buckets() if buckets is None else buckets
+        total = sum(count for _, count in buckets)
+        results: Dict[float, Optional[float]] = {}
+        for quantile in quantiles:
+            if not total:
+                results[quantile] = None
+                continue
+            rank = max(1, int(quantile * total + 0.5))
+            seen = 0
+            for index, count in buckets:
+                seen += count
+                if seen >= rank:
+                    lowest, highest = bucket_bounds(index)
+                    results[quantile] = (lowest + highest) / 2 / 1_000_000
+                    break
+        return results
+    
+    def percentile(self, quantile: float) -> Optional[float]:
+        return self.percentiles([quantile])[quantile]
+    
+    def snapshot(self) -> Dict[str, Any]:
+        buckets = self.buckets()
+        p50, p90, p99, p999 = self.percentiles([0.5, 0.9, 0.99, 0.999], buckets).values()
+        
+        def ms(seconds: Optional[float]) -> Optional[float]:
+            return round(seconds * 1000, 3) if seconds is not None else None
+        
+        return {
+            "window_seconds": self.window_seconds,
+            "count": sum(count for _, count in buckets),
+            "p50_ms": ms(p50),
+            "p90_ms": ms(p90),
+            "p99_ms": ms(p99),
+            "p999_ms": ms(p999),
+            "max_ms": ms(bucket_bounds(buckets[-1][0])[1] / 1_000_000) if buckets else None,
+            "recorded": self.recorded,
+            "clock_skewed": self.clock_skewed,
+            # Inclusive microsecond bounds and counts, enough to merge sketches from several replicas
+            "buckets": [[*bucket_bounds(index), count] for index, count in buckets],
+        }
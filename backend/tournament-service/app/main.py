@@ -1,13 +1,23 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 import logging
 import sys
 import atexit
+from sqlalchemy.orm import Session
 
 from .api import router
-from .database import create_tables
-from .events import start_event_subscriber, stop_event_subscriber
+from .database import (
+    DB_ASYNC, SessionLocal, AsyncSessionLocal, create_tables, create_tables_async, get_pool_stats, run_db
+)
+from .events import get_subscriber, start_event_subscriber, stop_event_subscriber
+from .metrics import REGISTRY, MetricsMiddleware, instrument_queries
+from .profiling import ProfilingMiddleware
+from .reconciler import get_reconciler, start_reconciler, stop_reconciler
 from .models import Tournament
+from .slow_queries import get_slow_query_log
+from .stream import get_broadcaster, start_event_stream
+from .versions import response_cache
 
 # Configure logging
 logging.basicConfig(
@@ -27,41 +37,99 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+# Per-route latency histograms and SQL timings for /metrics
+app.add_middleware(MetricsMiddleware)
+instrument_queries()
+
+# cProfile for requests sent with X-Profile, when PROFILING_ENABLED is set
+app.add_middleware(ProfilingMiddleware)
+
 # Include API router
 app.include_router(router)
 
+def ensure_default_tournament(db: Session):
+    default_tournament = db.query(Tournament).filter(Tournament.id == 1).first()
+    if not default_tournament:
+        default_tournament = Tournament(name="Default Tournament")
+        db.add(default_tournament)
+        db.commit()
+        logger.info("Created default tournament")
+
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting Tournament Service...")
-    create_tables()
+    if DB_ASYNC:
+        await create_tables_async()
+    else:
+        create_tables()
     logger.info("Database tables created/verified")
     
     # Create default tournament if it doesn't exist
-    from .database import SessionLocal
-    db = SessionLocal()
-    try:
-        default_tournament = db.query(Tournament).filter(Tournament.id == 1).first()
-        if not default_tournament:
-            default_tournament = Tournament(name="Default Tournament")
-            db.add(default_tournament)
-            db.commit()
-            logger.info("Created default tournament")
-    finally:
-        db.close()
+    if DB_ASYNC:
+        async with AsyncSessionLocal() as db:
+            await run_db(db, ensure_default_tournament)
+    else:
+        db = SessionLocal()
+        try:
+            ensure_default_tournament(db)
+        finally:
+            db.close()
+    
+    # Let the subscriber push applied registrations to /stream/tournament-teams clients
+    start_event_stream()
     
     # Start event subscriber
     start_event_subscriber()
+    
+    # Periodically repair registrations missed despite replay (e.g. pruned from the event log)
+    start_reconciler()
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down Tournament Service...")
+    stop_reconciler()
     stop_event_subscriber()
 
 # Register cleanup on exit
 atexit.register(stop_event_subscriber)
+atexit.register(stop_reconciler)
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy", "service": "tournament-service"}
\ No newline at end of file
+    return {"status": "healthy", "service": "tournament-service"}
+
+@app.get("/subscriber/stats")
+def subscriber_stats():
+    return get_subscriber().stats()
+
+@app.get("/subscriber/lag")
+def subscriber_lag():
+    return get_subscriber().lag_stats()
+
+@app.get("/reconciler/stats")
+def reconciler_stats():
+    return get_reconciler().stats()
+
+@app.get("/pool/stats")
+def db_pool_stats():
+    return get_pool_stats()
+
+@app.get("/admin/slow-queries")
+def slow_queries(limit: int = 50):
+    slow_query_log = get_slow_query_log()
+    return {**slow_query_log.stats(), "queries": slow_query_log.entries(limit)}
+
+@app.get("/cache/stats")
+def cache_stats():
+    return response_cache.stats()
+
+@app.get("/stream/stats")
+def stream_stats():
+    return get_broadcaster().stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
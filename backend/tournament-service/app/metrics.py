@@ -0,0 +1,348 @@
+import os
+import math
+import time
+import bisect
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import event
+from sqlalchemy import exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+# SQLAlchemy's cursor events cost a few microseconds per statement; set to false to skip query timings
+METRICS_QUERY_TIMING = os.getenv("METRICS_QUERY_TIMING", "true").lower() == "true"
+
+# Seconds; spans cache hits well under a millisecond up to slow bulk requests
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+def _format_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return "+Inf" if value == math.inf else repr(float(value))
+
+class Counter:
+    type = "counter"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Labels, float] = {}
+    
+    def inc(self, amount: float = 1, labels: Labels = ()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def value(self, labels: Labels = ()) -> float:
+        return self._values.get(labels, 0)
+    
+    def samples(self) -> Iterator[str]:
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+class Histogram:
+    """Fixed-bucket histogram; an observation is a bisect and two additions under a lock"""
+    type = "histogram"
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        self._lock = threading.Lock()
+        # Per label set: non-cumulative bucket counts and the sum of observations
+        self._series: Dict[Labels, List[Any]] = {}
+    
+    def observe(self, value: float, labels: Labels = ()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0]
+            series[0][index] += 1
+            series[1] += value
+    
+    def count(self, labels: Labels = ()) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+    
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            snapshot = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+class CallbackMetric:
+    """Value read at scrape time from state the code already keeps
+    
+    With label names the callback returns a value per label tuple instead.
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        type: str,
+        callback: Callable[[], Any],
+        labelnames: Sequence[str] = ()
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.type = type
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+    
+    def samples(self) -> Iterator[str]:
+        if not self.labelnames:
+            yield f"{self.name} {_format_value(self.callback())}"
+            return
+        for labels, value in sorted(self.callback().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+Metric = Union[Counter, Histogram, CallbackMetric]
+
+class Registry:
+    """In-process metrics rendered in the Prometheus text exposition format
+    
+    Every worker process keeps its own registry, so with several uvicorn
+    workers each scrape reports the worker that served it.
+    """
+    
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+    
+    def _register(self, metric: Metric) -> Metric:
+        # Re-registering a name (e.g. a module reloaded by tests) keeps the first instance
+        return self._metrics.setdefault(metric.name, metric)
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+    
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+    
+    def callback(
+        self,
+        name: str,
+        documentation: str,
+        type: str,
+        callback: Callable[[], Any],
+        labelnames: Sequence[str] = ()
+    ):
+        self._metrics[name] = CallbackMetric(name, documentation, type, callback, labelnames)
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.error(f"Failed to collect metric {metric.name}: {str(e)}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request until its response headers are sent, by route template",
+    ("method", "route", "status")
+)
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "db_query_duration_seconds",
+    "Time spent executing SQL statements, by statement type",
+    ("operation",)
+)
+DB_POOL_WAIT_SECONDS = REGISTRY.histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time to get a connection from the pool, including opening a new one and waiting for a free one",
+    ("pool",)
+)
+DB_POOL_TIMEOUTS = REGISTRY.counter(
+    "db_pool_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT seconds", ("pool",)
+)
+DB_CONNECTION_HOLD_SECONDS = REGISTRY.histogram(
+    "db_connection_hold_seconds",
+    "Time a connection stays checked out, by the route that held it or background for worker threads",
+    ("pool", "route")
+)
+
+# Scope of the request being served, so database hooks can tell which route they ran for
+_request_scope: ContextVar[Optional[Dict[str, Any]]] = ContextVar("request_scope", default=None)
+
+def current_route() -> str:
+    """Route template of the request in progress, unmatched before routing, background outside requests"""
+    scope = _request_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timing each request by its route template
+    
+    Timing stops at the response headers, so long-lived streams are measured
+    by how quickly they start rather than how long they stay open. Unlike
+    BaseHTTPMiddleware it adds no extra task or body stream per request.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        started = time.perf_counter()
+        responded = False
+        
+        def observe(status: int):
+            # The router stores the matched route in the shared scope; unmatched paths share one label
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route is not None else "unmatched", str(status))
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, labels)
+        
+        async def send_with_timing(message):
+            nonlocal responded
+            if message["type"] == "http.response.start":
+                responded = True
+                observe(message["status"])
+            await send(message)
+        
+        token = _request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except Exception:
+            if not responded:
+                observe(500)
+            raise
+        finally:
+            _request_scope.reset(token)
+
+QUERY_OPERATIONS = ("SELECT", "INSERT", "UPDATE", "DELETE")
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_started
+    operation = statement.lstrip()[:6].upper()
+    DB_QUERY_SECONDS.observe(elapsed, (operation if operation in QUERY_OPERATIONS else "OTHER",))
+
+def instrument_queries():
+    """Time every statement run by any engine, including the sync engine behind the async one"""
+    if METRICS_QUERY_TIMING and not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+class CheckoutTimingMixin:
+    """Times QueuePool._do_get, the step that blocks when every connection is in use"""
+    metrics_label = "sync"
+    
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            DB_POOL_TIMEOUTS.inc(labels=(self.metrics_label,))
+            raise
+        finally:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started, (self.metrics_label,))
+
+class InstrumentedQueuePool(CheckoutTimingMixin, QueuePool):
+    metrics_label = "sync"
+
+class InstrumentedAsyncQueuePool(CheckoutTimingMixin, AsyncAdaptedQueuePool):
+    metrics_label = "async"
+
+# Engines whose pools are reported by the db_pool_* gauges, looked up on every scrape
+# because engine.dispose() swaps in a new pool
+_pooled_engines: Dict[str, Engine] = {}
+
+def _pool_gauge(read: Callable[[QueuePool], int]) -> Callable[[], Dict[Labels, float]]:
+    def collect() -> Dict[Labels, float]:
+        return {
+            (name,): read(engine.pool)
+            for name, engine in _pooled_engines.items()
+            if isinstance(engine.pool, QueuePool)
+        }
+    return collect
+
+REGISTRY.callback(
+    "db_pool_size", "Connections the pool keeps open", "gauge", _pool_gauge(lambda pool: pool.size()), ("pool",)
+)
+REGISTRY.callback(
+    "db_pool_checked_out", "Connections currently in use", "gauge",
+    _pool_gauge(lambda pool: pool.checkedout()), ("pool",)
+)
+REGISTRY.callback(
+    "db_pool_overflow", "Connections open beyond the pool size", "gauge",
+    _pool_gauge(lambda pool: max(pool.overflow(), 0)), ("pool",)
+)
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info["metrics_checked_out"] = time.perf_counter()
+
+def _hold_timer(name: str):
+    def on_checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop("metrics_checked_out", None)
+        if started is None:
+            return
+        DB_CONNECTION_HOLD_SECONDS.observe(time.perf_counter() - started, (name, current_route()))
+    return on_checkin
+
+def instrument_pool(engine: Engine, name: str):
+    """Export an engine's pool occupancy and time how long each connection is held"""
+    if name in _pooled_engines:
+        return
+    _pooled_engines[name] = engine
+    # Listening on the engine keeps the hooks across the pools it recreates
+    event.listen(engine, "checkout", _on_checkout)
+    event.listen(engine, "checkin", _hold_timer(name))
+
+def pool_stats(engine: Engine) -> Dict[str, Any]:
+    """Current occupancy of an engine's pool"""
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__}
+    return {
+        "pool": type(pool).__name__,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+    }
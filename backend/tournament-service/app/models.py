@@ -1,17 +1,33 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, BigInteger, Integer, String, DateTime, ForeignKey, Index, Uuid
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql import func
+from sqlalchemy.sql.functions import FunctionElement
 from sqlalchemy.orm import relationship
 from typing import Optional
 import uuid
 
 Base = declarative_base()
 
+class insert_time(FunctionElement):
+    """Time of the insert itself; now() would stamp every row with its transaction's start time"""
+    type = DateTime(timezone=True)
+    inherit_cache = True
+
+@compiles(insert_time)
+def _insert_time(element, compiler, **kw):
+    # CURRENT_TIMESTAMP is already per statement on SQLite
+    return "CURRENT_TIMESTAMP"
+
+@compiles(insert_time, "postgresql")
+def _insert_time_postgresql(element, compiler, **kw):
+    return "clock_timestamp()"
+
 class Tournament(Base):
     __tablename__ = "tournaments"
     
     id = Column(Integer, primary_key=True, index=True)
-    tournament_id = Column(String, unique=True, index=True, default=lambda: str(uuid.uuid4()))
+    tournament_id = Column(Uuid, unique=True, index=True, default=uuid.uuid4)  # Native UUID on PostgreSQL
     name = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
@@ -21,7 +37,7 @@ class Tournament(Base):
     def to_dict(self):
         return {
             "id": self.id,
-            "tournament_id": self.tournament_id,
+            "tournament_id": str(self.tournament_id) if self.tournament_id else None,
             "name": self.name,
             "created_at": self.created_at.isoformat() if self.created_at else None
         }
@@ -31,13 +47,19 @@ class TournamentTeam(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     tournament_id = Column(Integer, ForeignKey("tournaments.id"))
-    team_id = Column(String, nullable=False)  # External team ID from team-service
+    team_id = Column(String, nullable=False, index=True)  # External team ID from team-service
     team_name = Column(String, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Stamped when the row is inserted, not when its transaction began
+    created_at = Column(DateTime(timezone=True), server_default=insert_time())
     
     # Relationship to tournament
     tournament = relationship("Tournament", back_populates="teams")
     
+    __table_args__ = (
+        # One registration per team and tournament, so replayed events can't duplicate rows
+        Index("ix_tournament_teams_tournament_id_team_id", "tournament_id", "team_id", unique=True),
+    )
+    
     def to_dict(self):
         return {
             "id": self.id,
@@ -45,4 +67,21 @@ class TournamentTeam(Base):
             "team_id": self.team_id,
             "team_name": self.team_name,
             "created_at": self.created_at.isoformat() if self.created_at else None
-        }
\ No newline at end of file
+        }
+
+class EventOffset(Base):
+    """Highest team-service event sequence applied per stream, so a restart replays only what it missed"""
+    __tablename__ = "event_offsets"
+    
+    stream = Column(String, primary_key=True)
+    sequence = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class TournamentTeamDigestBucket(Base):
+    """Count and XOR hash of a tournament's team_ids starting with one fixed-length hex prefix, see app.digest"""
+    __tablename__ = "tournament_team_digest_buckets"
+    
+    tournament_id = Column(Integer, ForeignKey("tournaments.id"), primary_key=True)
+    prefix = Column(String, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+    hash = Column(BigInteger, nullable=False, default=0)  # Unsigned 64-bit hash stored two's complement
@@ -0,0 +1,189 @@
+import os
+import logging
+import threading
+import time
+from typing import Any, Dict, List
+
+import httpx
+from sqlalchemy import select
+
+from .changes import lock_change_feed
+from .database import SessionLocal
+from .digest import MAX_PREFIX_LENGTH, prefix_range, record_tournament_team_digests, tournament_team_digests
+from .events import TEAM_SERVICE_URL, announce_tournament_teams, insert_tournament_teams_statement
+from .models import TournamentTeam
+
+logger = logging.getLogger(__name__)
+
+# Seconds between anti-entropy passes against team-service; 0 turns the reconciler off
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL_SECONDS", "300"))
+# Ranges holding at most this many teams are fetched outright instead of split further
+RECONCILE_LEAF_SIZE = int(os.getenv("RECONCILE_LEAF_SIZE", "256"))
+RECONCILE_FETCH_BATCH_SIZE = 1000
+# Registrations from TeamRegistered events all land in the default tournament
+RECONCILE_TOURNAMENT_ID = 1
+
+class Reconciler:
+    """Merkle-style sync of the default tournament's roster against team-service
+    
+    Both sides hash team_ids into 16 buckets per hex prefix. Only buckets
+    whose count or hash differ are split further, and only leaf ranges that
+    still differ have their teams fetched, so a pass costs a handful of
+    digest requests plus whatever actually drifted.
+    """
+    
+    def __init__(self, interval: float = RECONCILE_INTERVAL, leaf_size: int = RECONCILE_LEAF_SIZE):
+        self.interval = interval
+        self.leaf_size = leaf_size
+        self.running = False
+        self.thread = None
+        self._stop = threading.Event()
+        self.runs = 0
+        self.digests_compared = 0
+        self.ranges_fetched = 0
+        self.teams_repaired = 0
+        self.last_run_seconds = None
+    
+    def start(self):
+        """Start periodic reconciliation in a background thread"""
+        if not self.running and self.interval > 0 and TEAM_SERVICE_URL:
+            self.running = True
+            self._stop.clear()
+            self.thread = threading.Thread(target=self._run, name="reconciler", daemon=True)
+            self.thread.start()
+            logger.info(f"Reconciler started (every {self.interval:g}s)")
+    
+    def stop(self):
+        """Stop the reconciler"""
+        self.running = False
+        self._stop.set()
+        if self.thread:
+            self.thread.join()
+        logger.info("Reconciler stopped")
+    
+    def _run(self):
+        # Wait first: right after start the subscriber's own catch-up is still running
+        while not self._stop.wait(self.interval):
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"Reconciliation failed: {str(e)}")
+    
+    def reconcile(self) -> int:
+        """Run one pass and return how many missing registrations were restored"""
+        started = time.perf_counter()
+        repaired = 0
+        with httpx.Client(base_url=TEAM_SERVICE_URL, timeout=30) as client:
+            pending = [""]
+            while pending:
+                prefix = pending.pop()
+                remote = self._remote_digests(client, prefix)
+                local = self._local_digests(prefix)
+                self.digests_compared += 1
+                for remote_bucket, local_bucket in zip(remote, local):
+                    if remote_bucket == local_bucket:
+                        continue
+                    if remote_bucket["count"] <= self.leaf_size or len(remote_bucket["prefix"]) >= MAX_PREFIX_LENGTH:
+                        repaired += self._repair_range(client, remote_bucket["prefix"])
+                    else:
+                        pending.append(remote_bucket["prefix"])
+        
+        self.runs += 1
+        self.teams_repaired += repaired
+        self.last_run_seconds = time.perf_counter() - started
+        logger.info(f"Reconciliation pass restored {repaired} registrations in {self.last_run_seconds:.3f}s")
+        return repaired
+    
+    def _remote_digests(self, client: httpx.Client, prefix: str) -> List[Dict[str, Any]]:
+        response = client.get("/teams/digest", params={"prefix": prefix})
+        response.raise_for_status()
+        return response.json()
+    
+    def _local_digests(self, prefix: str) -> List[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            return tournament_team_digests(db, RECONCILE_TOURNAMENT_ID, prefix)
+        finally:
+            db.close()
+    
+    def _remote_teams(self, client: httpx.Client, prefix: str) -> List[Dict[str, Any]]:
+        """Fetch every team in one team_id range, page by page"""
+        teams = []
+        params = {"team_id_prefix": prefix, "limit": RECONCILE_FETCH_BATCH_SIZE}
+        while True:
+            response = client.get("/teams", params=params)
+            response.raise_for_status()
+            teams += response.json()
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                return teams
+            params["after"] = cursor
+    
+    def _repair_range(self, client: httpx.Client, prefix: str) -> int:
+        """Insert the registrations team-service has in a range and this service lacks"""
+        teams = self._remote_teams(client, prefix)
+        self.ranges_fetched += 1
+        if not teams:
+            # Extra local rows are reported, never deleted: teams are not removed upstream
+            logger.warning(f"Tournament teams in range {prefix} are unknown to team-service")
+            return 0
+        db = SessionLocal()
+        try:
+            known = set(
+                db.scalars(
+                    select(TournamentTeam.team_id).where(
+                        TournamentTeam.tournament_id == RECONCILE_TOURNAMENT_ID,
+                        *prefix_range(TournamentTeam.team_id, prefix)
+                    )
+                )
+            )
+            rows = [
+                {"tournament_id": RECONCILE_TOURNAMENT_ID, "team_id": team["team_id"], "team_name": team["name"]}
+                for team in teams
+                if team["team_id"] not in known
+            ]
+            if rows:
+                # ON CONFLICT DO NOTHING still guards against the subscriber inserting the same rows meanwhile
+                lock_change_feed(db, "tournament_teams")
+                inserted = db.execute(insert_tournament_teams_statement(db.get_bind().dialect.name), rows).all()
+                record_tournament_team_digests(db, inserted)
+                db.commit()
+                announce_tournament_teams(rows)
+                logger.info(f"Restored {len(rows)} registrations in range {prefix}")
+            return len(rows)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "digests_compared": self.digests_compared,
+            "ranges_fetched": self.ranges_fetched,
+            "teams_repaired": self.teams_repaired,
+            "last_run_seconds": self.last_run_seconds,
+        }
+
+# Global reconciler instance
+_reconciler = None
+
+def get_reconciler():
+    global _reconciler
+    if _reconciler is None:
+        _reconciler = Reconciler()
+    return _reconciler
+
+def start_reconciler():
+    """Start the reconciler"""
+    reconciler = get_reconciler()
+    reconciler.start()
+
+def stop_reconciler():
+    """Stop the reconciler"""
+    global _reconciler
+    if _reconciler:
+        _reconciler.stop()
+        _reconciler = None
@@ -1,6 +1,7 @@
 from pydantic import BaseModel
 from datetime import datetime
 from typing import Optional, List
+from uuid import UUID
 
 class TournamentCreate(BaseModel):
     name: str
@@ -14,12 +15,19 @@ class TournamentTeamResponse(BaseModel):
     class Config:
         from_attributes = True
 
-class TournamentResponse(BaseModel):
+class TournamentHeaderResponse(BaseModel):
     id: int
-    tournament_id: str
+    tournament_id: UUID
     name: str
     created_at: Optional[datetime] = None
-    teams: List[TournamentTeamResponse] = []
     
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class TournamentResponse(TournamentHeaderResponse):
+    teams: List[TournamentTeamResponse] = []
+
+class DigestBucket(BaseModel):
+    prefix: str
+    count: int
+    hash: str
\ No newline at end of file
@@ -0,0 +1,160 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .metrics import REGISTRY, current_route
+
+logger = logging.getLogger(__name__)
+
+# Statements slower than this many milliseconds are recorded; 0 leaves the recorder off
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+# Recorded statements kept in memory, oldest dropped first
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "100"))
+# Share of slow SELECTs that are run again under EXPLAIN; the sampled request waits for it
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE_RATE", "0.1"))
+SLOW_QUERY_MAX_STATEMENT_LENGTH = 4000
+
+# EXPLAIN ANALYZE executes the statement, so only SELECTs are ever explained
+EXPLAIN_PREFIXES = {
+    "postgresql": "EXPLAIN (ANALYZE, BUFFERS) ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+
+SLOW_QUERIES = REGISTRY.counter(
+    "db_slow_queries_total", "Statements slower than SLOW_QUERY_MS, by the route that ran them", ("route",)
+)
+
+def parameters_shape(parameters: Any, executemany: bool) -> Any:
+    """Parameter names and types without their values, which may hold personal data"""
+    if executemany:
+        rows = list(parameters or [])
+        return {"rows": len(rows), "row": parameters_shape(rows[0], False) if rows else None}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__ if parameters is not None else None
+
+class SlowQueryLog:
+    """Ring buffer of statements that crossed SLOW_QUERY_MS
+    
+    Entries keep the statement text, its parameter shape, the duration and
+    the route that ran it. A sample of slow SELECTs is re-run on the same
+    connection under EXPLAIN (inside a savepoint on Postgres, so a failing
+    EXPLAIN cannot abort the request's transaction) and the plan is stored
+    with the entry.
+    """
+    
+    def __init__(
+        self,
+        threshold_ms: Optional[float] = None,
+        size: Optional[int] = None,
+        explain_sample_rate: Optional[float] = None
+    ):
+        self.threshold_ms = threshold_ms if threshold_ms is not None else SLOW_QUERY_MS
+        self.size = size or SLOW_QUERY_LOG_SIZE
+        if explain_sample_rate is None:
+            explain_sample_rate = SLOW_QUERY_EXPLAIN_SAMPLE_RATE
+        self.explain_sample_rate = explain_sample_rate
+        self._lock = threading.Lock()
+        self._entries: Deque[Dict[str, Any]] = deque(maxlen=self.size)
+        self.recorded = 0
+        self.explained = 0
+        self.explain_errors = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+    
+    def attach(self, engine: Engine):
+        """Watch every statement the engine runs; pass async_engine.sync_engine for the async engine"""
+        if self.enabled and not event.contains(engine, "before_cursor_execute", self._before_cursor_execute):
+            event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+    
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._slow_query_started = time.perf_counter()
+    
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration_ms = (time.perf_counter() - context._slow_query_started) * 1000
+        if duration_ms < self.threshold_ms:
+            return
+        
+        route = current_route()
+        entry = {
+            "captured_at": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round(duration_ms, 3),
+            "route": route,
+            "statement": statement[:SLOW_QUERY_MAX_STATEMENT_LENGTH],
+            "parameters": parameters_shape(parameters, executemany),
+            "explain": None,
+        }
+        prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+        is_select = statement.lstrip()[:6].upper() == "SELECT"
+        if prefix and is_select and not executemany and random.random() < self.explain_sample_rate:
+            entry["explain"] = self._explain(conn, prefix + statement, parameters)
+        
+        SLOW_QUERIES.inc(labels=(route,))
+        with self._lock:
+            self._entries.append(entry)
+            self.recorded += 1
+        logger.warning(f"Slow query ({duration_ms:.1f} ms) on {route}: {statement[:200]}")
+    
+    def _explain(self, conn, statement: str, parameters: Any) -> Optional[str]:
+        """Run EXPLAIN on a fresh DBAPI cursor of the same connection, bypassing these hooks"""
+        postgres = conn.dialect.name == "postgresql"
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            if postgres:
+                cursor.execute("SAVEPOINT slow_query_explain")
+            try:
+                cursor.execute(statement, parameters)
+                plan = "\n".join(str(row[-1]) for row in cursor.fetchall())
+            except Exception as e:
+                if postgres:
+                    cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                self.explain_errors += 1
+                logger.error(f"Failed to explain slow query: {str(e)}")
+                return None
+            if postgres:
+                cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+            self.explained += 1
+            return plan
+        finally:
+            cursor.close()
+    
+    def entries(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Recorded statements, newest first"""
+        with self._lock:
+            entries = list(reversed(self._entries))
+        return entries[:limit] if limit else entries
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "threshold_ms": self.threshold_ms,
+            "size": self.size,
+            "entries": len(self._entries),
+            "recorded": self.recorded,
+            "explain_sample_rate": self.explain_sample_rate,
+            "explained": self.explained,
+            "explain_errors": self.explain_errors,
+        }
+
+# Global slow query log instance
+_slow_query_log = SlowQueryLog()
+
+def get_slow_query_log() -> SlowQueryLog:
+    return _slow_query_log
@@ -0,0 +1,111 @@
+import os
+import asyncio
+import logging
+import orjson
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Messages buffered per connected client; a client that falls this far behind is told to resync
+STREAM_CLIENT_BUFFER = int(os.getenv("STREAM_CLIENT_BUFFER", "100"))
+STREAM_MAX_CLIENTS = int(os.getenv("STREAM_MAX_CLIENTS", "10000"))
+# Comment lines sent on idle streams so proxies don't close them
+STREAM_KEEPALIVE_SECONDS = float(os.getenv("STREAM_KEEPALIVE_SECONDS", "15"))
+# Final message for a client whose buffer overflowed; it should reload through /tournament-teams/changes
+RESYNC_MESSAGE = "event: resync\ndata: {}\n\n"
+
+class StreamFull(Exception):
+    """Raised when STREAM_MAX_CLIENTS clients are already connected"""
+
+class StreamClient:
+    def __init__(self, buffer_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(buffer_size)
+        self.overflowed = False
+
+class EventBroadcaster:
+    """Fans events out to connected server-sent event clients
+    
+    Each event is formatted once and then put on every client's bounded queue,
+    so a push costs the same however it is consumed. A client whose queue is
+    full is cut off with a resync message rather than slowing the others or
+    growing without bound. publish() may be called from any thread.
+    """
+    
+    def __init__(self, buffer_size: Optional[int] = None, max_clients: Optional[int] = None):
+        self.buffer_size = buffer_size or STREAM_CLIENT_BUFFER
+        self.max_clients = max_clients or STREAM_MAX_CLIENTS
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._clients: Set[StreamClient] = set()
+        self.published = 0
+        self.overflows = 0
+    
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+    
+    def subscribe(self) -> StreamClient:
+        if len(self._clients) >= self.max_clients:
+            raise StreamFull()
+        client = StreamClient(self.buffer_size)
+        self._clients.add(client)
+        return client
+    
+    def unsubscribe(self, client: StreamClient):
+        self._clients.discard(client)
+    
+    def publish(self, event: str, data: Any):
+        """Queue an event for every connected client"""
+        if self.loop is None or not self._clients:
+            return
+        message = f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+        self.loop.call_soon_threadsafe(self._fan_out, message)
+    
+    def _fan_out(self, message: str):
+        self.published += 1
+        for client in list(self._clients):
+            try:
+                client.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Swap the oldest message for the resync notice so the stream ends promptly
+                client.queue.get_nowait()
+                client.queue.put_nowait(RESYNC_MESSAGE)
+                client.overflowed = True
+                self._clients.discard(client)
+                self.overflows += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clients": len(self._clients),
+            "max_clients": self.max_clients,
+            "client_buffer": self.buffer_size,
+            "published": self.published,
+            "overflows": self.overflows,
+        }
+
+async def sse_messages(
+    broadcaster: EventBroadcaster, client: StreamClient, keepalive: Optional[float] = None
+) -> AsyncIterator[str]:
+    """Server-sent event body for one client; cancelled by Starlette when the client disconnects"""
+    interval = keepalive or STREAM_KEEPALIVE_SECONDS
+    try:
+        yield ": connected\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(client.queue.get(), interval)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield message
+            if message is RESYNC_MESSAGE:
+                return
+    finally:
+        broadcaster.unsubscribe(client)
+
+# Global broadcaster instance
+_broadcaster = EventBroadcaster()
+
+def get_broadcaster() -> EventBroadcaster:
+    return _broadcaster
+
+def start_event_stream():
+    """Attach the broadcaster to the running loop; the event subscriber publishes applied registrations"""
+    _broadcaster.attach(asyncio.get_running_loop())
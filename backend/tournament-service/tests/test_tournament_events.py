@@ -1,14 +1,22 @@
 import pytest
 from unittest.mock import Mock, patch
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 import json
+import msgpack
+import asyncio
+import time
+import zmq
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
 
 from app.main import app
 from app.database import get_db
-from app.models import Base, Tournament, TournamentTeam
-from app.events import EventSubscriber
+from app.models import Base, EventOffset, Tournament, TournamentTeam
+from app.events import (
+    EventSubscriber, AsyncEventSubscriber, ENVELOPE_HEADER, ENVELOPE_VERSION, decode_message, partition_topics
+)
 
 # Create test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
@@ -22,10 +30,20 @@ def override_get_db():
     finally:
         db.close()
 
+# Async stack against the same database; NullPool keeps connections off other tests' event loops
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
 app.dependency_overrides[get_db] = override_get_db
 
-@pytest.fixture
-def client():
+@pytest.fixture(params=["sync", "async"])
+def client(request):
+    # Run every API test against both the sync and the async database stack
+    app.dependency_overrides[get_db] = override_get_db if request.param == "sync" else override_get_async_db
     Base.metadata.create_all(bind=engine)
     with TestClient(app) as test_client:
         yield test_client
@@ -115,7 +133,7 @@ def test_team_registered_event_handler():
                     assert tournament_team.tournament_id == 1
                     
                     db.close()
-                
+    
     finally:
         Base.metadata.drop_all(bind=engine)
 
@@ -124,4 +142,1023 @@ def test_get_tournament_teams(client):
     response = client.get("/tournament-teams")
     assert response.status_code == 200
     teams = response.json()
-    assert isinstance(teams, list)
\ No newline at end of file
+    assert isinstance(teams, list)
+def test_team_registered_batch_single_commit():
+    """Test a batch of events is written with one insert and one commit"""
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        db.add(Tournament(id=1, name="Default Tournament"))
+        db.commit()
+        db.close()
+        
+        subscriber = EventSubscriber(batch_size=10, flush_interval_ms=0)
+        messages = [
+            json.dumps({"event": "TeamRegistered", "payload": {"teamId": f"team-{i}", "name": f"Team {i}"}})
+            for i in range(3)
+        ]
+        messages.append("not json")
+        messages.append(json.dumps({"event": "SomethingElse", "payload": {}}))
+        
+        sessions = []
+        def session_factory():
+            session = TestingSessionLocal()
+            sessions.append(session)
+            return session
+        
+        with patch('app.events.SessionLocal', TestingSessionLocal):
+            # Loaded once at startup, not per batch
+            assert subscriber._ensure_checkpoint()
+        with patch('app.events.SessionLocal', side_effect=session_factory):
+            subscriber._handle_batch(messages)
+        
+        # One session for the whole batch
+        assert len(sessions) == 1
+        
+        db = TestingSessionLocal()
+        team_ids = sorted(t.team_id for t in db.query(TournamentTeam).all())
+        assert team_ids == ["team-0", "team-1", "team-2"]
+        db.close()
+        
+        subscriber.socket.close()
+        subscriber.context.term()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+def test_receive_batch_respects_batch_size():
+    """Test the consumer drains at most batch_size messages per flush"""
+    subscriber = EventSubscriber(batch_size=3, flush_interval_ms=100)
+    socket = Mock()
+    socket.poll.return_value = True
+    socket.recv_multipart.side_effect = [[f"message-{i}".encode()] for i in range(5)]
+    
+    with patch.object(subscriber, 'socket', socket):
+        assert subscriber._receive_batch() == [[b"message-0"], [b"message-1"], [b"message-2"]]
+        
+        # A quiet socket flushes whatever arrived before the interval expired
+        socket.poll.return_value = False
+        assert subscriber._receive_batch() == [[b"message-3"]]
+    
+    subscriber.socket.close()
+    subscriber.context.term()
+
+def test_partition_topics_split_partitions_between_replicas():
+    """Test every partition is owned by exactly one replica and a single replica takes everything"""
+    assert partition_topics(1, 0) == ["TeamRegistered/"]
+    
+    owned = [partition_topics(3, index, partitions=64) for index in range(3)]
+    assert sorted(topic for topics in owned for topic in topics) == [f"TeamRegistered/{p:03d}" for p in range(64)]
+
+def test_decode_message_envelope():
+    """Test the binary envelope decodes to the same event shape as the JSON format"""
+    header = ENVELOPE_HEADER.pack(ENVELOPE_VERSION, 7, 1704103200000000)
+    payload = msgpack.packb({"teamId": "binary-team", "name": "Binary FC"})
+    
+    event = decode_message([b"TeamRegistered/012", header, payload])
+    assert event == {
+        "event": "TeamRegistered",
+        "payload": {"teamId": "binary-team", "name": "Binary FC"},
+        "sequence": 7,
+        "timestamp_us": 1704103200000000,
+    }
+    assert decode_message('{"event": "TeamRegistered"}') == {"event": "TeamRegistered"}
+    
+    with pytest.raises(ValueError):
+        decode_message([b"TeamRegistered/012", bytes([ENVELOPE_VERSION + 1]) + header[1:], payload])
+
+def test_subscriber_only_receives_its_partitions():
+    """Test a replica's subscriptions filter out other replicas' partitions"""
+    context = zmq.Context()
+    publisher = context.socket(zmq.PUB)
+    publisher.bind("tcp://127.0.0.1:15557")
+    subscriber = EventSubscriber(flush_interval_ms=200, replicas=2, index=1)
+    subscriber.socket.connect("tcp://127.0.0.1:15557")
+    time.sleep(0.5)
+    
+    try:
+        # Event types nobody subscribed to never reach the subscriber
+        publisher.send_multipart([b"TeamRenamed/001", b"", b""])
+        for partition in range(4):
+            publisher.send_multipart([f"TeamRegistered/{partition:03d}".encode(), f"event-{partition}".encode()])
+        
+        assert subscriber.socket.poll(2000)
+        assert [frames[-1] for frames in subscriber._receive_batch()] == [b"event-1", b"event-3"]
+    finally:
+        publisher.close()
+        context.term()
+        subscriber.socket.close()
+        subscriber.context.term()
+
+@pytest.mark.asyncio
+async def test_async_subscriber_writes_batch():
+    """Test the asyncio subscriber writes a batch through the async engine"""
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        db.add(Tournament(id=1, name="Default Tournament"))
+        db.commit()
+        db.close()
+        
+        subscriber = AsyncEventSubscriber(batch_size=10, flush_interval_ms=0)
+        messages = [
+            json.dumps({"event": "TeamRegistered", "payload": {"teamId": f"async-{i}", "name": f"Async {i}"}})
+            for i in range(2)
+        ]
+        
+        with patch('app.events.AsyncSessionLocal', TestingAsyncSessionLocal):
+            await subscriber._handle_batch_async(messages)
+        
+        db = TestingSessionLocal()
+        team_ids = sorted(t.team_id for t in db.query(TournamentTeam).all())
+        assert team_ids == ["async-0", "async-1"]
+        db.close()
+        
+        subscriber.stop()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+@pytest.mark.asyncio
+async def test_async_subscriber_stops_immediately():
+    """Test stopping the asyncio subscriber cancels its task without a poll timeout"""
+    subscriber = AsyncEventSubscriber()
+    subscriber.start()
+    await asyncio.sleep(0.05)
+    
+    started = time.monotonic()
+    subscriber.stop()
+    await asyncio.sleep(0)
+    
+    assert time.monotonic() - started < 0.5
+    assert subscriber.task.cancelled() or subscriber.task.done()
+
+def seed_tournaments(count, teams_per_tournament):
+    db = TestingSessionLocal()
+    for i in range(count):
+        tournament = Tournament(name=f"Cup {i}")
+        db.add(tournament)
+        db.flush()
+        for j in range(teams_per_tournament):
+            db.add(TournamentTeam(tournament_id=tournament.id, team_id=f"team-{i}-{j}", team_name=f"Team {i}-{j}"))
+    db.commit()
+    db.close()
+
+def count_statements(client, url):
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    for target in (engine, async_engine.sync_engine):
+        event.listen(target, "before_cursor_execute", record)
+    try:
+        response = client.get(url)
+    finally:
+        for target in (engine, async_engine.sync_engine):
+            event.remove(target, "before_cursor_execute", record)
+    assert response.status_code == 200
+    return response, len(statements)
+
+def test_get_tournaments_query_count_is_constant(client):
+    """Test rosters are loaded in batches rather than one query per tournament"""
+    seed_tournaments(3, 2)
+    response, few = count_statements(client, "/tournaments")
+    assert all(len(t["teams"]) == 2 for t in response.json() if t["name"].startswith("Cup"))
+    
+    seed_tournaments(6, 2)
+    _, many = count_statements(client, "/tournaments")
+    assert many == few
+
+def test_get_tournaments_headers_only(client):
+    """Test include_teams=false returns tournaments without rosters"""
+    seed_tournaments(2, 3)
+    response = client.get("/tournaments", params={"include_teams": "false"})
+    assert response.status_code == 200
+    assert all("teams" not in t for t in response.json())
+
+def test_get_tournament_roster_pagination(client):
+    """Test paging through one tournament's teams"""
+    seed_tournaments(2, 5)
+    tournament = next(t for t in client.get("/tournaments").json() if t["name"] == "Cup 1")
+    
+    seen = []
+    params = {"limit": 2}
+    while True:
+        response = client.get(f"/tournaments/{tournament['id']}/teams", params=params)
+        assert response.status_code == 200
+        seen.extend(t["team_id"] for t in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        params = {"limit": 2, "after": cursor}
+    
+    assert seen == [f"team-1-{j}" for j in range(5)]
+
+def test_get_tournament_roster_not_found(client):
+    """Test roster of an unknown tournament returns 404"""
+    response = client.get("/tournaments/9999/teams")
+    assert response.status_code == 404
+
+def test_replayed_team_registered_is_idempotent():
+    """Test redelivered events neither duplicate rows nor hit the database twice"""
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        db.add(Tournament(id=1, name="Default Tournament"))
+        db.commit()
+        db.close()
+        
+        message = json.dumps({"event": "TeamRegistered", "payload": {"teamId": "replayed-team", "name": "Replay FC"}})
+        subscriber = EventSubscriber()
+        
+        with patch('app.events.SessionLocal', TestingSessionLocal):
+            # Duplicate inside one batch and again in a later batch
+            subscriber._handle_batch([message, message])
+            subscriber._handle_batch([message])
+            assert subscriber.stats()["dedupe_misses"] == 1
+            assert subscriber.stats()["dedupe_hits"] == 2
+            
+            # A fresh subscriber has an empty cache, so the unique index absorbs the replay
+            fresh = EventSubscriber()
+            fresh._handle_batch([message])
+            assert fresh.stats()["dedupe_misses"] == 1
+        
+        db = TestingSessionLocal()
+        assert db.query(TournamentTeam).filter_by(team_id="replayed-team").count() == 1
+        db.close()
+        
+        for s in (subscriber, fresh):
+            s.socket.close()
+            s.context.term()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+def envelope(sequence, team_id):
+    """Build a TeamRegistered wire message the way team-service publishes it"""
+    return [
+        b"TeamRegistered/000",
+        ENVELOPE_HEADER.pack(ENVELOPE_VERSION, sequence, 1704103200000000),
+        msgpack.packb({"teamId": team_id, "name": team_id.title()}),
+    ]
+
+def logged_event(sequence, team_id):
+    """An event as returned by team-service's GET /events"""
+    return {"sequence": sequence, "event": "TeamRegistered", "payload": {"teamId": team_id, "name": team_id.title()}}
+
+def test_sequence_gap_is_filled_from_event_log():
+    """Test a skipped sequence range is fetched and applied with the live batch, then checkpointed"""
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        db.add(Tournament(id=1, name="Default Tournament"))
+        db.commit()
+        db.close()
+        
+        subscriber = EventSubscriber()
+        subscriber.last_sequence = 1
+        pages = Mock(return_value=iter([[logged_event(2, "gap-b"), logged_event(3, "gap-c")]]))
+        
+        with patch('app.events.SessionLocal', TestingSessionLocal), patch.object(subscriber, '_event_pages', pages), \
+                patch('app.events.TEAM_SERVICE_URL', "http://team-service:8000"):
+            subscriber._handle_batch([envelope(4, "live-d")])
+        
+        pages.assert_called_once_with(1, 4)
+        stats = subscriber.stats()
+        assert stats["gaps_detected"] == 1
+        assert stats["pending_gaps"] == 0
+        assert stats["checkpoint"] == 4
+        
+        db = TestingSessionLocal()
+        assert sorted(t.team_id for t in db.query(TournamentTeam).all()) == ["gap-b", "gap-c", "live-d"]
+        assert db.get(EventOffset, "team-service").sequence == 4
+        db.close()
+        
+        subscriber.socket.close()
+        subscriber.context.term()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+def test_unfilled_gap_holds_back_checkpoint():
+    """Test the checkpoint stays below a gap that could not be fetched"""
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        db.add(Tournament(id=1, name="Default Tournament"))
+        db.commit()
+        db.close()
+        
+        subscriber = EventSubscriber()
+        subscriber.last_sequence = 1
+        pages = Mock(side_effect=ConnectionError("team-service unreachable"))
+        
+        with patch('app.events.SessionLocal', TestingSessionLocal), patch.object(subscriber, '_event_pages', pages):
+            subscriber._handle_batch([envelope(2, "seq-b")])
+            subscriber._handle_batch([envelope(5, "seq-e")])
+        
+        # The live events are applied, but a restart must still replay from sequence 2
+        assert subscriber.stats()["pending_gaps"] == 1
+        db = TestingSessionLocal()
+        assert db.query(TournamentTeam).count() == 2
+        assert db.get(EventOffset, "team-service").sequence == 2
+        db.close()
+        
+        subscriber.socket.close()
+        subscriber.context.term()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+def test_partly_filled_gap_keeps_the_missing_sequences():
+    """Test a gap whose fetch returns only some events stays open for the rest, holding back the checkpoint"""
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        db.add(Tournament(id=1, name="Default Tournament"))
+        db.commit()
+        db.close()
+        
+        subscriber = EventSubscriber()
+        subscriber.last_sequence = 2
+        # Sequence 4 is still being committed when the gap is first fetched
+        pages = Mock(side_effect=[
+            iter([[logged_event(3, "part-c"), logged_event(5, "part-e")]]),
+            iter([[logged_event(4, "part-d")]]),
+        ])
+        
+        with patch('app.events.SessionLocal', TestingSessionLocal), patch.object(subscriber, '_event_pages', pages), \
+                patch('app.events.TEAM_SERVICE_URL', "http://team-service:8000"):
+            subscriber._handle_batch([envelope(6, "part-f")])
+            assert subscriber._gaps == [(3, 5)]
+            assert subscriber.stats()["checkpoint"] == 3
+            
+            subscriber._handle_batch([envelope(7, "part-g")])
+        
+        assert pages.call_args_list[1].args == (3, 5)
+        stats = subscriber.stats()
+        assert stats["pending_gaps"] == 0
+        assert stats["checkpoint"] == 7
+        db = TestingSessionLocal()
+        assert sorted(t.team_id for t in db.query(TournamentTeam).all()) == [
+            "part-c", "part-d", "part-e", "part-f", "part-g"
+        ]
+        assert db.get(EventOffset, "team-service").sequence == 7
+        db.close()
+        
+        subscriber.socket.close()
+        subscriber.context.term()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+def test_missing_sequences_are_given_up_once_pruned_or_too_old():
+    """Test a hole in the log stops holding back the checkpoint below X-Log-Start or after EVENT_GAP_MAX_AGE_SECONDS"""
+    subscriber = EventSubscriber()
+    subscriber.last_sequence = 10
+    subscriber._add_gap(1, 4, found_at=time.monotonic())
+    subscriber._add_gap(5, 8, found_at=time.monotonic() - 3600)
+    subscriber.log_start = 3
+    
+    subscriber._filled_gaps = []
+    assert subscriber._apply_gap_fill(1, 4, []) == []
+    assert subscriber._apply_gap_fill(5, 8, []) == []
+    
+    # 2 was pruned, 3 may still commit, and 6..7 have been missing for too long
+    assert subscriber._gaps == [(2, 4)]
+    assert subscriber.stats()["gaps_abandoned"] == 1
+    
+    subscriber.socket.close()
+    subscriber.context.term()
+
+def test_catch_up_replays_from_stored_checkpoint():
+    """Test a starting subscriber applies only events logged after its checkpoint"""
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        db.add(Tournament(id=1, name="Default Tournament"))
+        db.add(EventOffset(stream="team-service", sequence=10))
+        db.commit()
+        db.close()
+        
+        subscriber = EventSubscriber()
+        subscriber.running = True
+        pages = Mock(return_value=iter([[logged_event(11, "replay-k")], [logged_event(12, "replay-l")]]))
+        
+        with patch('app.events.SessionLocal', TestingSessionLocal), patch.object(subscriber, '_event_pages', pages), \
+                patch('app.events.TEAM_SERVICE_URL', "http://team-service:8000"):
+            subscriber._catch_up()
+        
+        pages.assert_called_once_with(10)
+        assert subscriber.stats()["replayed"] == 2
+        db = TestingSessionLocal()
+        assert sorted(t.team_id for t in db.query(TournamentTeam).all()) == ["replay-k", "replay-l"]
+        assert db.get(EventOffset, "team-service").sequence == 12
+        db.close()
+        
+        subscriber.socket.close()
+        subscriber.context.term()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+def test_catch_up_does_not_skip_uncommitted_sequences():
+    """Test a sequence missing from the replayed log is kept as a gap instead of being stepped over"""
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        db.add(Tournament(id=1, name="Default Tournament"))
+        db.add(EventOffset(stream="team-service", sequence=10))
+        db.commit()
+        db.close()
+        
+        subscriber = EventSubscriber()
+        subscriber.running = True
+        pages = Mock(side_effect=[
+            iter([[logged_event(11, "replay-k"), logged_event(13, "replay-m")]]),
+            iter([]),
+        ])
+        
+        with patch('app.events.SessionLocal', TestingSessionLocal), patch.object(subscriber, '_event_pages', pages), \
+                patch('app.events.TEAM_SERVICE_URL', "http://team-service:8000"):
+            subscriber._catch_up()
+        
+        assert pages.call_args_list[1].args == (11, 13)
+        assert subscriber._gaps == [(11, 13)]
+        db = TestingSessionLocal()
+        assert db.get(EventOffset, "team-service").sequence == 11
+        db.close()
+        
+        subscriber.socket.close()
+        subscriber.context.term()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+def test_checkpoint_is_loaded_with_first_batch_after_failed_start():
+    """Test a checkpoint that could not be read at start is loaded before the next batch, so gaps are still seen"""
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        db.add(Tournament(id=1, name="Default Tournament"))
+        db.commit()
+        db.close()
+        
+        subscriber = EventSubscriber()
+        unavailable = Mock()
+        unavailable.get.side_effect = Exception("database unavailable")
+        with patch('app.events.SessionLocal', return_value=unavailable):
+            subscriber._catch_up()
+            assert subscriber._handle_batch([envelope(1, "late-a")]) is False
+        assert subscriber.last_sequence is None
+        
+        with patch('app.events.SessionLocal', TestingSessionLocal), patch('app.events.TEAM_SERVICE_URL', ""):
+            assert subscriber._handle_batch([envelope(1, "late-a"), envelope(2, "late-b"), envelope(5, "late-e")])
+        
+        stats = subscriber.stats()
+        assert stats["gaps_detected"] == 1
+        assert stats["pending_gaps"] == 1
+        db = TestingSessionLocal()
+        assert db.query(TournamentTeam).count() == 3
+        assert db.get(EventOffset, "team-service").sequence == 2
+        db.close()
+        
+        subscriber.socket.close()
+        subscriber.context.term()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+def test_reconciler_fetches_only_drifted_ranges():
+    """Test the reconciler recurses into mismatching buckets and restores just the missing teams"""
+    import uuid
+    from app.digest import bucket_digests, record_tournament_team_digests
+    from app.reconciler import Reconciler
+    
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        remote_teams = [{"team_id": str(uuid.uuid4()), "name": f"Remote {i}"} for i in range(600)]
+        missing = remote_teams[:3]
+        
+        db = TestingSessionLocal()
+        db.add(Tournament(id=1, name="Default Tournament"))
+        db.add_all(
+            TournamentTeam(tournament_id=1, team_id=team["team_id"], team_name=team["name"])
+            for team in remote_teams[3:]
+        )
+        # As the subscriber would have while inserting them
+        record_tournament_team_digests(db, [(1, team["team_id"]) for team in remote_teams[3:]])
+        db.commit()
+        db.close()
+        
+        def remote_digests(client, prefix):
+            return bucket_digests((t["team_id"] for t in remote_teams if t["team_id"].startswith(prefix)), prefix)
+        
+        def remote_teams_in(client, prefix):
+            return [t for t in remote_teams if t["team_id"].startswith(prefix)]
+        
+        reconciler = Reconciler(interval=0, leaf_size=8)
+        with patch('app.reconciler.SessionLocal', TestingSessionLocal), \
+                patch.object(reconciler, '_remote_digests', side_effect=remote_digests), \
+                patch.object(reconciler, '_remote_teams', side_effect=remote_teams_in):
+            assert reconciler.reconcile() == 3
+            # A second pass finds nothing left to repair
+            assert reconciler.reconcile() == 0
+        
+        stats = reconciler.stats()
+        assert stats["ranges_fetched"] <= 3
+        assert stats["teams_repaired"] == 3
+        
+        db = TestingSessionLocal()
+        assert db.query(TournamentTeam).count() == 600
+        for team in missing:
+            assert db.query(TournamentTeam).filter_by(team_id=team["team_id"]).count() == 1
+        db.close()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+def test_subscriber_keeps_digest_buckets_in_step():
+    """Test stored digest buckets count each applied registration once, replays included"""
+    import uuid
+    from app.digest import bucket_digests, tournament_team_digests
+    
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        db.add(Tournament(id=1, name="Default Tournament"))
+        db.commit()
+        db.close()
+        
+        team_ids = [str(uuid.uuid4()) for _ in range(400)]
+        rows = [{"tournament_id": 1, "team_id": team_id, "team_name": "Digest FC"} for team_id in team_ids]
+        subscriber = EventSubscriber()
+        subscriber.last_sequence = 0
+        with patch('app.events.SessionLocal', TestingSessionLocal):
+            assert subscriber._insert_tournament_teams(rows[:250])
+            # Overlaps the first batch, as a redelivery after a lost acknowledgement would
+            assert subscriber._insert_tournament_teams(rows[200:])
+        
+        db = TestingSessionLocal()
+        for prefix in ("", team_ids[0][:1], team_ids[0][:4]):
+            expected = bucket_digests((t for t in team_ids if t.startswith(prefix)), prefix)
+            assert tournament_team_digests(db, 1, prefix) == expected
+        db.close()
+        
+        subscriber.socket.close()
+        subscriber.context.term()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+def test_tournament_teams_digest(client):
+    """Test the roster digest buckets registered team ids by hex prefix"""
+    response = client.get("/tournament-teams/digest")
+    assert response.status_code == 200
+    buckets = response.json()
+    assert [b["prefix"] for b in buckets] == list("0123456789abcdef")
+    assert all(b["count"] == 0 and b["hash"] == "0" * 16 for b in buckets)
+    
+    assert client.get("/tournament-teams/digest?prefix=xyz").status_code == 422
+
+def test_event_journal_survives_reopen_and_rotates_segments(tmp_path):
+    """Test journaled messages are recovered after a restart and spent segments are removed"""
+    from app.journal import RECORD_HEADER, EventJournal
+    
+    journal = EventJournal(str(tmp_path), segment_bytes=256, fsync_interval_ms=0)
+    messages = [envelope(i, f"journal-{i}") for i in range(1, 11)]
+    journal.append(messages[:6])
+    journal.append(messages[6:])
+    journal.sync()
+    assert journal.stats()["journal_segments"] > 1
+    
+    first, offset = journal.read(journal.checkpoint, 4)
+    assert first == messages[:4]
+    journal.commit(offset)
+    segment_path = journal._segment_path(journal._active_base)
+    torn_position = journal.write_offset - journal._active_base
+    journal.close()
+    
+    # A torn write after the last record is ignored on recovery
+    with open(segment_path, "r+b") as f:
+        f.seek(torn_position)
+        f.write(RECORD_HEADER.pack(12, 0) + b"partial")
+    reopened = EventJournal(str(tmp_path), segment_bytes=256, fsync_interval_ms=0)
+    rest, end = reopened.read(reopened.checkpoint, 100)
+    assert rest == messages[4:]
+    assert end == reopened.write_offset
+    reopened.commit(end)
+    assert reopened.stats()["journal_segments"] == 1
+    reopened.close()
+
+def test_journaled_events_wait_out_a_database_outage(tmp_path):
+    """Test events received while the database is down are kept and applied once it is back"""
+    from app.journal import EventJournal
+    
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        db.add(Tournament(id=1, name="Default Tournament"))
+        db.commit()
+        db.close()
+        
+        subscriber = EventSubscriber(journal=EventJournal(str(tmp_path), fsync_interval_ms=0))
+        subscriber._dispatch([envelope(1, "outage-a"), envelope(2, "outage-b")])
+        
+        unavailable = Mock()
+        unavailable.execute.side_effect = Exception("database unavailable")
+        unavailable.get.side_effect = Exception("database unavailable")
+        with patch('app.events.SessionLocal', return_value=unavailable):
+            assert subscriber._drain_journal_once() is False
+        assert subscriber.stats()["journal_pending_bytes"] > 0
+        
+        subscriber._dispatch([envelope(3, "outage-c")])
+        with patch('app.events.SessionLocal', TestingSessionLocal):
+            assert subscriber._drain_journal_once() is True
+            assert subscriber._drain_journal_once() is None
+        assert subscriber.stats()["journal_pending_bytes"] == 0
+        
+        db = TestingSessionLocal()
+        assert sorted(t.team_id for t in db.query(TournamentTeam).all()) == ["outage-a", "outage-b", "outage-c"]
+        db.close()
+        
+        subscriber.journal.close()
+        subscriber.socket.close()
+        subscriber.context.term()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+def test_failed_journaled_write_refetches_only_filled_gaps(tmp_path):
+    """Test a journaled batch that fails to write is retried from the journal, refetching just its gap"""
+    from app.journal import EventJournal
+    
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        db.add(Tournament(id=1, name="Default Tournament"))
+        db.commit()
+        db.close()
+        
+        subscriber = EventSubscriber(journal=EventJournal(str(tmp_path), fsync_interval_ms=0))
+        subscriber.last_sequence = 1
+        subscriber._dispatch([envelope(2, "retry-b"), envelope(5, "retry-e")])
+        pages = Mock(side_effect=lambda after, before: iter([[logged_event(3, "retry-c"), logged_event(4, "retry-d")]]))
+        
+        unavailable = Mock()
+        unavailable.execute.side_effect = Exception("database unavailable")
+        with patch.object(subscriber, '_event_pages', pages), \
+                patch('app.events.TEAM_SERVICE_URL', "http://team-service:8000"):
+            with patch('app.events.SessionLocal', return_value=unavailable):
+                assert subscriber._drain_journal_once() is False
+                assert subscriber._drain_journal_once() is False
+            assert subscriber._gaps == [(2, 5)]
+            
+            with patch('app.events.SessionLocal', TestingSessionLocal):
+                assert subscriber._drain_journal_once() is True
+        
+        assert pages.call_count == 3
+        assert subscriber.stats()["pending_gaps"] == 0
+        db = TestingSessionLocal()
+        assert sorted(t.team_id for t in db.query(TournamentTeam).all()) == ["retry-b", "retry-c", "retry-d", "retry-e"]
+        assert db.get(EventOffset, "team-service").sequence == 5
+        db.close()
+        
+        subscriber.journal.close()
+        subscriber.socket.close()
+        subscriber.context.term()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+def test_failed_writes_queue_one_refetch():
+    """Test repeated failed writes without a journal keep a single refetch range"""
+    subscriber = EventSubscriber()
+    subscriber.last_sequence = 1
+    unavailable = Mock()
+    unavailable.execute.side_effect = Exception("database unavailable")
+    
+    with patch('app.events.SessionLocal', return_value=unavailable), patch('app.events.TEAM_SERVICE_URL', ""):
+        assert subscriber._handle_batch([envelope(2, "lost-b")]) is False
+        assert subscriber._handle_batch([envelope(3, "lost-c")]) is False
+        assert subscriber._handle_batch([envelope(3, "lost-c")]) is False
+    
+    # The wider range replaces the one it contains
+    assert subscriber._gaps == [(0, 4)]
+    
+    subscriber.socket.close()
+    subscriber.context.term()
+
+def test_failing_journaled_batch_is_split_and_its_bad_record_set_aside(tmp_path):
+    """Test a batch that keeps failing is halved until the one bad record is moved to the dead-letter file"""
+    import os
+    from app.events import record_tournament_team_digests
+    from app.journal import DEAD_LETTER_FILE, EventJournal
+    
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        db.add(Tournament(id=1, name="Default Tournament"))
+        db.commit()
+        db.close()
+        
+        subscriber = EventSubscriber(journal=EventJournal(str(tmp_path), fsync_interval_ms=0))
+        subscriber.last_sequence = 0
+        subscriber.drain_batch_size = 4
+        poison = envelope(3, "poison-c")
+        subscriber._dispatch([envelope(1, "good-a"), envelope(2, "good-b"), poison, envelope(4, "good-d")])
+        
+        def record_digests(db, inserted):
+            inserted = list(inserted)
+            if any(team_id == "poison-c" for _, team_id in inserted):
+                raise ValueError("value out of range")
+            record_tournament_team_digests(db, inserted)
+        
+        unavailable = Mock()
+        unavailable.execute.side_effect = Exception("database unavailable")
+        with patch('app.events.EVENT_JOURNAL_MAX_ATTEMPTS', 2), patch('app.events.TEAM_SERVICE_URL', ""), \
+                patch('app.events.record_tournament_team_digests', side_effect=record_digests):
+            # An outage fails every batch alike, so it is waited out at full size
+            with patch('app.events.SessionLocal', return_value=unavailable):
+                for _ in range(2):
+                    assert subscriber._drain_journal_once() is False
+            assert subscriber.drain_batch_size == 4
+            
+            with patch('app.events.SessionLocal', TestingSessionLocal):
+                results = [subscriber._drain_journal_once() for _ in range(9)]
+        
+        # 4 fails twice, 2 succeeds, 2 fails twice, the poison record fails twice and is set aside, 1 succeeds
+        assert results == [False, False, True, False, False, False, False, True, None]
+        assert subscriber.stats()["journal_dead_letters"] == 1
+        assert subscriber.stats()["journal_pending_bytes"] == 0
+        with open(os.path.join(str(tmp_path), DEAD_LETTER_FILE), "rb") as f:
+            assert msgpack.unpackb(f.read()[8:]) == poison
+        db = TestingSessionLocal()
+        assert sorted(t.team_id for t in db.query(TournamentTeam).all()) == ["good-a", "good-b", "good-d"]
+        db.close()
+        
+        subscriber.journal.close()
+        subscriber.socket.close()
+        subscriber.context.term()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+def test_journal_writer_survives_unexpected_errors(tmp_path):
+    """Test an exception while draining the journal is logged and retried instead of ending the thread"""
+    from app.journal import EventJournal
+    
+    subscriber = EventSubscriber(journal=EventJournal(str(tmp_path), fsync_interval_ms=0))
+    subscriber.running = True
+    
+    def drain_once():
+        if drain.call_count == 1:
+            raise ValueError("corrupt record")
+        subscriber.running = False
+        return None
+    
+    drain = Mock(side_effect=drain_once)
+    with patch.object(subscriber, '_catch_up'), patch.object(subscriber, '_drain_journal_once', drain):
+        subscriber._drain_journal()
+    
+    assert drain.call_count == 2
+    
+    subscriber.journal.close()
+    subscriber.socket.close()
+    subscriber.context.term()
+
+def test_consumed_events_change_tournament_teams_etag(client):
+    """Test a conditional GET stays 304 until the subscriber applies new registrations"""
+    response = client.get("/tournament-teams")
+    etag = response.headers["ETag"]
+    assert client.get("/tournament-teams", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+    
+    subscriber = EventSubscriber(batch_size=10, flush_interval_ms=0)
+    try:
+        event = json.dumps({"event": "TeamRegistered", "payload": {"teamId": "etag-team", "name": "ETag FC"}})
+        with patch('app.events.SessionLocal', TestingSessionLocal):
+            subscriber._handle_batch([event])
+    finally:
+        subscriber.socket.close()
+        subscriber.context.term()
+    
+    response = client.get("/tournament-teams", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert [t["team_id"] for t in response.json()] == ["etag-team"]
+    
+    # Rosters embedded in the tournament list depend on the same counter
+    tournaments = client.get("/tournaments")
+    assert client.get("/tournaments", headers={"If-None-Match": tournaments.headers["ETag"]}).status_code == 304
+
+def test_collection_versions_notice_other_workers_writes():
+    """Test a positive staleness bound re-reads the high-water mark written by other processes"""
+    from app.versions import CollectionVersions
+    
+    marks = iter([5, 5, 6])
+    versions = CollectionVersions(max_staleness=0.01)
+    versions.register_watermark("tournament_teams", lambda: next(marks))
+    
+    versions.refresh(["tournament_teams"])
+    first = versions.etag("tournament_teams")
+    versions.refresh(["tournament_teams"])
+    assert versions.etag("tournament_teams") == first
+    
+    time.sleep(0.02)
+    assert versions.needs_refresh(["tournament_teams"])
+    versions.refresh(["tournament_teams"])
+    assert versions.etag("tournament_teams") != first
+
+def test_tournaments_etag_notices_other_process_writes(client):
+    """Test a tournament created by another worker process invalidates this worker's ETag within the staleness bound"""
+    import os
+    import sys
+    import subprocess
+    from sqlalchemy import func
+    from app.versions import CollectionVersions, _watermark
+    
+    other_worker = (
+        "from sqlalchemy import create_engine\n"
+        "from sqlalchemy.orm import Session\n"
+        "from app.models import Tournament\n"
+        "with Session(create_engine('sqlite:///./test.db')) as db:\n"
+        "    db.add(Tournament(name='Other Worker Cup'))\n"
+        "    db.commit()\n"
+    )
+    service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    
+    # Fresh counters: ids restart with the recreated tables, so a mark seen by an earlier test could repeat
+    versions = CollectionVersions(max_staleness=0.05)
+    versions.register_watermark("tournaments", _watermark(func.count(Tournament.id), func.max(Tournament.id)))
+    versions.register_watermark("tournament_teams", _watermark(func.count(TournamentTeam.id), func.max(TournamentTeam.id)))
+    with patch('app.versions.SessionLocal', TestingSessionLocal), patch('app.versions.collection_versions', versions):
+        etag = client.get("/tournaments").headers["ETag"]
+        assert client.get("/tournaments", headers={"If-None-Match": etag}).status_code == 304
+        
+        subprocess.run([sys.executable, "-c", other_worker], check=True, env={**os.environ, "PYTHONPATH": service_dir})
+        time.sleep(0.1)
+        
+        response = client.get("/tournaments", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert "Other Worker Cup" in [t["name"] for t in response.json()]
+
+def test_list_fast_path_matches_model_serialization(client):
+    """Test the Core/orjson list bodies are identical to the ORM and pydantic rendering they replace"""
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from sqlalchemy.orm import selectinload
+    from app.schemas import TournamentResponse
+    
+    seed_tournaments(2, 3)
+    db = TestingSessionLocal()
+    try:
+        tournaments = db.query(Tournament).options(selectinload(Tournament.teams)).order_by(Tournament.id).all()
+        expected = [TournamentResponse.model_validate(t) for t in tournaments]
+        assert client.get("/tournaments").content == JSONResponse(jsonable_encoder(expected)).body
+        
+        teams = [team.to_dict() for team in db.query(TournamentTeam).order_by(TournamentTeam.id)]
+        assert client.get("/tournament-teams").content == JSONResponse(teams).body
+    finally:
+        db.close()
+
+def test_tournament_team_changes_feed(client):
+    """Test the change feed pages through registrations after a token"""
+    seed_tournaments(1, 3)
+    
+    first = client.get("/tournament-teams/changes", params={"limit": 2}).json()
+    assert [t["team_id"] for t in first["items"]] == ["team-0-0", "team-0-1"]
+    assert first["has_more"] is True
+    
+    second = client.get("/tournament-teams/changes", params={"since": first["token"]}).json()
+    assert [t["team_id"] for t in second["items"]] == ["team-0-2"]
+    assert second["has_more"] is False
+    # Same entries as the full list
+    assert first["items"] + second["items"] == client.get("/tournament-teams").json()
+
+def test_subscriber_takes_the_change_feed_lock_for_slow_batches():
+    """Test the subscriber locks the change feed before inserting, and a slow batch still commits"""
+    from app.changes import lock_change_feed
+    from app.events import insert_tournament_teams_statement
+    
+    Base.metadata.create_all(bind=engine)
+    
+    try:
+        db = TestingSessionLocal()
+        db.add(Tournament(id=1, name="Default Tournament"))
+        db.commit()
+        db.close()
+        
+        subscriber = EventSubscriber()
+        subscriber.last_sequence = 0
+        
+        def slow_statement(dialect_name):
+            time.sleep(0.15)
+            return insert_tournament_teams_statement(dialect_name)
+        
+        lock = Mock(side_effect=lock_change_feed)
+        with patch('app.events.SessionLocal', TestingSessionLocal), patch('app.events.lock_change_feed', lock), \
+                patch('app.events.insert_tournament_teams_statement', side_effect=slow_statement):
+            assert subscriber._insert_tournament_teams([
+                {"tournament_id": 1, "team_id": "slow-team", "team_name": "Slow FC"}
+            ]) is True
+        
+        assert lock.call_args.args[1] == "tournament_teams"
+        db = TestingSessionLocal()
+        assert db.query(TournamentTeam).count() == 1
+        db.close()
+        
+        subscriber.socket.close()
+        subscriber.context.term()
+    finally:
+        Base.metadata.drop_all(bind=engine)
+
+@pytest.mark.asyncio
+async def test_applied_registrations_are_pushed_to_stream_clients():
+    """Test registrations reach stream clients once the subscriber has committed them"""
+    from app.stream import get_broadcaster
+    
+    Base.metadata.create_all(bind=engine)
+    broadcaster = get_broadcaster()
+    broadcaster.attach(asyncio.get_running_loop())
+    client = broadcaster.subscribe()
+    subscriber = EventSubscriber(batch_size=10, flush_interval_ms=0)
+    
+    try:
+        event = json.dumps({"event": "TeamRegistered", "payload": {"teamId": "stream-team", "name": "Stream FC"}})
+        with patch('app.events.SessionLocal', TestingSessionLocal):
+            subscriber._handle_batch([event])
+        
+        message = await asyncio.wait_for(client.queue.get(), 1)
+        assert message.startswith("event: TournamentTeamRegistered\n")
+        assert json.loads(message.split("data: ", 1)[1]) == {
+            "tournament_id": 1, "team_id": "stream-team", "team_name": "Stream FC"
+        }
+    finally:
+        broadcaster.unsubscribe(client)
+        subscriber.socket.close()
+        subscriber.context.term()
+        Base.metadata.drop_all(bind=engine)
+
+def test_subscriber_metrics_count_batches_and_errors(client):
+    """Test consume counts, batch latency and decode errors show up on /metrics"""
+    from app.events import EVENT_BATCH_SECONDS, EVENT_HANDLER_ERRORS, EVENTS_CONSUMED
+    
+    consumed, batches = EVENTS_CONSUMED.value(), EVENT_BATCH_SECONDS.count()
+    decode_errors = EVENT_HANDLER_ERRORS.value(("decode",))
+    subscriber = EventSubscriber(batch_size=10, flush_interval_ms=0)
+    try:
+        event = json.dumps({"event": "TeamRegistered", "payload": {"teamId": "metrics-team", "name": "Metrics FC"}})
+        with patch('app.events.SessionLocal', TestingSessionLocal):
+            subscriber._handle_batch([event, "not json"])
+    finally:
+        subscriber.socket.close()
+        subscriber.context.term()
+    
+    assert EVENTS_CONSUMED.value() == consumed + 2
+    assert EVENT_BATCH_SECONDS.count() == batches + 1
+    assert EVENT_HANDLER_ERRORS.value(("decode",)) == decode_errors + 1
+    
+    body = client.get("/metrics").text
+    assert 'event_handler_errors_total{stage="decode"}' in body
+    assert "# TYPE event_batch_duration_seconds histogram" in body
+    assert "event_checkpoint_sequence" in body
+
+def test_lag_sketch_percentiles_stay_within_bucket_precision():
+    """Test the rolling sketch answers percentiles to within a few percent"""
+    from app.lag import LagSketch
+    
+    sketch = LagSketch(window_seconds=60)
+    sketch.record(i / 1000 for i in range(1, 10001))
+    
+    assert sketch.percentile(0.5) == pytest.approx(5.0, rel=0.03)
+    assert sketch.percentile(0.99) == pytest.approx(9.9, rel=0.03)
+    snapshot = sketch.snapshot()
+    assert snapshot["count"] == 10000
+    assert sum(count for _, _, count in snapshot["buckets"]) == 10000
+    assert LagSketch(window_seconds=60).percentile(0.99) is None
+
+def test_subscriber_reports_publish_to_commit_lag(client, caplog):
+    """Test committed events are measured from their envelope timestamp and a high p99 is logged"""
+    Base.metadata.create_all(bind=engine)
+    subscriber = EventSubscriber(batch_size=10, flush_interval_ms=0)
+    subscriber.last_sequence = 0
+    published_us = int((time.time() - 2) * 1_000_000)
+    message = [
+        b"TeamRegistered/000",
+        ENVELOPE_HEADER.pack(ENVELOPE_VERSION, 1, published_us),
+        msgpack.packb({"teamId": "lag-team", "name": "Lag FC"}),
+    ]
+    
+    try:
+        with patch('app.events.SessionLocal', TestingSessionLocal), patch('app.events._subscriber', subscriber):
+            subscriber._handle_batch([message])
+            stats = client.get("/subscriber/lag").json()
+    finally:
+        subscriber.socket.close()
+        subscriber.context.term()
+        Base.metadata.drop_all(bind=engine)
+    
+    assert stats["count"] == 1
+    assert 1900 < stats["p99_ms"] < 2200
+    assert stats["backlog"] == {"sequences_behind": 0, "pending_gaps": 0, "journal_pending_bytes": 0}
+    assert stats["alerting"] is True
+    assert "p99 event lag is" in caplog.text
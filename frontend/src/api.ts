@@ -1,4 +1,4 @@
-import { Team, Tournament } from "./types";
+import { Team, TeamChanges, Tournament } from "./types";
 
 const TEAM_SERVICE_URL =
   (import.meta as any).env.VITE_TEAM_SERVICE_URL || "http://localhost:8001";
@@ -33,6 +33,38 @@ export const teamApi = {
 
     return response.json();
   },
+
+  async getTeamChanges(since: number): Promise<TeamChanges> {
+    const response = await fetch(
+      `${TEAM_SERVICE_URL}/teams/changes?since=${since}`
+    );
+
+    if (!response.ok) {
+      throw new Error("Failed to fetch teams");
+    }
+
+    return response.json();
+  },
+
+  // Calls onTeam with each registered team as it is pushed, and onResync whenever pushes may
+  // have been missed; returns a function that closes the stream
+  subscribeToTeams(
+    onTeam: (team: Team) => void,
+    onResync: () => void
+  ): () => void {
+    if (typeof EventSource === "undefined") {
+      return () => {};
+    }
+    const source = new EventSource(`${TEAM_SERVICE_URL}/stream/teams`);
+    source.addEventListener("TeamRegistered", (event) => {
+      onTeam(JSON.parse((event as MessageEvent).data));
+    });
+    // Sent when this tab fell too far behind; the change feed fills the gap
+    source.addEventListener("resync", onResync);
+    // Every (re)connect, since nothing is pushed while the stream is down
+    source.addEventListener("open", onResync);
+    return () => source.close();
+  },
 };
 
 // Tournament API
@@ -1,8 +1,9 @@
 import React, { useState } from 'react'
 import { teamApi } from '../api'
+import { Team } from '../types'
 
 interface TeamFormProps {
-  onTeamCreated: () => void
+  onTeamCreated: (team: Team) => void
 }
 
 export default function TeamForm({ onTeamCreated }: TeamFormProps) {
@@ -22,9 +23,9 @@ export default function TeamForm({ onTeamCreated }: TeamFormProps) {
     setError('')
 
     try {
-      await teamApi.createTeam(name.trim())
+      const team = await teamApi.createTeam(name.trim())
       setName('')
-      onTeamCreated()
+      onTeamCreated(team)
     } catch (err) {
       setError(err instanceof Error ? err.message : 'Failed to create team')
     } finally {
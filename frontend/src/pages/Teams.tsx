@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import TeamForm from "../components/TeamForm";
 import { teamApi } from "../api";
 import { Team } from "../types";
@@ -7,11 +7,27 @@ export default function Teams() {
   const [teams, setTeams] = useState<Team[]>([]);
   const [isLoading, setIsLoading] = useState(true);
   const [error, setError] = useState("");
+  // Change feed position, so resyncs only fetch teams registered since the last one
+  const token = useRef(0);
+  const sync = useRef<Promise<void>>(Promise.resolve());
+  const queued = useRef(false);
 
-  const loadTeams = async () => {
+  const mergeTeams = (incoming: Team[]) => {
+    // Recent changes can be delivered twice, so merge by id
+    setTeams((current) => {
+      const known = new Set(current.map((team) => team.id));
+      return [...current, ...incoming.filter((team) => !known.has(team.id))];
+    });
+  };
+
+  const fetchChanges = async () => {
     try {
-      const data = await teamApi.getTeams();
-      setTeams(data);
+      let changes;
+      do {
+        changes = await teamApi.getTeamChanges(token.current);
+        token.current = changes.token;
+        mergeTeams(changes.items);
+      } while (changes.has_more);
       setError("");
     } catch (err) {
       setError(err instanceof Error ? err.message : "Failed to load teams");
@@ -20,12 +36,35 @@ export default function Teams() {
     }
   };
 
+  const loadTeams = () => {
+    // Resyncs arriving while a fetch runs collapse into one fetch queued behind it
+    if (!queued.current) {
+      queued.current = true;
+      sync.current = sync.current.then(() => {
+        queued.current = false;
+        return fetchChanges();
+      });
+    }
+    return sync.current;
+  };
+
+  const handleTeamPushed = (team: Team) => {
+    // Pushed rows are complete; only events from an older team-service lack the id
+    if (team.id == null) {
+      loadTeams();
+    } else {
+      mergeTeams([team]);
+    }
+  };
+
   useEffect(() => {
     loadTeams();
+    return teamApi.subscribeToTeams(handleTeamPushed, loadTeams);
   }, []);
 
-  const handleTeamCreated = () => {
-    loadTeams();
+  const handleTeamCreated = (team: Team) => {
+    // Append the created team instead of reloading the whole list
+    mergeTeams([team]);
   };
 
   if (isLoading) {
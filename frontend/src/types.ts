@@ -5,6 +5,12 @@ export interface Team {
   created_at?: string
 }
 
+export interface TeamChanges {
+  items: Team[]
+  token: number
+  has_more: boolean
+}
+
 export interface Tournament {
   id: number
   tournament_id: string